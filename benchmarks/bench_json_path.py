@@ -0,0 +1,118 @@
+"""Micro-benchmark: per-field visit_path vs. the compiled PathMatcher
+
+Builds a synthetic `apolloState` with a configurable number of entries
+(Goodreads pages easily carry hundreds of Review/User/Genre objects next to
+the single Book we care about) and extracts every BookItem path, enabled
+or not, both ways.
+
+    python benchmarks/bench_json_path.py --entries 5000
+"""
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "goodreads_to_kindle"))
+
+from goodreads_scraper.items import visit_path  # noqa: E402
+from goodreads_scraper.json_path import PathMatcher  # noqa: E402
+
+PREFIX = "props.pageProps.apolloState."
+
+PATHS = {
+    "title": PREFIX + "Book*.title",
+    "titleComplete": PREFIX + "Book*.titleComplete",
+    "description": PREFIX + "Book*.description",
+    "imageUrl": PREFIX + "Book*.imageUrl",
+    "genres": PREFIX + "Book*.bookGenres[].genre.name",
+    "asin": PREFIX + "Book*.details.asin",
+    "isbn": PREFIX + "Book*.details.isbn",
+    "isbn13": PREFIX + "Book*.details.isbn13",
+    "publisher": PREFIX + "Book*.details.publisher",
+    "publishDate": PREFIX + "Book*.details.publicationTime",
+    "series": PREFIX + "Series*.title",
+    "author": PREFIX + "Contributor*.name",
+    "places": PREFIX + "Work*.details.places[].name",
+    "characters": PREFIX + "Work*.details.characters[].name",
+    "awards": PREFIX + "Work*.details.awardsWon[].[name,awardedAt,category,hasWon]",
+    "ratingsCount": PREFIX + "Work*.stats.ratingsCount",
+    "reviewsCount": PREFIX + "Work*.stats.textReviewsCount",
+    "avgRating": PREFIX + "Work*.stats.averageRating",
+    "ratingHistogram": PREFIX + "Work*.stats.ratingsCountDist",
+    "numPages": PREFIX + "Book*.details.numPages",
+    "language": PREFIX + "Book*.details.language.name",
+    "format": PREFIX + "Book*.details.format",
+}
+
+
+def make_document(entries: int) -> dict:
+    state = {
+        "Book:kca://book/1": {
+            "title": "Dune",
+            "titleComplete": "Dune (Dune, #1)",
+            "description": "<b>Set on the desert planet Arrakis</b>",
+            "imageUrl": "https://images.gr-assets.com/books/1.jpg",
+            "bookGenres": [{"genre": {"name": f"Genre {i}"}} for i in range(10)],
+            "details": {
+                "asin": "B00B7NPRY8",
+                "isbn": "0441013597",
+                "isbn13": "9780441013593",
+                "publisher": "Ace",
+                "publicationTime": 1033974000000,
+                "numPages": 604,
+                "format": "Paperback",
+                "language": {"name": "English"},
+            },
+        },
+        "Work:kca://work/1": {
+            "details": {
+                "places": [{"name": f"Place {i}"} for i in range(5)],
+                "characters": [{"name": f"Character {i}"} for i in range(20)],
+                "awardsWon": [
+                    {"name": f"Award {i}", "awardedAt": 0, "category": "Novel", "hasWon": True}
+                    for i in range(5)
+                ],
+            },
+            "stats": {
+                "ratingsCount": 1500000,
+                "textReviewsCount": 60000,
+                "averageRating": 4.27,
+                "ratingsCountDist": [1, 2, 3, 4, 5],
+            },
+        },
+        "Series:kca://series/1": {"title": "Dune"},
+    }
+    for i in range(3):
+        state[f"Contributor:kca://author/{i}"] = {"name": f"Author {i}"}
+    for i in range(entries):
+        state[f"Review:kca://review/{i}"] = {"text": "great book " * 10, "rating": i % 5}
+        state[f"User:kca://user/{i}"] = {"name": f"User {i}", "followersCount": i}
+    return {"props": {"pageProps": {"apolloState": state}}}
+
+
+def per_field(document: dict) -> dict:
+    return {field: list(visit_path(document, key, key)) for field, key in PATHS.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=2000, help="number of Review/User pairs in apolloState")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+
+    document = make_document(args.entries)
+    matcher = PathMatcher(PATHS)
+    assert matcher.match(document) == per_field(document), "PathMatcher and visit_path disagree"
+
+    baseline = min(timeit.repeat(lambda: per_field(document), repeat=args.repeat, number=args.number))
+    compiled = min(timeit.repeat(lambda: matcher.match(document), repeat=args.repeat, number=args.number))
+
+    print(f"apolloState keys: {len(document['props']['pageProps']['apolloState'])}, fields: {len(PATHS)}")
+    print(f"visit_path per field: {baseline / args.number * 1000:.3f} ms/page")
+    print(f"PathMatcher.match:    {compiled / args.number * 1000:.3f} ms/page")
+    print(f"speedup: {baseline / compiled:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
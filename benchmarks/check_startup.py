@@ -0,0 +1,105 @@
+"""Check the startup cost of a run with nothing to do
+
+Runs main() with no users under `python -X importtime`, in a temporary
+directory and with placeholder settings, then fails if any of the heavy
+subsystems got imported or if the imports took longer than the budget.
+
+    python benchmarks/check_startup.py --budget-ms 500
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+APP_DIR = Path(__file__).parent.parent / "goodreads_to_kindle"
+
+# only the stages that need them may import these
+HEAVY_MODULES = ["scrapy", "twisted", "zlibrary", "requests", "aiohttp", "PIL", "smtplib", "dataclasses_json"]
+
+# slow imports a no-op run can't do without, shown apart with the reason
+EXPECTED_MODULES = {
+    # the settings are what tells whether there is anything to do
+    "pydantic_settings": "reads the settings, needed by every run",
+}
+
+NO_OP_RUN = """
+import asyncio
+from pathlib import Path
+import main
+
+main.DATA_FOLDER = Path({data_dir!r})
+asyncio.run(main.main())
+"""
+
+PLACEHOLDER_SETTINGS = {
+    "EMAIL_PASSWORD": "",
+    "EMAIL_SMTP_PORT": "25",
+    "EMAIL_SMTP": "localhost",
+    "EMAIL_USER": "startup-check@example.com",
+    "RAPID_API_KEY": "",
+    "ZLIB_EMAIL": "",
+    "ZLIB_PASSWORD": "",
+}
+
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def run_no_op() -> list[tuple[str, int, int]]:
+    """Return (module, cumulative us, nesting level) of every import of a no-op run"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = Path(tmp_dir) / "data"
+        (data_dir / "users").mkdir(parents=True)
+        env = {**os.environ, **PLACEHOLDER_SETTINGS, "PYTHONPATH": str(APP_DIR)}
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", NO_OP_RUN.format(data_dir=str(data_dir))],
+            cwd=tmp_dir, env=env, capture_output=True, text=True,
+        )
+    if process.returncode != 0:
+        sys.exit(f"The no-op run failed:\n{process.stderr[-3000:]}")
+
+    imports = []
+    for line in process.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            _, cumulative, indent, module = match.groups()
+            imports.append((module, int(cumulative), (len(indent) - 1) // 2))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=500, help="total import time allowed")
+    parser.add_argument("--top", type=int, default=10, help="how many of the slowest imports to show")
+    args = parser.parse_args()
+
+    imports = run_no_op()
+    top_level = [(module, cumulative) for module, cumulative, level in imports if level == 0]
+    total_ms = sum(cumulative for _, cumulative in top_level) / 1000
+
+    print("Slowest top level imports of a no-op run:")
+    for module, cumulative in sorted(top_level, key=lambda entry: -entry[1])[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {module}")
+    print(f"Total: {total_ms:.1f} ms, budget {args.budget_ms:.0f} ms")
+
+    cumulative_by_module = {module: cumulative for module, cumulative, _ in imports}
+    for module, reason in EXPECTED_MODULES.items():
+        if module in cumulative_by_module:
+            print(f"  of which {cumulative_by_module[module] / 1000:.1f} ms  {module}: {reason}")
+
+    imported = set(cumulative_by_module)
+    heavy = [module for module in HEAVY_MODULES if module in imported]
+    failures = []
+    if heavy:
+        failures.append(f"heavy modules imported: {', '.join(heavy)}")
+    if total_ms > args.budget_ms:
+        failures.append(f"imports took {total_ms:.1f} ms, over the {args.budget_ms:.0f} ms budget")
+    if failures:
+        sys.exit("FAILED: " + "; ".join(failures))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Write the page fixtures used by the benchmark suite
+
+The fixtures have the shape of real Goodreads pages: a "My Books" shelf
+list page, and /book/show/ pages whose `__NEXT_DATA__` apolloState carries
+a growing number of Review/User objects next to the book. They are
+generated, not recorded, so they can be checked in and rebuilt at will.
+
+    python benchmarks/make_fixtures.py
+"""
+import gzip
+import json
+from pathlib import Path
+
+from bench_json_path import make_document
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+# name -> number of Review/User pairs in apolloState
+BOOK_PAGES = {
+    "book_small": 20,
+    "book_medium": 500,
+    "book_large": 5000,
+}
+
+SHELF_BOOKS = 30
+
+BOOK_PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>Dune (Dune, #1) by Frank Herbert | Goodreads</title>
+<link rel="canonical" href="https://www.goodreads.com/book/show/44767458-dune">
+</head>
+<body>
+<div id="__next"><div class="PageFrame PageFrame--siteHeaderBanner">
+<main class="PageFrame__main"><div class="BookPage">
+<h1 class="Text Text__title1" data-testid="bookTitle">Dune</h1>
+</div></main></div></div>
+<script id="__NEXT_DATA__" type="application/json">{next_data}</script>
+<script src="/_next/static/chunks/main.js" async=""></script>
+</body>
+</html>
+"""
+
+SHELF_ROW = """<tr id="review_{id}" class="bookalike review">
+<td class="field cover"><div class="value"><a href="/book/show/{id}-book-{id}"><img src="https://i.gr-assets.com/images/{id}.jpg" alt="Book {id}"></a></div></td>
+<td class="field title"><label>title</label><div class="value"><a title="Book {id}" href="/book/show/{id}-book-{id}">Book {id}</a></div></td>
+<td class="field author"><label>author</label><div class="value"><a href="/author/show/{id}.Author_{id}">Author, {id}</a></div></td>
+<td class="field avg_rating"><label>avg rating</label><div class="value">4.{rating}</div></td>
+<td class="field date_added"><label>date added</label><div class="value"><span title="January 1, 2024">Jan 01, 2024</span></div></td>
+</tr>
+"""
+
+SHELF_PAGE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>User's books on Goodreads</title></head>
+<body>
+<div id="leftCol" class="reviewListLeft"><h1>User &gt; to-read</h1></div>
+<table id="books" class="table stacked" border="0">
+<thead><tr id="booksHeader" class="tableList"><th>cover</th><th>title</th><th>author</th><th>avg rating</th><th>date added</th></tr></thead>
+<tbody id="booksBody">
+{rows}</tbody>
+</table>
+<div id="reviewPagination"><em class="current">1</em> <a href="/review/list/1?page=2&amp;shelf=to-read">2</a> <a class="next_page" rel="next" href="/review/list/1?page=2&amp;shelf=to-read">next &raquo;</a></div>
+</body>
+</html>
+"""
+
+
+def write(name: str, content: str) -> None:
+    path = FIXTURES_DIR / f"{name}.html.gz"
+    # mtime=0 so that regenerating gives the same bytes
+    path.write_bytes(gzip.compress(content.encode(), mtime=0))
+    print(f"{path.name}: {len(content) / 1024:.0f} KiB")
+
+
+def main():
+    FIXTURES_DIR.mkdir(exist_ok=True)
+    for name, entries in BOOK_PAGES.items():
+        next_data = {"buildId": "fixture", "page": "/book/show/[book_id]", **make_document(entries)}
+        write(name, BOOK_PAGE.format(next_data=json.dumps(next_data)))
+    rows = "".join(SHELF_ROW.format(id=1000 + i, rating=i % 10) for i in range(SHELF_BOOKS))
+    write("shelf_page", SHELF_PAGE.format(rows=rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Offline benchmark suite for the hot paths
+
+Everything runs against the fixtures in benchmarks/fixtures (see
+make_fixtures.py) and temporary files, nothing touches the network.
+
+    python benchmarks/run.py --output baseline.json
+    python benchmarks/run.py --compare baseline.json
+
+With --compare, every benchmark slower than the baseline by more than
+--threshold is reported as a regression and the exit status is 1.
+Baselines only make sense on the machine they were recorded on.
+"""
+import argparse
+import gzip
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+BENCHMARKS_DIR = Path(__file__).parent
+FIXTURES_DIR = BENCHMARKS_DIR / "fixtures"
+sys.path.insert(0, str(BENCHMARKS_DIR.parent / "goodreads_to_kindle"))
+
+from scrapy.http import HtmlResponse, Request  # noqa: E402
+
+from bench_json_path import PATHS  # noqa: E402
+from goodreads_scraper.items import extract_next_data, visit_path  # noqa: E402
+from goodreads_scraper.spiders.book_spider import BookSpider  # noqa: E402
+from goodreads_scraper.spiders.mybooks_spider import MyBooksSpider  # noqa: E402
+from mail import EmailManager  # noqa: E402
+from models import GoodReadsBook, User  # noqa: E402
+from repository import JsonRepository  # noqa: E402
+
+# name -> function returning (operations per call, call)
+BENCHMARKS: dict[str, Callable[[Path], tuple[int, Callable[[], object]]]] = {}
+
+
+def benchmark(name: str):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def fixture_response(name: str, url: str) -> HtmlResponse:
+    body = gzip.decompress((FIXTURES_DIR / f"{name}.html.gz").read_bytes())
+    return HtmlResponse(url=url, body=body, encoding="utf-8", request=Request(url))
+
+
+def book_parse(fixture: str):
+    def setup(tmp_dir: Path):
+        response = fixture_response(fixture, "https://www.goodreads.com/book/show/44767458-dune")
+        spider = BookSpider()
+        return 1, lambda: list(spider.parse(response))
+    return setup
+
+
+for _fixture in ("book_small", "book_medium", "book_large"):
+    benchmark(f"book_parse[{_fixture}]")(book_parse(_fixture))
+
+
+@benchmark("shelf_parse")
+def shelf_parse(tmp_dir: Path):
+    response = fixture_response("shelf_page", "https://www.goodreads.com/review/list/1?shelf=to-read")
+    spider = MyBooksSpider(user_id="1", shelf="to-read")
+    requests = list(spider.parse(response))
+    return len(requests), lambda: list(spider.parse(response))
+
+
+@benchmark("visit_path[book_large]")
+def visit_path_large(tmp_dir: Path):
+    response = fixture_response("book_large", "https://www.goodreads.com/book/show/44767458-dune")
+    document = extract_next_data(response)
+    return len(PATHS), lambda: [list(visit_path(document, key, key)) for key in PATHS.values()]
+
+
+def json_repository(tmp_dir: Path) -> JsonRepository:
+    (tmp_dir / JsonRepository.USERS_PATH).mkdir()
+    return JsonRepository(workdir=tmp_dir)
+
+
+def sent_books(count: int) -> list[GoodReadsBook]:
+    return [
+        GoodReadsBook(authors=[f"Author {i % 97}"], isbn=None, isbn13=f"978{i:010d}", language="English", title=f"Book {i}")
+        for i in range(count)
+    ]
+
+
+@benchmark("json_repository_list_users")
+def json_repository_list_users(tmp_dir: Path):
+    repository = json_repository(tmp_dir)
+    books = sent_books(1000)
+    for i in range(5):
+        repository.update_user(User(goodreads_id=f"user{i}", kindle_email=f"user{i}@kindle.com", books_sent_to_kindle=list(books)))
+    return 5, repository.list_users
+
+
+@benchmark("json_repository_update_user")
+def json_repository_update_user(tmp_dir: Path):
+    repository = json_repository(tmp_dir)
+    user = User(goodreads_id="user", kindle_email="user@kindle.com", books_sent_to_kindle=sent_books(2000))
+    return 1, lambda: repository.update_user(user)
+
+
+@benchmark("mime_message[20MiB]")
+def mime_message(tmp_dir: Path):
+    attachment = tmp_dir / "book.epub"
+    with open(attachment, "wb") as file:
+        for i in range(20):
+            file.write(bytes(range(256)) * 4096)
+    manager = EmailManager("localhost", 25, "me@example.com", "")
+
+    def build():
+        skeleton, markers = manager._skeleton(["user@kindle.com"], "Book", "Your book", ["book.epub"])
+        return sum(len(chunk) for chunk in manager._message_chunks(skeleton, markers, [str(attachment)]))
+    return 1, build
+
+
+def measure(call: Callable[[], object], min_time: float, repeat: int) -> list[float]:
+    """Time `repeat` rounds of as many calls as fit in `min_time`, return seconds per call"""
+    call()  # warm up
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            call()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            call()
+        timings.append((time.perf_counter() - start) / number)
+    return timings
+
+
+def run(selected: list[str], min_time: float, repeat: int) -> dict:
+    results = {}
+    for name in selected:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            ops, call = BENCHMARKS[name](Path(tmp_dir))
+            timings = measure(call, min_time, repeat)
+        best = min(timings)
+        results[name] = {
+            "ops_per_call": ops,
+            "best_s": best,
+            "median_s": statistics.median(timings),
+            "ops_per_s": ops / best,
+        }
+        print(f"{name:32} {best * 1000:10.3f} ms  {ops / best:14.1f} ops/s")
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Return the benchmarks slower than in the baseline by more than `threshold`"""
+    regressions = []
+    print(f"\n{'benchmark':32} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["best_s"], result["best_s"]
+        change = after / before - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:32} {before * 1000:10.3f}ms {after * 1000:10.3f}ms {change:+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--output", type=Path, help="write the results to this JSON file")
+    parser.add_argument("--compare", type=Path, help="baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown flagged as a regression (default 10%%)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds each timing round lasts at least")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    selected = [name for name in BENCHMARKS if args.filter in name]
+    results = run(selected, args.min_time, args.repeat)
+
+    if args.output:
+        report = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created_at": time.time(),
+            "benchmarks": results,
+        }
+        args.output.write_text(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())["benchmarks"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,31 @@
 from abc import abstractmethod, ABC
 from models import GoodReadsBook
 from pathlib import Path
+from typing import Iterator
 from zlibrary import AsyncZlib, Language, Extension 
 import requests
-from exceptions import BookNotFoundException
+from exceptions import BookDownloadError, BookNotFoundException
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 
+CHUNK_SIZE = 256 * 1024
+
 class BookProvider(ABC):
 
     @abstractmethod
     def download_book(self, book: GoodReadsBook, destination: Path) -> Path:
         ...
 
+    @abstractmethod
+    def fetch_book(self, book: GoodReadsBook) -> tuple[Iterator[bytes], str]:
+        """Find the book and return its content as chunks, together with its file extension
+
+        Reading the chunks blocks on the download, iterate them in a thread.
+        """
+        ...
+
 class ZlibBookProvider(BookProvider):
 
     def __init__(self, email: str, password: str):
@@ -25,6 +37,18 @@ class ZlibBookProvider(BookProvider):
 
 
     async def download_book(self, book: GoodReadsBook, destination: Path) -> Path:
+        chunks, extension = await self.fetch_book(book)
+        downloaded_book_file_path = Path(f"{destination}/{book.get_file_name()}.{extension}")
+        await asyncio.to_thread(self._write_chunks, chunks, downloaded_book_file_path)
+        return downloaded_book_file_path
+
+    @staticmethod
+    def _write_chunks(chunks: Iterator[bytes], file_path: Path) -> None:
+        with open(file_path, "wb") as file:
+            for chunk in chunks:
+                file.write(chunk)
+
+    async def fetch_book(self, book: GoodReadsBook) -> tuple[Iterator[bytes], str]:
         logger.info("Logging in to Z-Library...")
         await self.lib.login(self.email, self.password)
         logger.info(f"Searching for book: {book.title}...")
@@ -48,11 +72,23 @@ class ZlibBookProvider(BookProvider):
         if not download_url:
             raise BookNotFoundException
         logging.info(f"Downloading book: {book.title}...")
-        download = requests.get(download_url, cookies=self.lib.cookies)
-        downloaded_book_file_path = Path(f"{destination}/{book.get_file_name()}.{item['extension'].lower()}")
-        with open(downloaded_book_file_path, "wb") as file:
-            file.write(download.content)
-        return downloaded_book_file_path
+        # only the headers are read here, the body is read by whoever iterates the chunks
+        download = await asyncio.to_thread(requests.get, download_url, cookies=self.lib.cookies, stream=True)
+        try:
+            download.raise_for_status()
+            # e.g. the page telling the daily download limit is reached
+            if download.headers.get("Content-Type", "").startswith("text/html"):
+                raise BookDownloadError(f"Got an HTML page instead of the file of {book.title}")
+        except Exception:
+            download.close()
+            raise
+        return self._iter_download(download), item["extension"].lower()
+
+    @staticmethod
+    def _iter_download(download: requests.Response) -> Iterator[bytes]:
+        # the response is closed once read, or once the generator is closed
+        with download:
+            yield from download.iter_content(chunk_size=CHUNK_SIZE)
 
     
     async def test(self):
@@ -66,6 +102,9 @@ class AABookProvider(BookProvider):
 
     def download_book(self, book: GoodReadsBook, destination: Path) -> Path:
         raise NotImplementedError
+
+    def fetch_book(self, book: GoodReadsBook) -> tuple[Iterator[bytes], str]:
+        raise NotImplementedError
     
 if __name__ == "__main__":
     from dotenv import load_dotenv
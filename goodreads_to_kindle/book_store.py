@@ -0,0 +1,128 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from functools import partial
+from pathlib import Path
+from typing import Iterable
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class BookStore:
+    """Content-addressed store of book files
+
+    Files are stored once under `blobs/<sha256>.<extension>`, and a small
+    JSON index maps book keys to them, so the same file downloaded for
+    different books (or twice) takes space only once. New content is
+    written in `tmp/`, on the same filesystem, and renamed into place.
+
+    The index is written by `save_index`, once per batch of files stored
+    rather than for every file. Files stored since it was last written are
+    stored again when next asked for.
+    """
+
+    BLOBS_PATH = "blobs"
+    TMP_PATH = "tmp"
+    INDEX_FILE = "index.json"
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.blob_dir = root / self.BLOBS_PATH
+        self.tmp_dir = root / self.TMP_PATH
+        self.index_file = root / self.INDEX_FILE
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.index = json.loads(self.index_file.read_text()) if self.index_file.exists() else {}
+        # books can be stored from several threads at once
+        self.lock = threading.Lock()
+        # the index has entries not written yet
+        self.dirty = False
+
+    def get(self, key: str, legacy_path: Path | None = None) -> Path | None:
+        """Return the file stored for `key`
+
+        A file found at `legacy_path` (the old title based layout) is moved
+        into the store the first time it's looked up.
+        """
+        blob = self.index.get(key)
+        if blob is not None and (self.blob_dir / blob).exists():
+            return self.blob_dir / blob
+        if legacy_path is not None and legacy_path.exists():
+            return self.put_file(key, legacy_path)
+        return None
+
+    @staticmethod
+    def derived_key(blob: Path, variant: str) -> str:
+        return f"derived:{Path(blob).stem}:{variant.lower()}"
+
+    def get_derived(self, blob: Path, variant: str) -> Path | None:
+        """Return the stored `variant` (a conversion, an optimized copy...) of `blob`"""
+        return self.get(self.derived_key(blob, variant))
+
+    def put_derived(self, blob: Path, variant: str, file_path: Path) -> Path:
+        """Move the `variant` of `blob` into the store"""
+        return self.put_file(self.derived_key(blob, variant), file_path)
+
+    def put_chunks(self, key: str, chunks: Iterable[bytes], extension: str) -> Path:
+        """Write `chunks` to the store, hashing them on the way"""
+        tmp_path = self.tmp_dir / f"{uuid.uuid4().hex}.part"
+        digest = hashlib.sha256()
+        try:
+            with open(tmp_path, "wb") as file:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    file.write(chunk)
+            return self._commit(key, tmp_path, digest.hexdigest(), extension)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+            # e.g. a download stopped halfway, let it close its connection
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+
+    def copy_file(self, key: str, file_path: Path) -> Path:
+        """Copy an existing file into the store, leaving it in place"""
+        file_path = Path(file_path)
+        with open(file_path, "rb") as file:
+            return self.put_chunks(key, iter(partial(file.read, CHUNK_SIZE), b""), file_path.suffix.lstrip("."))
+
+    def put_file(self, key: str, file_path: Path) -> Path:
+        """Move an existing file into the store"""
+        file_path = Path(file_path)
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            while chunk := file.read(CHUNK_SIZE):
+                digest.update(chunk)
+        return self._commit(key, file_path, digest.hexdigest(), file_path.suffix.lstrip("."))
+
+    def _commit(self, key: str, file_path: Path, digest: str, extension: str) -> Path:
+        blob_path = self.blob_dir / f"{digest}.{extension.lower()}"
+        with self.lock:
+            if blob_path.exists():
+                # same content already stored
+                file_path.unlink()
+            else:
+                try:
+                    os.replace(file_path, blob_path)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    shutil.move(file_path, blob_path)
+
+            self.index[key] = blob_path.name
+            self.dirty = True
+        return blob_path
+
+    def save_index(self) -> None:
+        """Write the index, if anything was stored since it was last written"""
+        with self.lock:
+            if not self.dirty:
+                return
+            tmp_index = self.tmp_dir / self.INDEX_FILE
+            tmp_index.write_text(json.dumps(self.index, indent=1, sort_keys=True))
+            os.replace(tmp_index, self.index_file)
+            self.dirty = False
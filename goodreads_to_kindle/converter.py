@@ -0,0 +1,39 @@
+import asyncio
+import logging
+import tempfile
+from pathlib import Path
+
+from repository import Repository
+from utils import CONVERSION_TIMEOUT, convert_ebook_async
+
+logger = logging.getLogger(__name__)
+
+
+class EbookConverter:
+    """Converts book files with Calibre, at most `max_workers` at a time
+
+    Conversions are cached in the repository by source content and target
+    format, so each book is converted to a format only once, whoever it is
+    sent to.
+    """
+
+    def __init__(self, repository: Repository, max_workers: int = 2, timeout: float = CONVERSION_TIMEOUT):
+        self.repository = repository
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(max_workers)
+
+    async def convert(self, book_file: Path, format: str) -> Path:
+        format = format.lower()
+        if book_file.suffix.lower() == f".{format}":
+            return book_file
+
+        converted_file = self.repository.get_converted_book(book_file, format)
+        if converted_file:
+            return converted_file
+
+        async with self.slots:
+            logger.info(f"Converting {book_file.name} to {format}")
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                output = Path(tmp_dir) / f"converted.{format}"
+                await convert_ebook_async(book_file, format, new_path=output, timeout=self.timeout)
+                return await asyncio.to_thread(self.repository.add_converted_book, book_file, format, output)
@@ -0,0 +1,162 @@
+"""Service mode: keep running, checking every shelf on its own schedule
+
+A single GoodreadsToKindle instance is kept alive, so the Twisted reactor,
+the SMTP sessions and the repository stay warm between checks. Each user's
+shelf is checked on its own interval: halved every time the shelf changed
+since the last check, stretched by half every time it didn't, within
+`poll_min_interval` and `poll_max_interval`. A token bucket caps the checks
+of all users together at `max_polls_per_hour`.
+"""
+import asyncio
+import logging
+import random
+import signal
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from models import User
+
+if TYPE_CHECKING:
+    # main.py is usually __main__, importing it again would load it twice
+    from main import GoodreadsToKindle
+
+logger = logging.getLogger(__name__)
+
+# the interval is multiplied by these when the shelf changed, and when it didn't
+SPEED_UP = 0.5
+SLOW_DOWN = 1.5
+# spread of the next check, so that users added together don't stay in step
+JITTER = 0.1
+
+
+@dataclass
+class UserSchedule:
+    user: User
+    interval: float
+    next_poll: float
+    shelf: set[str] | None = None
+
+
+class TokenBucket:
+    """Allows `rate` events per second on average, and bursts of up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, count: int) -> int:
+        """Take up to `count` tokens, return how many were taken"""
+        self._refill()
+        taken = min(count, int(self.tokens))
+        self.tokens -= taken
+        return taken
+
+    def wait_time(self) -> float:
+        """Seconds until the next token"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class PollScheduler:
+    def __init__(self, initial_interval: float, min_interval: float, max_interval: float):
+        self.initial_interval = initial_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        # Goodreads id -> schedule
+        self.schedules: dict[str, UserSchedule] = {}
+
+    def update_users(self, users: list[User]) -> None:
+        """Schedule new users right away, forget the removed ones"""
+        now = time.monotonic()
+        current = {user.goodreads_id: user for user in users}
+        for goodreads_id in self.schedules.keys() - current.keys():
+            del self.schedules[goodreads_id]
+        for goodreads_id, user in current.items():
+            if goodreads_id in self.schedules:
+                self.schedules[goodreads_id].user = user
+            else:
+                self.schedules[goodreads_id] = UserSchedule(user, self.initial_interval, now)
+
+    def due(self) -> list[UserSchedule]:
+        """Users whose check is due, the most overdue first"""
+        now = time.monotonic()
+        return sorted((s for s in self.schedules.values() if s.next_poll <= now), key=lambda s: s.next_poll)
+
+    def next_poll(self) -> float | None:
+        return min((s.next_poll for s in self.schedules.values()), default=None)
+
+    def polled(self, schedule: UserSchedule, shelf: set[str] | None, partial: bool = False) -> None:
+        """Reschedule a user after a check, `shelf` is None if the crawl failed
+
+        A `partial` shelf only has the books of the newest pages, from an
+        incremental crawl: the books added since the last check are in it,
+        the ones removed can't be told from the ones on older pages.
+        """
+        if shelf is not None:
+            if schedule.shelf is not None:
+                changed = not shelf <= schedule.shelf if partial else shelf != schedule.shelf
+                factor = SPEED_UP if changed else SLOW_DOWN
+                schedule.interval = min(self.max_interval, max(self.min_interval, schedule.interval * factor))
+                if partial:
+                    shelf = schedule.shelf | shelf
+            schedule.shelf = shelf
+        jitter = random.uniform(1 - JITTER, 1 + JITTER)
+        schedule.next_poll = time.monotonic() + schedule.interval * jitter
+
+
+async def serve(app: "GoodreadsToKindle") -> None:
+    """Check the users' shelves until SIGINT or SIGTERM"""
+    settings = app.settings
+    scheduler = PollScheduler(settings.poll_initial_interval, settings.poll_min_interval, settings.poll_max_interval)
+    bucket = TokenBucket(settings.max_polls_per_hour / 3600, settings.poll_burst)
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    users_refreshed = None
+    try:
+        while not stopping.is_set():
+            if users_refreshed is None or time.monotonic() - users_refreshed >= settings.users_refresh_interval:
+                scheduler.update_users(await asyncio.to_thread(app.load_users))
+                users_refreshed = time.monotonic()
+
+            due = scheduler.due()
+            polled = due[:bucket.take(len(due))]
+            if polled:
+                for schedule in polled:
+                    # a failed crawl leaves no shelf to compare
+                    app.shelves.pop(schedule.user.goodreads_id, None)
+                print(f"Checking {len(polled)} of {len(scheduler.schedules)} users")
+                # the SMTP sessions stay open between checks, every email was sent by the end of the run
+                app.start_metrics()
+                await app.run([schedule.user for schedule in polled])
+                app.write_report()
+                for schedule in polled:
+                    goodreads_id = schedule.user.goodreads_id
+                    scheduler.polled(schedule, app.shelves.get(goodreads_id), partial=goodreads_id in app.partial_shelves)
+                    logger.info(f"Next check of user {schedule.user.goodreads_id} in {schedule.interval:.0f}s")
+                continue
+
+            # Sleep until the next check is due and allowed, or the users are to be reloaded
+            wake_up = users_refreshed + settings.users_refresh_interval
+            if due:
+                wake_up = min(wake_up, time.monotonic() + bucket.wait_time())
+            elif scheduler.schedules:
+                wake_up = min(wake_up, scheduler.next_poll())
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=max(0.0, wake_up - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        print("Stopping")
+        await app.close()
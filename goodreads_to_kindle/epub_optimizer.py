@@ -0,0 +1,119 @@
+"""Shrink EPUB files before they are sent
+
+EPUBs are often zipped with little or no compression, and carry images far
+bigger than any e-reader screen. Images are downscaled with Pillow when it's
+installed, otherwise only the zip is recompressed.
+"""
+import asyncio
+import io
+import logging
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from repository import Repository
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def shrink_image(data: bytes, max_image_size: int, jpeg_quality: int = 85) -> bytes:
+    """Downscale an image to fit in `max_image_size` pixels, if that makes it smaller"""
+    with Image.open(io.BytesIO(data)) as image:
+        if max(image.size) <= max_image_size:
+            return data
+        image_format = image.format
+        image.thumbnail((max_image_size, max_image_size), Image.LANCZOS)
+        output = io.BytesIO()
+        if image_format == "JPEG":
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(output, image_format, quality=jpeg_quality, optimize=True)
+        else:
+            image.save(output, image_format, optimize=True)
+    shrunk = output.getvalue()
+    return shrunk if len(shrunk) < len(data) else data
+
+
+def optimize_epub(source: Path, destination: Path, max_image_size: int = 1600, compresslevel: int = 9) -> int:
+    """Write a smaller copy of the `source` EPUB to `destination`, return its size"""
+    with zipfile.ZipFile(source) as original, zipfile.ZipFile(destination, "w") as optimized:
+        # the mimetype entry must come first, and not be compressed
+        entries = sorted(original.infolist(), key=lambda info: info.filename != "mimetype")
+        for info in entries:
+            data = original.read(info)
+            entry = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+            entry.external_attr = info.external_attr
+            if info.filename == "mimetype":
+                optimized.writestr(entry, data, compress_type=zipfile.ZIP_STORED)
+                continue
+
+            if Image is not None and max_image_size and Path(info.filename).suffix.lower() in IMAGE_EXTENSIONS:
+                try:
+                    data = shrink_image(data, max_image_size)
+                except Exception:
+                    # not an image Pillow can handle (or a decompression bomb), keep it as it is
+                    pass
+            optimized.writestr(entry, data, compress_type=zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+    return destination.stat().st_size
+
+
+class EpubOptimizer:
+    """Optimizes EPUBs in a process pool, caching the results in the repository
+
+    Optimized copies are stored next to the original book, keyed by its
+    content and the optimization settings. When optimizing doesn't make a
+    book smaller, or fails in any way, the original is used.
+    """
+
+    def __init__(self, repository: Repository, max_workers: int = 2, max_image_size: int = 1600, compresslevel: int = 9):
+        self.repository = repository
+        self.max_image_size = max_image_size
+        self.compresslevel = compresslevel
+        # images are left as they are without Pillow, that's another result
+        self.variant = f"optimized-{max_image_size}-{compresslevel}" + ("" if Image else "-zip")
+        if Image is None and max_image_size:
+            logger.warning("Pillow is not installed, EPUB images won't be downscaled (pip install pillow)")
+        self.max_workers = max_workers
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    async def optimize(self, book_file: Path) -> Path:
+        if book_file.suffix.lower() != ".epub":
+            return book_file
+        try:
+            return await self._optimize(book_file)
+        except Exception as e:
+            logger.warning(f"Could not optimize {book_file.name}, sending it as it is", exc_info=True)
+            if isinstance(e, BrokenProcessPool):
+                # a worker died (out of memory...), the pool takes no more work
+                self.executor.shutdown(wait=False)
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return book_file
+
+    async def _optimize(self, book_file: Path) -> Path:
+        optimized_file = self.repository.get_optimized_book(book_file, self.variant)
+        if optimized_file:
+            return optimized_file
+
+        loop = asyncio.get_running_loop()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = Path(tmp_dir) / "optimized.epub"
+            size = await loop.run_in_executor(
+                self.executor, optimize_epub, book_file, output, self.max_image_size, self.compresslevel
+            )
+            if size >= book_file.stat().st_size:
+                # stores nothing new, the copy is deduplicated with the original
+                shutil.copyfile(book_file, output)
+            return await asyncio.to_thread(self.repository.add_optimized_book, book_file, self.variant, output)
+
+    def close(self) -> None:
+        self.executor.shutdown()
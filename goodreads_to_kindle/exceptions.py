@@ -3,4 +3,7 @@ class BookNotFoundException(Exception):
     pass
 
 class EbookConversionError(Exception):
+    pass
+
+class BookDownloadError(Exception):
     pass
\ No newline at end of file
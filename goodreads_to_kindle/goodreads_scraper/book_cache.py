@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""Persistent cache of parsed /book/show pages
+
+Book metadata almost never changes, so there is no need to download and
+parse the page of every book on a shelf at each run. Parsed BookItem's are
+stored in a SQLite file keyed by Goodreads book id, and are considered
+fresh for BOOK_CACHE_TTL seconds.
+"""
+import json
+import re
+import sqlite3
+import time
+from typing import Optional
+
+BOOK_ID_RE = re.compile(r"/book/show/(\d+)")
+
+
+def book_id_from_url(url: str) -> Optional[str]:
+    match = BOOK_ID_RE.search(url)
+    return match.group(1) if match else None
+
+
+class BookCache(object):
+    def __init__(self, path: str, ttl: Optional[float] = None, schema: str = ""):
+        # `schema` identifies the set of fields of the cached items,
+        # entries stored with a different schema are treated as missing
+        self.ttl = ttl
+        self.schema = schema
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS books ("
+            " book_id TEXT PRIMARY KEY,"
+            " schema TEXT NOT NULL,"
+            " scraped_at REAL NOT NULL,"
+            " item TEXT NOT NULL)"
+        )
+        self.connection.commit()
+
+    @classmethod
+    def from_settings(cls, settings, schema: str = ""):
+        ttl = settings.getfloat("BOOK_CACHE_TTL") or None
+        return cls(settings.get("BOOK_CACHE_FILE"), ttl=ttl, schema=schema)
+
+    def get(self, book_id: str) -> Optional[dict]:
+        row = self.connection.execute(
+            "SELECT schema, scraped_at, item FROM books WHERE book_id = ?", (book_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        schema, scraped_at, item = row
+        if schema != self.schema:
+            return None
+        if self.ttl is not None and time.time() - scraped_at > self.ttl:
+            return None
+        return json.loads(item)
+
+    def set(self, book_id: str, item: dict) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO books (book_id, schema, scraped_at, item) VALUES (?, ?, ?, ?)",
+            (book_id, self.schema, time.time(), json.dumps(dict(item))),
+        )
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
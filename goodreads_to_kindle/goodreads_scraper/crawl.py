@@ -1,54 +1,332 @@
-import json
-from pathlib import Path
-from scrapy.crawler import CrawlerProcess
+"""Run the Goodreads spiders from the rest of the application
+
+Scrapy runs on top of a Twisted reactor, which can't be restarted once
+stopped. Instead of a CrawlerProcess per crawl, a single reactor is started
+in a background thread the first time it's needed, and every crawl is
+scheduled on it through a shared CrawlerRunner. This way the startup cost
+is paid once per process, and any number of crawls can be run from it.
+"""
+import asyncio
+import logging
+import threading
+from typing import AsyncIterator, Iterable
+
+from scrapy.crawler import Crawler, CrawlerRunner
+from scrapy.utils.log import configure_logging
 from scrapy.utils.project import get_project_settings
+from scrapy.utils.reactor import install_reactor
+from twisted.internet.defer import Deferred, DeferredList, DeferredSemaphore, maybeDeferred
+
+from .spiders.author_spider import AuthorSpider
 from .spiders.mybooks_spider import MyBooksSpider
+from .spiders.shelf_rss_spider import ShelfRssSpider
+
+logger = logging.getLogger(__name__)
+
+SHELVES = ["read", "to-read", "currently-reading", "all"]
+
+# Where the books of a shelf are read from: its HTML list pages and the
+# page of every book, or its RSS feed
+SHELF_SPIDERS = {
+    "html": MyBooksSpider,
+    "rss": ShelfRssSpider,
+}
+
+# How many users' shelves are crawled at the same time,
+# each crawl has its own downloader and concurrency limits
+MAX_CONCURRENT_CRAWLS = 8
+
+# How many scraped books can wait for a slow consumer of `crawl_stream`
+# before the crawl itself is slowed down
+MAX_QUEUED_ITEMS = 16
+
+_runner = None
+_runner_lock = threading.Lock()
+
+_END_OF_CRAWL = object()
+
+
+def _run_reactor(settings, started: threading.Event):
+    if settings.get("TWISTED_REACTOR"):
+        install_reactor(settings["TWISTED_REACTOR"], settings.get("ASYNCIO_EVENT_LOOP"))
+    from twisted.internet import reactor
+
+    reactor.callWhenRunning(started.set)
+    reactor.run(installSignalHandlers=False)
+
+
+def _get_runner(log_file: str) -> CrawlerRunner:
+    """Return the shared runner, starting the reactor thread on first use
+
+    Scrapy logging is configured for the whole process along with the
+    reactor, so `log_file` is only used by the first call.
+    """
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            settings = get_project_settings()
+            settings.set("LOG_FILE", log_file)
+            settings.set("LOG_ENABLED", True)
+            configure_logging(settings)
+
+            started = threading.Event()
+            threading.Thread(
+                target=_run_reactor,
+                args=(settings, started),
+                name="scrapy-reactor",
+                daemon=True,
+            ).start()
+            started.wait()
+            _runner = CrawlerRunner(settings)
+    return _runner
+
+
+def _in_reactor(func, *args, **kwargs) -> asyncio.Future:
+    """Call `func` in the reactor thread and wrap its (deferred) result in an asyncio future"""
+    from twisted.internet import reactor
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(result):
+        if not future.done():
+            future.set_result(result)
+
+    def reject(exception):
+        if not future.done():
+            future.set_exception(exception)
+
+    def call():
+        d = maybeDeferred(func, *args, **kwargs)
+        d.addCallbacks(
+            lambda result: loop.call_soon_threadsafe(resolve, result),
+            lambda failure: loop.call_soon_threadsafe(reject, failure.value),
+        )
+
+    reactor.callFromThread(call)
+    return future
+
+
+def _new_crawler(runner: CrawlerRunner, source: str = "html") -> Crawler:
+    return Crawler(SHELF_SPIDERS[source], runner.settings.copy())
+
+
+def _crawl_shelves(runner: CrawlerRunner, user_ids: list[str], shelf: str, max_concurrent: int, source: str):
+    """Queue one shelf spider per user on `runner`, must run in the reactor thread"""
+    results = {user_id: [] for user_id in user_ids}
+    errors = {}
+    semaphore = DeferredSemaphore(max_concurrent)
+
+    def collector(user_id):
+        def on_item_scraped(item, response, spider):
+            print(f"[item] Scraped: {item.get('title')} by {item.get('author')}")
+            results[user_id].append(dict(item))
+
+        return on_item_scraped
+
+    def on_failure(failure, user_id):
+        logger.error(
+            f"Crawl of shelf '{shelf}' of user {user_id} failed",
+            exc_info=(failure.type, failure.value, failure.getTracebackObject()),
+        )
+        errors[user_id] = failure.value
 
-def crawl(user_id: str, shelf: str, log_file: str = "scrapy.log") -> list[dict]:
-    assert shelf in ["read", "to-read", "currently-reading", "all"], (
+    crawls = []
+    for user_id in user_ids:
+        crawler = _new_crawler(runner, source)
+        d = semaphore.run(
+            runner.crawl,
+            crawler,
+            user_id=user_id,
+            shelf=shelf,
+            item_scraped_callback=collector(user_id),
+        )
+        d.addErrback(on_failure, user_id)
+        crawls.append(d)
+
+    d = DeferredList(crawls)
+    d.addCallback(lambda _: (results, errors))
+    return d
+
+
+async def crawl_many(
+    user_ids: Iterable[str],
+    shelf: str,
+    log_file: str = "scrapy.log",
+    max_concurrent: int = MAX_CONCURRENT_CRAWLS,
+    source: str = "html",
+    errors: dict | None = None,
+) -> dict[str, list[dict]]:
+    """Crawl `shelf` for every user concurrently, on the shared reactor
+
+    Returns the scraped books keyed by user id. A user whose crawl failed
+    is returned with the books scraped so far, the failure is logged and,
+    when `errors` is given, added to it keyed by user id. `log_file` is
+    only used by the first crawl of the process, see `_get_runner`.
+    """
+    assert shelf in SHELVES, (
+        "Shelf must be one of 'read', 'to-read', 'currently-reading', 'all'"
+    )
+    assert source in SHELF_SPIDERS, f"Source must be one of {', '.join(map(repr, SHELF_SPIDERS))}"
+    user_ids = list(dict.fromkeys(user_ids))
+
+    print(f"[crawl] Crawling {len(user_ids)} Goodreads profiles for shelf '{shelf}'")
+
+    runner = await asyncio.to_thread(_get_runner, log_file)
+    results, failures = await _in_reactor(_crawl_shelves, runner, user_ids, shelf, max_concurrent, source)
+    if errors is not None:
+        errors.update(failures)
+
+    print(f"[crawl] Scraped {sum(map(len, results.values()))} books.")
+    if failures:
+        print(f"[crawl] The crawl failed for {len(failures)} users: {', '.join(failures)}")
+    return results
+
+
+async def crawl_stream(
+    user_id: str,
+    shelf: str,
+    log_file: str = "scrapy.log",
+    max_queued: int = MAX_QUEUED_ITEMS,
+    stats: dict | None = None,
+    known_book_ids: set[str] | None = None,
+    high_water_mark: str | None = None,
+    source: str = "html",
+) -> AsyncIterator[dict]:
+    """Yield the books of a user's shelf as soon as they are scraped
+
+    Items are handed over from the item_scraped signal through a bounded
+    queue. Scrapy waits for the signal handlers of an item, so when the
+    consumer falls behind the crawl slows down instead of buffering the
+    whole shelf. Leaving the iteration early stops the crawl.
+
+    `stats`, when given, is filled with the crawler stats once it's over.
+    With `known_book_ids` or a `high_water_mark` only the newest pages of
+    the shelf are crawled, see MyBooksSpider.
+    """
+    assert shelf in SHELVES, (
         "Shelf must be one of 'read', 'to-read', 'currently-reading', 'all'"
     )
+    assert source in SHELF_SPIDERS, f"Source must be one of {', '.join(map(repr, SHELF_SPIDERS))}"
 
-    print(f"[crawl] Crawling Goodreads profile {user_id} for shelf '{shelf}'")
+    print(f"[crawl] Streaming Goodreads profile {user_id} for shelf '{shelf}'")
 
-    settings = get_project_settings()
-    settings.set("OUTPUT_FILE_SUFFIX", f"{user_id}")
-    settings.set("LOG_FILE", log_file)
-    settings.set("LOG_ENABLED", True)
-    settings.set("FEEDS", {
-        f"book_{user_id}.jl": {
-            "format": "jsonlines",
-            "overwrite": True,
-        }
-    })
+    runner = await asyncio.to_thread(_get_runner, log_file)
+    # only safe to import once _get_runner installed the reactor
+    from twisted.internet import reactor
 
-    process = CrawlerProcess(settings)
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=max_queued)
+    pending = set()
+    closed = False
 
     def on_item_scraped(item, response, spider):
-        print(f"[item] Scraped: {item.get('title')} by {item.get('author')}")
+        if closed:
+            return None
+        d = Deferred()
+        put = asyncio.run_coroutine_threadsafe(queue.put(dict(item)), loop)
+        pending.add(put)
+        put.add_done_callback(pending.discard)
+        put.add_done_callback(lambda _: reactor.callFromThread(d.callback, None))
+        return d
 
-    process.crawl(
-        MyBooksSpider,
+    crawler = _new_crawler(runner, source)
+    done = _in_reactor(
+        runner.crawl,
+        crawler,
         user_id=user_id,
         shelf=shelf,
         item_scraped_callback=on_item_scraped,
+        known_book_ids=known_book_ids,
+        high_water_mark=high_water_mark,
     )
+    done.add_done_callback(lambda _: loop.create_task(queue.put(_END_OF_CRAWL)))
 
-    process.start()  # <== blocks until done
+    try:
+        while (item := await queue.get()) is not _END_OF_CRAWL:
+            yield item
+        # surface crawl errors once all the books scraped so far were consumed
+        done.result()
+    finally:
+        closed = True
+        for put in list(pending):
+            put.cancel()
+        if not done.done():
+            await _in_reactor(crawler.stop)
+        if stats is not None and crawler.stats is not None:
+            stats.update(crawler.stats.get_stats())
 
-    # Read output
-    output_file = Path(f"book_{user_id}.jl")
-    results = []
-    if output_file.exists():
-        with open(output_file) as f:
-            for line in f:
-                results.append(json.loads(line))
-        output_file.unlink()
 
-    #print(f"[crawl] Scraped {len(results)} books.")
-    return results
+async def crawl_authors(
+    author_names: Iterable[str],
+    log_file: str = "scrapy.log",
+    max_depth: int | None = None,
+    max_authors: int | None = None,
+) -> list[dict]:
+    """Crawl the pages of `author_names`, and of the authors close to them, on the shared reactor
 
-import asyncio
+    The crawl is bounded by `max_depth` and `max_authors` (AUTHOR_CRAWL_*
+    settings by default), and resumes from the checkpoint of the previous
+    one, see AuthorSpider.
+    """
+    author_names = list(dict.fromkeys(author_names))
+    print(f"[crawl] Crawling the authors close to {len(author_names)} authors")
 
-async def fetch_want_to_read(user_id: str):
-    return await asyncio.to_thread(crawl, user_id, "to-read")
+    runner = await asyncio.to_thread(_get_runner, log_file)
+    authors = []
+
+    def on_item_scraped(item, response, spider):
+        authors.append(dict(item))
+
+    await _in_reactor(
+        runner.crawl,
+        Crawler(AuthorSpider, runner.settings.copy()),
+        author_crawl=True,
+        item_scraped_callback=on_item_scraped,
+        seed_authors=author_names,
+        max_depth=max_depth,
+        max_authors=max_authors,
+    )
+
+    print(f"[crawl] Scraped {len(authors)} authors.")
+    return authors
+
+
+def crawl(user_id: str, shelf: str, log_file: str = "scrapy.log", source: str = "html") -> list[dict]:
+    """Blocking version of `crawl_many` for a single user, raises if the crawl failed"""
+    errors = {}
+    books = asyncio.run(crawl_many([user_id], shelf, log_file, source=source, errors=errors))[user_id]
+    if user_id in errors:
+        raise errors[user_id]
+    return books
+
+
+async def fetch_want_to_read(user_id: str, source: str = "html") -> list[dict]:
+    errors = {}
+    books = (await fetch_want_to_read_many([user_id], source=source, errors=errors))[user_id]
+    if user_id in errors:
+        raise errors[user_id]
+    return books
+
+
+async def fetch_want_to_read_many(
+    user_ids: Iterable[str], source: str = "html", errors: dict | None = None
+) -> dict[str, list[dict]]:
+    return await crawl_many(user_ids, "to-read", source=source, errors=errors)
+
+
+def fetch_want_to_read_stream(
+    user_id: str,
+    stats: dict | None = None,
+    known_book_ids: set[str] | None = None,
+    high_water_mark: str | None = None,
+    source: str = "html",
+) -> AsyncIterator[dict]:
+    return crawl_stream(
+        user_id,
+        "to-read",
+        stats=stats,
+        known_book_ids=known_book_ids,
+        high_water_mark=high_water_mark,
+        source=source,
+    )
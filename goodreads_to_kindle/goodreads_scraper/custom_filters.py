@@ -1,6 +1,20 @@
+import logging
+import math
+import os
+import re
+import struct
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
 from scrapy.dupefilters import RFPDupeFilter
+from twisted.internet import task
+
+logger = logging.getLogger(__name__)
 
 SEEN_URL_FILE = "seen_urls.txt"
+SEEN_REQUESTS_FILE = "seen_requests.bin"
 
 
 class SeenUrlFilter(RFPDupeFilter):
@@ -32,3 +46,252 @@ class SeenUrlFilter(RFPDupeFilter):
             f.write("\n".join(sorted(self.urls_seen)))
 
         super().close(*args, **kwargs)
+
+
+class BloomFilter(object):
+    """Fixed-size set of fingerprints, with a bounded false positive rate
+
+    Fingerprints are already uniformly distributed hashes, so the k bit
+    positions are derived from them directly (double hashing).
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 1e-6):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, fingerprint: bytes):
+        h1 = int.from_bytes(fingerprint[:8], "little")
+        h2 = int.from_bytes(fingerprint[8:16], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, fingerprint: bytes) -> None:
+        for pos in self._positions(fingerprint):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, fingerprint: bytes) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(fingerprint))
+
+
+class FingerprintStore(object):
+    """Append-only file of seen request fingerprints
+
+    Each record is a truncated request fingerprint followed by its expiry
+    time (0 for never). New fingerprints are appended, expired records are
+    skipped when loading and dropped when the file is compacted.
+
+    The records expiring later are counted by hour of expiry, so that the
+    records expired while the store is open are known without reading it.
+
+    Every crawl of a process shares the store of a file (see `acquire`):
+    a store compacting its file would otherwise leave the others appending
+    to the replaced one.
+    """
+
+    RECORD = struct.Struct("<16sI")
+    EXPIRY_BUCKET = 60 * 60
+
+    # absolute path -> [store, number of users]
+    _shared: Dict[str, list] = {}
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def acquire(cls, path: str, bloom_capacity: int = 0, bloom_error_rate: float = 1e-6) -> "FingerprintStore":
+        """Store of `path` shared within the process, opened by its first user"""
+        key = os.path.abspath(path)
+        with cls._shared_lock:
+            shared = cls._shared.get(key)
+            if shared is None:
+                shared = cls._shared[key] = [cls(path, bloom_capacity, bloom_error_rate), 0]
+            shared[1] += 1
+            return shared[0]
+
+    def release(self, compact_ratio: float = 0.5) -> None:
+        """Let go of a store from `acquire`, closed with its last user"""
+        with self._shared_lock:
+            shared = self._shared[os.path.abspath(self.path)]
+            shared[1] -= 1
+            if shared[1]:
+                return
+            del self._shared[os.path.abspath(self.path)]
+        self.close(compact_ratio)
+
+    def __init__(self, path: str, bloom_capacity: int = 0, bloom_error_rate: float = 1e-6):
+        self.path = path
+        self.lock = threading.RLock()
+        self.compaction = None
+        self.live = 0
+        self.stale = 0
+        # hour of expiry -> live records expiring in it
+        self.expiring = Counter()
+
+        if bloom_capacity:
+            self.seen = BloomFilter(bloom_capacity, bloom_error_rate)
+        else:
+            self.seen = set()
+
+        now = time.time()
+        for fingerprint, expires_at in self._records():
+            if expires_at and expires_at < now:
+                self.stale += 1
+                continue
+            self.seen.add(fingerprint)
+            self.live += 1
+            self._track(expires_at)
+
+        if bloom_capacity and self.live > bloom_capacity:
+            logger.warning(
+                "%d fingerprints loaded in a Bloom filter sized for %d, "
+                "raise DUPEFILTER_BLOOM_CAPACITY", self.live, bloom_capacity
+            )
+
+        self.file = open(path, "ab")
+
+    def _records(self):
+        try:
+            with open(self.path, "rb") as f:
+                while chunk := f.read(self.RECORD.size * 4096):
+                    # a truncated record at the end (unclean shutdown) is ignored
+                    end = len(chunk) - len(chunk) % self.RECORD.size
+                    yield from self.RECORD.iter_unpack(chunk[:end])
+        except FileNotFoundError:
+            return
+
+    def __contains__(self, fingerprint: bytes) -> bool:
+        with self.lock:
+            return fingerprint[:16] in self.seen
+
+    def _track(self, expires_at: int) -> None:
+        if expires_at:
+            self.expiring[expires_at // self.EXPIRY_BUCKET] += 1
+
+    def _expire(self) -> None:
+        """Count the records whose hour of expiry is over as stale"""
+        current = int(time.time()) // self.EXPIRY_BUCKET
+        for bucket in [bucket for bucket in self.expiring if bucket < current]:
+            count = self.expiring.pop(bucket)
+            self.live -= count
+            self.stale += count
+
+    def add(self, fingerprint: bytes, ttl: Optional[float] = None) -> None:
+        fingerprint = fingerprint[:16]
+        expires_at = int(time.time() + ttl) if ttl is not None else 0
+        with self.lock:
+            self.file.write(self.RECORD.pack(fingerprint, expires_at))
+            self.seen.add(fingerprint)
+            self.live += 1
+            self._track(expires_at)
+
+    def compact(self) -> None:
+        """Rewrite the file without expired records, without loading it in memory"""
+        with self.lock:
+            self.file.flush()
+            now = time.time()
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as tmp:
+                for fingerprint, expires_at in self._records():
+                    if not expires_at or expires_at >= now:
+                        tmp.write(self.RECORD.pack(fingerprint, expires_at))
+            self.file.close()
+            os.replace(tmp_path, self.path)
+            self.file = open(self.path, "ab")
+            self.stale = 0
+
+    def maybe_compact(self, compact_ratio: float = 0.5) -> None:
+        """Compact the file once the stale records outnumber `compact_ratio` of the live ones"""
+        with self.lock:
+            self._expire()
+            if self.stale > max(self.live, 1) * compact_ratio:
+                self.compact()
+
+    def start_compaction(self, interval: float, compact_ratio: float = 0.5) -> None:
+        """Check for compaction every `interval` seconds on the reactor, once for all the users of the store"""
+        if self.compaction is None:
+            self.compaction = task.LoopingCall(self.maybe_compact, compact_ratio)
+            self.compaction.start(interval, now=False)
+
+    def close(self, compact_ratio: float = 0.5) -> None:
+        if self.compaction is not None and self.compaction.running:
+            self.compaction.stop()
+        with self.lock:
+            self.maybe_compact(compact_ratio)
+            self.file.close()
+
+
+class FingerprintDupeFilter(RFPDupeFilter):
+    """Dupe filter that remembers requests across runs
+
+    Unlike SeenUrlFilter it keeps compact request fingerprints instead of
+    URLs, appends to its file instead of rewriting it, and forgets requests
+    after a TTL chosen by URL pattern (DUPEFILTER_TTLS): shelf pages can
+    expire right away while author pages are remembered for weeks. The store is compacted every `compact_interval`
+    seconds while the crawl runs, and when its last crawl closes it.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttls: Optional[Dict[str, Optional[float]]] = None,
+        default_ttl: Optional[float] = None,
+        bloom_capacity: int = 0,
+        bloom_error_rate: float = 1e-6,
+        compact_ratio: float = 0.5,
+        compact_interval: float = 60 * 60,
+        debug: bool = False,
+        *,
+        fingerprinter=None,
+    ):
+        super().__init__(None, debug, fingerprinter=fingerprinter)
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in (ttls or {}).items()]
+        self.default_ttl = default_ttl
+        self.compact_ratio = compact_ratio
+        self.compact_interval = compact_interval
+        self.store = FingerprintStore.acquire(path, bloom_capacity, bloom_error_rate)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            settings.get("DUPEFILTER_STORE_FILE", SEEN_REQUESTS_FILE),
+            ttls=settings.getdict("DUPEFILTER_TTLS"),
+            default_ttl=settings.get("DUPEFILTER_DEFAULT_TTL"),
+            bloom_capacity=settings.getint("DUPEFILTER_BLOOM_CAPACITY"),
+            bloom_error_rate=settings.getfloat("DUPEFILTER_BLOOM_ERROR_RATE", 1e-6),
+            compact_ratio=settings.getfloat("DUPEFILTER_COMPACT_RATIO", 0.5),
+            compact_interval=settings.getfloat("DUPEFILTER_COMPACT_INTERVAL", 60 * 60),
+            debug=settings.getbool("DUPEFILTER_DEBUG"),
+            fingerprinter=crawler.request_fingerprinter,
+        )
+
+    def open(self):
+        if self.compact_interval > 0:
+            self.store.start_compaction(self.compact_interval, self.compact_ratio)
+        return super().open()
+
+    def ttl_for(self, url: str) -> Optional[float]:
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    def request_seen(self, request) -> bool:
+        # requests of the current run
+        if super().request_seen(request):
+            return True
+
+        ttl = self.ttl_for(request.url)
+        if ttl is not None and ttl <= 0:
+            # never remembered across runs
+            return False
+
+        fingerprint = self.fingerprinter.fingerprint(request)
+        if fingerprint in self.store:
+            return True
+        self.store.add(fingerprint, ttl)
+        return False
+
+    def close(self, *args, **kwargs) -> None:
+        self.store.release(self.compact_ratio)
+        super().close(*args, **kwargs)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+"""Bounded priority frontier of a graph crawl
+
+The pages left to crawl are kept in a heap, highest priority first. The
+heap never grows past twice `max_size`: it's then cut back to the
+`max_size` best entries, so that the lowest priority pages are forgotten
+instead of piling up. A page queued again with a higher priority moves up,
+its previous entry is left in the heap and skipped when popped.
+
+Pages already crawled are recognized by their key in a Bloom filter, whose
+size doesn't depend on how many pages it holds. Only the crawled pages go
+in it: a page dropped from the heap can be queued again later. The filter
+is started over, a new generation, once it's older than `seen_ttl` or a
+crawl went through all of its frontier, so that pages are crawled again
+once in a while.
+
+The whole frontier, Bloom filter included, can be saved to a checkpoint
+file and loaded back, to resume a crawl where it stopped.
+"""
+import base64
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+
+from .custom_filters import BloomFilter
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(order=True)
+class FrontierEntry:
+    # negated, heapq pops the smallest entry first
+    rank: float
+    sequence: int
+    depth: int
+    url: str
+    key: str
+
+    @property
+    def priority(self) -> float:
+        return -self.rank
+
+
+class Frontier(object):
+    def __init__(self, max_size: int, seen_capacity: int, error_rate: float = 1e-6, seen_ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.seen_capacity = seen_capacity
+        self.error_rate = error_rate
+        self.seen_ttl = seen_ttl
+        self.heap: List[FrontierEntry] = []
+        # key -> entry of the pages queued, the heap also has the entries they replaced
+        self.queued: Dict[str, FrontierEntry] = {}
+        # keys of the pages popped and not crawled yet
+        self.popped: Set[str] = set()
+        self.sequence = itertools.count()
+        self.dropped = 0
+        self._new_generation()
+
+    def _new_generation(self) -> None:
+        self.seen = BloomFilter(self.seen_capacity, self.error_rate)
+        self.seen_count = 0
+        self.seen_since = time.time()
+
+    def __len__(self) -> int:
+        return len(self.queued)
+
+    @staticmethod
+    def _fingerprint(key: str) -> bytes:
+        return hashlib.sha1(key.encode()).digest()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.queued or key in self.popped or self._fingerprint(key) in self.seen
+
+    def push(self, url: str, key: str, priority: float, depth: int) -> bool:
+        """Queue a page, unless it was crawled, return whether it wasn't queued yet
+
+        A page already queued is moved up if `priority` is higher than its own.
+        """
+        if key in self.popped or self._fingerprint(key) in self.seen:
+            return False
+        queued = self.queued.get(key)
+        if queued is None:
+            self._queue(FrontierEntry(-priority, next(self.sequence), depth, url, key))
+            return True
+        if priority > queued.priority:
+            self._queue(FrontierEntry(-priority, next(self.sequence), min(depth, queued.depth), queued.url, key))
+        return False
+
+    def _queue(self, entry: FrontierEntry) -> None:
+        self.queued[entry.key] = entry
+        heapq.heappush(self.heap, entry)
+        if len(self.heap) > 2 * self.max_size:
+            self._trim()
+
+    def requeue(self, entry: FrontierEntry) -> None:
+        """Put back an entry popped but not crawled"""
+        self.popped.discard(entry.key)
+        if entry.key not in self.queued:
+            self._queue(entry)
+
+    def _trim(self) -> None:
+        live = [entry for entry in self.heap if self.queued.get(entry.key) is entry]
+        kept = heapq.nsmallest(self.max_size, live)
+        self.dropped += len(live) - len(kept)
+        self.queued = {entry.key: entry for entry in kept}
+        self.heap = kept
+        heapq.heapify(self.heap)
+
+    def pop(self) -> Optional[FrontierEntry]:
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            # skip the entries replaced by a higher priority one
+            if self.queued.get(entry.key) is entry:
+                del self.queued[entry.key]
+                self.popped.add(entry.key)
+                return entry
+        return None
+
+    def crawled(self, key: str) -> None:
+        """Remember a popped page as crawled, it isn't queued again in this generation"""
+        self.popped.discard(key)
+        self.seen.add(self._fingerprint(key))
+        self.seen_count += 1
+        if self.seen_count == self.seen_capacity + 1:
+            logger.warning(
+                "%d pages crawled, past the capacity of the Bloom filter (%d): more pages will be skipped as crawled "
+                "until the next generation, raise the capacity",
+                self.seen_count,
+                self.seen_capacity,
+            )
+
+    def save(self, path: str, in_flight: List[FrontierEntry] = (), **meta) -> None:
+        """Checkpoint the frontier, with the pages being crawled put back in it"""
+        entries = [*self.queued.values(), *in_flight]
+        state = {
+            "entries": [[entry.priority, entry.depth, entry.url, entry.key] for entry in sorted(entries)],
+            "seen": {
+                "capacity": self.seen_capacity,
+                "error_rate": self.error_rate,
+                "count": self.seen_count,
+                "since": self.seen_since,
+                "bits": base64.b64encode(self.seen.bits).decode(),
+            },
+            "dropped": self.dropped,
+            # nothing left to crawl, the next crawl starts a new generation
+            "complete": not entries,
+            "meta": meta,
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(state, file)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> Optional[dict]:
+        """Resume from a checkpoint, return its meta, None if there is none or the crawl is started over"""
+        try:
+            with open(path, "r") as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            return None
+
+        seen = state["seen"]
+        age = time.time() - seen.get("since", 0)
+        if state.get("complete"):
+            logger.info("The crawl of frontier checkpoint %s went through all of it, starting a new one", path)
+            return None
+        if self.seen_ttl is not None and age > self.seen_ttl:
+            logger.info("Frontier checkpoint %s is %d days old, starting a new crawl", path, age // (24 * 60 * 60))
+            return None
+
+        if (seen["capacity"], seen["error_rate"]) != (self.seen_capacity, self.error_rate):
+            # Bloom filter of another size, only the queued pages are remembered
+            logger.warning("Frontier checkpoint %s has a Bloom filter of another size, the pages crawled are forgotten", path)
+        elif seen.get("count", 0) > self.seen_capacity:
+            logger.warning(
+                "Frontier checkpoint %s has %d pages crawled, past the capacity of its Bloom filter (%d), they are forgotten",
+                path,
+                seen["count"],
+                self.seen_capacity,
+            )
+        else:
+            self.seen.bits = bytearray(base64.b64decode(seen["bits"]))
+            self.seen_count = seen.get("count", 0)
+            self.seen_since = seen.get("since", self.seen_since)
+        self.heap = []
+        self.queued = {}
+        for priority, depth, url, key in state["entries"]:
+            self.push(url, key, priority, depth)
+        self.dropped = state["dropped"]
+        return state["meta"]
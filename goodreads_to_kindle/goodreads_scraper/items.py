@@ -6,7 +6,7 @@
 # http://doc.scrapy.org/en/latest/topics/items.html
 import json
 import datetime
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 import scrapy
 from scrapy import Field
@@ -17,9 +17,13 @@ from itemloaders.processors import Compose, MapCompose, TakeFirst, Join
 from dateutil.parser import parse as dateutil_parse
 from w3lib.html import remove_tags
 
+from .json_path import PathMatcher
+
 
 DEBUG = False
 
+NEXT_DATA_MARKER = b'id="__NEXT_DATA__"'
+
 
 def print_schema(d, tabs=1):
     if type(d) is not dict:
@@ -95,12 +99,23 @@ def visit_path(data: Dict[str, Any], key: str, original_key: str):
     return None
 
 
-def json_field_extractor_v2(key: str):
-    def extract_field(text: str):
-        data = json.loads(text)
-        return list(visit_path(data, key, key))
+def extract_next_data(response) -> Optional[Dict[str, Any]]:
+    """Decode the JSON document of the ``script#__NEXT_DATA__`` tag of a page.
 
-    return extract_field
+    The script body is sliced straight out of the response bytes, so no DOM
+    has to be built to reach it. If the markup doesn't look as expected we
+    fall back to the CSS selector.
+    """
+    body = response.body
+    start = body.find(NEXT_DATA_MARKER)
+    if start != -1:
+        start = body.find(b">", start) + 1
+        end = body.find(b"</script>", start)
+        if start and end != -1:
+            return json.loads(body[start:end])
+
+    text = response.css("script#__NEXT_DATA__::text").get()
+    return json.loads(text) if text else None
 
 
 def splitter(split_on=","):
@@ -129,51 +144,49 @@ class BookItem(scrapy.Item):
     # Scalars
     # url = Field()
 
-    title = Field(
-        input_processor=MapCompose(
-            json_field_extractor_v2("props.pageProps.apolloState.Book*.title")
-        )
-    )
-    # titleComplete = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.titleComplete')))
-    # description = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.description'), remove_tags))
-    # imageUrl = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.imageUrl')))
-    # genres = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.bookGenres[].genre.name')), output_processor=Compose(set, list))
-    # asin = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.details.asin')))
-    isbn = Field(
-        input_processor=MapCompose(
-            json_field_extractor_v2("props.pageProps.apolloState.Book*.details.isbn")
-        )
-    )
-    isbn13 = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.details.isbn13')))
-    # publisher = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.details.publisher')))
-    # publishDate = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.details.publicationTime')))
-    # series = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Series*.title')), output_processor=Compose(set, list))
+    # Goodreads id of the book, from the shelf the book was found on
+    book_id = Field()
+
+    # Every field with a `json_path` is read from the page's __NEXT_DATA__,
+    # see BOOK_PATHS below. All paths are matched in a single walk over the
+    # document, so enabling one more field is almost free.
+
+    title = Field(json_path="props.pageProps.apolloState.Book*.title")
+    # titleComplete = Field(json_path='props.pageProps.apolloState.Book*.titleComplete')
+    # description = Field(json_path='props.pageProps.apolloState.Book*.description', input_processor=MapCompose(remove_tags))
+    # imageUrl = Field(json_path='props.pageProps.apolloState.Book*.imageUrl')
+    # genres = Field(json_path='props.pageProps.apolloState.Book*.bookGenres[].genre.name', output_processor=Compose(set, list))
+    # asin = Field(json_path='props.pageProps.apolloState.Book*.details.asin')
+    isbn = Field(json_path="props.pageProps.apolloState.Book*.details.isbn")
+    isbn13 = Field(json_path='props.pageProps.apolloState.Book*.details.isbn13')
+    # publisher = Field(json_path='props.pageProps.apolloState.Book*.details.publisher')
+    # publishDate = Field(json_path='props.pageProps.apolloState.Book*.details.publicationTime')
+    # series = Field(json_path='props.pageProps.apolloState.Series*.title', output_processor=Compose(set, list))
 
     author = Field(
-        input_processor=MapCompose(
-            json_field_extractor_v2("props.pageProps.apolloState.Contributor*.name")
-        ),
+        json_path="props.pageProps.apolloState.Contributor*.name",
         output_processor=list,
     )
 
-    # places = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Work*.details.places[].name')), output_processor=Compose(set, list))
-    # characters = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Work*.details.characters[].name')), output_processor=Compose(set, list))
-    # awards = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Work*.details.awardsWon[].[name,awardedAt,category,hasWon]')), output_processor=Identity())
+    # places = Field(json_path='props.pageProps.apolloState.Work*.details.places[].name', output_processor=Compose(set, list))
+    # characters = Field(json_path='props.pageProps.apolloState.Work*.details.characters[].name', output_processor=Compose(set, list))
+    # awards = Field(json_path='props.pageProps.apolloState.Work*.details.awardsWon[].[name,awardedAt,category,hasWon]', output_processor=Identity())
 
-    # ratingsCount = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Work*.stats.ratingsCount')))
-    # reviewsCount = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Work*.stats.textReviewsCount')))
-    # avgRating = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Work*.stats.averageRating')))
-    # ratingHistogram = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Work*.stats.ratingsCountDist')))
+    # ratingsCount = Field(json_path='props.pageProps.apolloState.Work*.stats.ratingsCount')
+    # reviewsCount = Field(json_path='props.pageProps.apolloState.Work*.stats.textReviewsCount')
+    # avgRating = Field(json_path='props.pageProps.apolloState.Work*.stats.averageRating')
+    # ratingHistogram = Field(json_path='props.pageProps.apolloState.Work*.stats.ratingsCountDist')
 
-    # numPages = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.details.numPages')))
+    # numPages = Field(json_path='props.pageProps.apolloState.Book*.details.numPages')
     language = Field(
-        input_processor=MapCompose(
-            json_field_extractor_v2(
-                "props.pageProps.apolloState.Book*.details.language.name"
-            )
-        )
+        json_path="props.pageProps.apolloState.Book*.details.language.name"
     )
-    # format = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.details.language.format')))
+    # format = Field(json_path='props.pageProps.apolloState.Book*.details.language.format')
+
+
+BOOK_PATHS = PathMatcher(
+    {name: field["json_path"] for name, field in BookItem.fields.items() if "json_path" in field}
+)
 
 
 class BookLoader(ItemLoader):
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""Compiled form of the dotted key language understood by ``items.visit_path``
+
+``visit_path`` interprets a single key per call, so extracting N fields
+from a page means N walks over the document (and N scans of every key of
+``apolloState`` for each ``Book*``-like wildcard).
+
+``PathMatcher`` compiles all the keys once into a trie and fills every
+field during a single walk. Supported segments are the same:
+ - ``key``    regular key
+ - ``key*``   every key starting with ``key``
+ - ``key[]``  every element of the array at ``key``
+ - ``[a,b]``  projection of the keys ``a`` and ``b`` (always a leaf)
+"""
+from typing import Any, Dict, List
+
+
+class _Node(object):
+    __slots__ = ("fields", "keys", "prefixes", "arrays", "projections")
+
+    def __init__(self):
+        # fields whose key ends at this node
+        self.fields = []
+        self.keys = {}
+        self.prefixes = {}
+        self.arrays = {}
+        # (field, [subkeys]) pairs
+        self.projections = []
+
+
+class PathMatcher(object):
+    def __init__(self, paths: Dict[str, str]):
+        self.paths = dict(paths)
+        self.root = _Node()
+        for field, key in self.paths.items():
+            self._add(field, key)
+
+    def _add(self, field: str, key: str):
+        node = self.root
+        for segment in key.split("."):
+            # same precedence as visit_path
+            if segment.endswith("*"):
+                node = node.prefixes.setdefault(segment[:-1], _Node())
+            elif segment.endswith("[]"):
+                node = node.arrays.setdefault(segment[:-2], _Node())
+            elif segment.startswith("[") and segment.endswith("]"):
+                node.projections.append((field, segment[1:-1].split(",")))
+                return
+            else:
+                node = node.keys.setdefault(segment, _Node())
+        node.fields.append(field)
+
+    def match(self, data: Dict[str, Any]) -> Dict[str, List[Any]]:
+        """Return the values found for every field, in the order visit_path would yield them"""
+        values = {field: [] for field in self.paths}
+        self._visit(self.root, data, values)
+        return values
+
+    def _visit(self, node: _Node, data: Any, values: Dict[str, List[Any]]):
+        # like visit_path, empty values are never yielded
+        if not data:
+            return
+
+        for field in node.fields:
+            values[field].append(data)
+
+        if not isinstance(data, dict):
+            return
+
+        for field, subkeys in node.projections:
+            values[field].append({sk: data.get(sk, None) for sk in subkeys})
+
+        # a single pass over the keys serves every wildcard at this level
+        if node.prefixes:
+            any_prefix = tuple(node.prefixes)
+            for key, value in data.items():
+                if not key.startswith(any_prefix):
+                    continue
+                for prefix, child in node.prefixes.items():
+                    if key.startswith(prefix):
+                        self._visit(child, value, values)
+
+        for key, child in node.arrays.items():
+            for value in data.get(key) or []:
+                self._visit(child, value, values)
+
+        for key, child in node.keys.items():
+            self._visit(child, data.get(key, None), values)
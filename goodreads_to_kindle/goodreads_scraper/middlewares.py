@@ -1,56 +1,194 @@
 # -*- coding: utf-8 -*-
 
-# Define here the models for your spider middleware
+# Define here the models for your downloader middleware
 #
 # See documentation in:
-# http://doc.scrapy.org/en/latest/topics/spider-middleware.html
+# http://doc.scrapy.org/en/latest/topics/downloader-middleware.html
+
+import bisect
+import logging
+import re
+from typing import Dict, Optional
 
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+logger = logging.getLogger(__name__)
+
+# endpoint class -> pattern of the request paths it covers
+ENDPOINT_CLASSES = {
+    "shelf": re.compile(r"/review/list(_rss)?/"),
+    "book": re.compile(r"/book/show/"),
+    "author": re.compile(r"/author/(show|list)/"),
+}
+
+# upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+SIZE_BUCKETS = (16_000, 64_000, 128_000, 256_000, 512_000, 1_000_000, float("inf"))
+
+THROTTLE_CODES = {429, 500, 502, 503, 504, 520, 522, 524}
+
+
+def classify(url: str) -> Optional[str]:
+    for endpoint, pattern in ENDPOINT_CLASSES.items():
+        if pattern.search(url):
+            return endpoint
+    return None
+
+
+def bucket_label(buckets, value: float) -> str:
+    bound = buckets[bisect.bisect_left(buckets, value)]
+    return "le_inf" if bound == float("inf") else f"le_{bound:g}"
+
+
+class EndpointThrottle(object):
+    """Delay and concurrency of one endpoint class
 
+    Additive increase, multiplicative decrease: every window of fast
+    responses (average latency under the target) allows one more
+    concurrent request and shortens the delay, a slow window takes one
+    concurrent request away, and a 429/5xx or a failed download halves the
+    concurrency and doubles the delay.
+    """
 
-class GoodreadsscraperSpiderMiddleware(object):
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the spider middleware does not modify the
-    # passed objects.
+    def __init__(self, delay: float, concurrency: int, min_delay: float, max_delay: float,
+                 max_concurrency: int, target_latency: float):
+        self.delay = delay
+        self.concurrency = concurrency
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.latency = None
+        self.window = 0
+
+    def on_success(self, latency: float) -> None:
+        # exponentially weighted, so that a single slow page doesn't count much
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        self.window += 1
+        if self.window < self.concurrency:
+            return
+        self.window = 0
+        if self.latency <= self.target_latency:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            self.delay = max(self.min_delay, self.delay * 0.75)
+        else:
+            self.concurrency = max(1, self.concurrency - 1)
+
+    def on_error(self, retry_after: Optional[float] = None) -> None:
+        self.window = 0
+        self.concurrency = max(1, self.concurrency // 2)
+        self.delay = min(self.max_delay, max(self.delay * 2, self.min_delay, 0.5))
+        if retry_after is not None:
+            self.delay = min(self.max_delay, max(self.delay, retry_after))
+
+
+class EndpointThrottleMiddleware(object):
+    """Throttle Goodreads requests per endpoint class
+
+    Shelf lists, book pages and author pages are served with very different
+    latencies, so each class gets its own downloader slot, whose delay and
+    concurrency follow the responses of that class (see EndpointThrottle).
+    Latency and size histograms of every class are kept in the crawler
+    stats, under endpoint/<class>/.
+
+    Sits between the downloader and RetryMiddleware, so it sees every
+    429/5xx before it's retried.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        settings = crawler.settings
+        # never faster than the politeness configured for every request
+        min_delay = max(settings.getfloat("ENDPOINT_THROTTLE_MIN_DELAY"), settings.getfloat("DOWNLOAD_DELAY"))
+        self.throttle_settings = dict(
+            delay=max(settings.getfloat("ENDPOINT_THROTTLE_START_DELAY"), min_delay),
+            concurrency=settings.getint("ENDPOINT_THROTTLE_START_CONCURRENCY"),
+            min_delay=min_delay,
+            max_delay=settings.getfloat("ENDPOINT_THROTTLE_MAX_DELAY"),
+            max_concurrency=settings.getint("ENDPOINT_THROTTLE_MAX_CONCURRENCY"),
+            target_latency=settings.getfloat("ENDPOINT_THROTTLE_TARGET_LATENCY"),
+        )
+        self.throttles: Dict[str, EndpointThrottle] = {}
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
-        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
-        return s
+        if not crawler.settings.getbool("ENDPOINT_THROTTLE_ENABLED"):
+            raise NotConfigured
+        middleware = cls(crawler)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
 
-    def process_spider_input(self, response, spider):
-        # Called for each response that goes through the spider
-        # middleware and into the spider.
+    @staticmethod
+    def slot_key(endpoint: str) -> str:
+        return f"goodreads-{endpoint}"
 
-        # Should return None or raise an exception.
-        return None
+    def _apply(self, endpoint: str) -> None:
+        """Copy the throttle of `endpoint` to its downloader slot, once it exists"""
+        throttle = self.throttles[endpoint]
+        slot = self.crawler.engine.downloader.slots.get(self.slot_key(endpoint))
+        if slot is not None:
+            slot.delay = throttle.delay
+            slot.concurrency = throttle.concurrency
+        self.stats.set_value(f"endpoint/{endpoint}/delay", throttle.delay)
+        self.stats.set_value(f"endpoint/{endpoint}/concurrency", throttle.concurrency)
 
-    def process_spider_output(self, response, result, spider):
-        # Called with the results returned from the Spider, after
-        # it has processed the response.
+    def process_request(self, request, spider=None):
+        endpoint = classify(request.url)
+        if endpoint is None:
+            return None
+        request.meta["endpoint"] = endpoint
+        request.meta.setdefault("download_slot", self.slot_key(endpoint))
+        if endpoint not in self.throttles:
+            self.throttles[endpoint] = EndpointThrottle(**self.throttle_settings)
+        self._apply(endpoint)
+        return None
 
-        # Must return an iterable of Request, dict or Item objects.
-        for i in result:
-            yield i
+    def process_response(self, request, response, spider=None):
+        endpoint = request.meta.get("endpoint")
+        if endpoint is None:
+            return response
 
-    def process_spider_exception(self, response, exception, spider):
-        # Called when a spider or process_spider_input() method
-        # (from other spider middleware) raises an exception.
+        prefix = f"endpoint/{endpoint}"
+        latency = request.meta.get("download_latency", 0.0)
+        self.stats.inc_value(f"{prefix}/responses")
+        self.stats.inc_value(f"{prefix}/latency/{bucket_label(LATENCY_BUCKETS, latency)}")
+        self.stats.inc_value(f"{prefix}/bytes/{bucket_label(SIZE_BUCKETS, len(response.body))}")
 
-        # Should return either None or an iterable of Response, dict
-        # or Item objects.
-        pass
+        throttle = self.throttles[endpoint]
+        if response.status in THROTTLE_CODES:
+            self.stats.inc_value(f"{prefix}/throttled")
+            throttle.on_error(self._retry_after(response))
+            logger.info(
+                f"{response.status} on {endpoint} pages, backing off: "
+                f"delay {throttle.delay:.2f}s, concurrency {throttle.concurrency}"
+            )
+        else:
+            throttle.on_success(latency)
+        self._apply(endpoint)
+        return response
 
-    def process_start_requests(self, start_requests, spider):
-        # Called with the start requests of the spider, and works
-        # similarly to the process_spider_output() method, except
-        # that it doesn’t have a response associated.
+    def process_exception(self, request, exception, spider=None):
+        endpoint = request.meta.get("endpoint")
+        if endpoint is not None:
+            self.stats.inc_value(f"endpoint/{endpoint}/errors")
+            self.throttles[endpoint].on_error()
+            self._apply(endpoint)
+        return None
 
-        # Must return only requests (not items).
-        for r in start_requests:
-            yield r
+    @staticmethod
+    def _retry_after(response) -> Optional[float]:
+        value = response.headers.get("Retry-After")
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            # an HTTP date, not worth parsing
+            return None
 
-    def spider_opened(self, spider):
-        spider.logger.info("Spider opened: %s" % spider.name)
+    def spider_closed(self, spider):
+        for endpoint, throttle in self.throttles.items():
+            spider.logger.info(
+                f"Endpoint {endpoint}: delay {throttle.delay:.2f}s, concurrency {throttle.concurrency}, "
+                f"latency {throttle.latency or 0:.2f}s"
+            )
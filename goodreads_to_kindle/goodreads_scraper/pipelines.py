@@ -4,44 +4,55 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: http://doc.scrapy.org/en/latest/topics/item-pipeline.html
-from scrapy.exporters import JsonLinesItemExporter
-from scrapy import signals
+from pathlib import Path
 
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
 
-class JsonLineItemSegregator(object):
-    @classmethod
-    def from_crawler(cls, crawler):
-        output_file_suffix = crawler.settings.get("OUTPUT_FILE_SUFFIX", default="")
-        return cls(crawler, output_file_suffix)
-
-    def __init__(self, crawler, output_file_suffix):
-        self.types = {"book", "author"}
-        self.output_file_suffix = output_file_suffix
-        self.files = set()
-        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
-        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+from .items import BookItem
+from .snapshot_log import SnapshotLog
 
-    def spider_opened(self, spider):
-        self.files = {
-            name: open(name + "_" + self.output_file_suffix + ".jl", "a+b")
-            for name in self.types
-        }
-        self.exporters = {
-            name: JsonLinesItemExporter(self.files[name]) for name in self.types
-        }
 
-        for e in self.exporters.values():
-            e.start_exporting()
+class ShelfSnapshotPipeline(object):
+    """Record every finished crawl of a shelf in the user's SnapshotLog
 
-    def spider_closed(self, spider):
-        for e in self.exporters.values():
-            e.finish_exporting()
+    The log of a shelf is SNAPSHOT_DIR/<user id>_<shelf>.snapshots. The
+    books added and removed since the previous crawl are counted in the
+    stats, under snapshot/. Crawls closed for any other reason than
+    finishing (errors, shutdown...) aren't recorded, the books they missed
+    would look removed. An incremental crawl, stopping on purpose after the
+    newest pages, is recorded as partial: its books are added to the ones
+    of the previous snapshot.
+    """
 
-        for f in self.files.values():
-            f.close()
+    @classmethod
+    def from_crawler(cls, crawler):
+        directory = crawler.settings.get("SNAPSHOT_DIR")
+        if not directory:
+            raise NotConfigured
+        return cls(crawler, Path(directory))
+
+    def __init__(self, crawler, directory: Path):
+        self.stats = crawler.stats
+        self.directory = directory
+        # book id -> item
+        self.items = {}
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
 
     def process_item(self, item, spider):
-        item_type = type(item).__name__.replace("Item", "").lower()
-        if item_type in self.types:
-            self.exporters[item_type].export_item(item)
+        if isinstance(item, BookItem) and item.get("book_id"):
+            self.items[item["book_id"]] = dict(item)
         return item
+
+    def spider_closed(self, spider, reason):
+        # only the shelf spiders know their user
+        user_id = getattr(spider, "user_id", None)
+        if reason != "finished" or user_id is None:
+            return
+
+        log = SnapshotLog(self.directory / f"{user_id}_{spider.shelf}.snapshots")
+        snapshot = log.append(self.items, partial=getattr(spider, "stopped_early", False))
+        diff = log.diff()
+        self.stats.set_value("snapshot/books", len(snapshot.book_ids))
+        self.stats.set_value("snapshot/added", len(diff.added))
+        self.stats.set_value("snapshot/removed", len(diff.removed))
@@ -9,10 +9,6 @@
 #     http://scrapy.readthedocs.org/en/latest/topics/downloader-middleware.html
 #     http://scrapy.readthedocs.org/en/latest/topics/spider-middleware.html
 
-from dotenv import load_dotenv
-
-load_dotenv(override=True)
-
 BOT_NAME = "GoodreadsScraper"
 
 SPIDER_MODULES = ["goodreads_scraper.spiders"]
@@ -48,17 +44,24 @@ COOKIES_ENABLED = False
 #   'Accept-Language': 'en',
 # }
 
-# Enable or disable spider middlewares
-# See http://scrapy.readthedocs.org/en/latest/topics/spider-middleware.html
-# SPIDER_MIDDLEWARES = {
-#    'GoodreadsScraper.middlewares.GoodreadsscraperSpiderMiddleware': 543,
-# }
-
 # Enable or disable downloader middlewares
 # See http://scrapy.readthedocs.org/en/latest/topics/downloader-middleware.html
-# DOWNLOADER_MIDDLEWARES = {
-#    'GoodreadsScraper.middlewares.MyCustomDownloaderMiddleware': 543,
-# }
+DOWNLOADER_MIDDLEWARES = {
+    # right below RetryMiddleware (550), to see responses before they're retried
+    'goodreads_scraper.middlewares.EndpointThrottleMiddleware': 560,
+}
+
+# Shelf, book and author pages get their own delay and concurrency, adapted
+# to their latency and backed off on 429/5xx (DOWNLOAD_DELAY applies to the rest).
+# Their delay never goes below DOWNLOAD_DELAY, even with a lower MIN_DELAY
+ENDPOINT_THROTTLE_ENABLED = True
+ENDPOINT_THROTTLE_START_DELAY = 0.1
+ENDPOINT_THROTTLE_START_CONCURRENCY = 4
+ENDPOINT_THROTTLE_MIN_DELAY = 0
+ENDPOINT_THROTTLE_MAX_DELAY = 60
+ENDPOINT_THROTTLE_MAX_CONCURRENCY = 16
+# average latency (in seconds) above which concurrency stops growing
+ENDPOINT_THROTTLE_TARGET_LATENCY = 1.0
 
 # Enable or disable extensions
 # See http://scrapy.readthedocs.org/en/latest/topics/extensions.html
@@ -69,15 +72,68 @@ COOKIES_ENABLED = False
 # Configure item pipelines
 # See http://scrapy.readthedocs.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
-    "goodreads_scraper.pipelines.JsonLineItemSegregator": 300,
+    "goodreads_scraper.pipelines.ShelfSnapshotPipeline": 300,
 }
 
-# If you want to run the tool in multiple runs
-# but avoid scraping data for the same books/authors
+# Bounds of an AuthorSpider crawl (author_crawl=True): links followed from
+# the seed authors, author pages requested per crawl, pages kept in the
+# frontier, and pages remembered as crawled (in a Bloom filter, across crawls).
+# The frontier is checkpointed every AUTHOR_CRAWL_CHECKPOINT_EVERY pages and
+# at the end of the crawl, and the next crawl resumes from it. The pages
+# crawled are forgotten, and crawled again, once the crawl went through its
+# whole frontier or after AUTHOR_CRAWL_SEEN_TTL seconds (None for never)
+AUTHOR_CRAWL_MAX_DEPTH = 2
+AUTHOR_CRAWL_MAX_AUTHORS = 500
+AUTHOR_CRAWL_FRONTIER_SIZE = 10_000
+AUTHOR_CRAWL_SEEN_CAPACITY = 100_000
+AUTHOR_CRAWL_SEEN_TTL = 30 * 24 * 60 * 60
+AUTHOR_CRAWL_CHECKPOINT_FILE = "author_frontier.json"
+AUTHOR_CRAWL_CHECKPOINT_EVERY = 50
+
+# Every complete shelf crawl is recorded in SNAPSHOT_DIR/<user id>_<shelf>.snapshots,
+# see snapshot_log.py. Empty to not keep them
+SNAPSHOT_DIR = "snapshots"
+
+# Parsed book pages are cached across runs, keyed by Goodreads book id,
+# so only new (or expired) books on a shelf are requested
+BOOK_CACHE_ENABLED = True
+BOOK_CACHE_FILE = "book_cache.sqlite"
+# Seconds a cached book is considered fresh, 0 to never expire
+BOOK_CACHE_TTL = 30 * 24 * 60 * 60
+
+# To avoid scraping data for the same books/authors across runs
 # uncomment the following line (if commented)
 # This will create a file in the directory where you run
-# that keeps track of seen URLs, and avoids scraping duplicate URLs
-# DUPEFILTER_CLASS = 'GoodreadsScraper.custom_filters.SeenUrlFilter'
+# that keeps track of seen requests, and avoids scraping duplicate URLs.
+# The shelf spiders don't go through it for book pages, the book cache
+# decides when those are requested again, nor does an author crawl, whose
+# frontier dedupes its pages: it's for `scrapy crawl book`/`author`
+# DUPEFILTER_CLASS = "goodreads_scraper.custom_filters.FingerprintDupeFilter"
+DUPEFILTER_STORE_FILE = "seen_requests.bin"
+# Seconds a seen request is remembered, by URL regex (first match wins),
+# None to remember it forever, 0 to never remember it across runs
+DUPEFILTER_TTLS = {
+    r"/review/list(_rss)?/": 0,
+    r"/book/show/": BOOK_CACHE_TTL or None,
+    r"/author/show/": 30 * 24 * 60 * 60,
+}
+DUPEFILTER_DEFAULT_TTL = 7 * 24 * 60 * 60
+# Load the seen requests in a Bloom filter sized for this many entries
+# instead of a set, to keep memory bounded on very large stores
+DUPEFILTER_BLOOM_CAPACITY = 0
+DUPEFILTER_BLOOM_ERROR_RATE = 1e-6
+# Rewrite the store without expired entries when they outnumber
+# this fraction of the live ones
+DUPEFILTER_COMPACT_RATIO = 0.5
+# Seconds between checks for compaction during a crawl, 0 to only check at the end
+DUPEFILTER_COMPACT_INTERVAL = 60 * 60
+
+# Fields the entries of a shelf RSS feed must have, the page of a book
+# missing one of them is requested (or read from the book cache) instead.
+# The feed only has the first author, so the books without an ISBN (keyed
+# by their title and authors) take all their authors from their page.
+# The feed has no language, add "language" to filter Z-Library by it
+SHELF_RSS_REQUIRED_FIELDS = ["title", "author", "isbn"]
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See http://doc.scrapy.org/en/latest/topics/autothrottle.html
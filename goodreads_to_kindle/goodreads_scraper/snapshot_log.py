@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+"""Append-only log of the snapshots of a user's shelf
+
+Every finished crawl of a shelf appends one record: the ids of the books
+on the shelf at that time, and the items of the books added since the
+previous record only, so that a book is stored once however many crawls
+see it. Records are zlib compressed JSON, framed by their length.
+
+A separate index of fixed size entries (time, offset and length of every
+record) gives direct access to any record, so that the changes since the
+last snapshot are found by reading two records, however long the log.
+The index can always be rebuilt from the log, which is the only source of
+truth: a record torn by a crash (or corrupted) is cut off, along with
+everything after it, and the missing index entries are added, the next
+time the log is opened.
+"""
+import json
+import os
+import struct
+import time
+import zlib
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+FRAME_HEADER = struct.Struct("<I")
+# taken_at, offset and length of a record
+INDEX_ENTRY = struct.Struct("<dQI")
+
+
+@dataclass
+class Snapshot:
+    taken_at: float
+    book_ids: List[str]
+    # book id -> item, of the books added since the previous snapshot
+    added: Dict[str, dict]
+    # whether only the newest pages of the shelf were crawled
+    partial: bool = False
+
+
+@dataclass
+class ShelfDiff:
+    added: Dict[str, dict] = field(default_factory=dict)
+    removed: Set[str] = field(default_factory=set)
+
+
+class SnapshotLog(object):
+    def __init__(self, path):
+        self.path = Path(path)
+        self.index_path = self.path.with_name(self.path.name + ".idx")
+        self._repair()
+
+    def __len__(self) -> int:
+        if not self.index_path.exists():
+            return 0
+        return self.index_path.stat().st_size // INDEX_ENTRY.size
+
+    def _entry(self, position: int):
+        count = len(self)
+        if position < 0:
+            position += count
+        if not 0 <= position < count:
+            raise IndexError(f"No snapshot {position} in {self.path}, it has {count}")
+        with open(self.index_path, "rb") as index:
+            index.seek(position * INDEX_ENTRY.size)
+            return INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))
+
+    def _repair(self) -> None:
+        """Bring the index in line with the log, after a crash in between writing them"""
+        if not self.path.exists():
+            if self.index_path.exists():
+                self.index_path.unlink()
+            return
+
+        count = len(self)
+        with open(self.index_path, "ab") as index:
+            # drop a torn index entry
+            index.truncate(count * INDEX_ENTRY.size)
+        end = 0
+        if count:
+            _, offset, length = self._entry(-1)
+            end = offset + FRAME_HEADER.size + length
+
+        size = self.path.stat().st_size
+        if end == size:
+            return
+        if end > size:
+            # the log lost records the index has, start over from the log
+            self.index_path.unlink()
+            end = 0
+
+        with open(self.path, "r+b") as log, open(self.index_path, "ab") as index:
+            log.seek(end)
+            while True:
+                header = log.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    break
+                (length,) = FRAME_HEADER.unpack(header)
+                payload = log.read(length)
+                if len(payload) < length:
+                    break
+                try:
+                    taken_at = json.loads(zlib.decompress(payload))["taken_at"]
+                except (zlib.error, ValueError, KeyError, TypeError):
+                    # garbage, not a record: the log ends with the last good one
+                    break
+                index.write(INDEX_ENTRY.pack(taken_at, end, length))
+                end += FRAME_HEADER.size + length
+            # cut off a torn record
+            log.truncate(end)
+
+    def read(self, position: int = -1) -> Snapshot:
+        """Return a snapshot, by position in the log (negative from the end)"""
+        _, offset, length = self._entry(position)
+        with open(self.path, "rb") as log:
+            log.seek(offset + FRAME_HEADER.size)
+            return Snapshot(**json.loads(zlib.decompress(log.read(length))))
+
+    def latest(self) -> Optional[Snapshot]:
+        return self.read(-1) if len(self) else None
+
+    def append(self, items: Dict[str, dict], partial: bool = False) -> Snapshot:
+        """Record the books of a crawl, keyed by book id
+
+        The books of a `partial` crawl are added to the ones of the last
+        snapshot, since a book missing from the crawl may just be on a page
+        that wasn't crawled.
+        """
+        previous = self.latest()
+        previous_ids = set(previous.book_ids) if previous else set()
+        book_ids = (set(items) | previous_ids) if partial else set(items)
+        snapshot = Snapshot(
+            taken_at=time.time(),
+            book_ids=sorted(book_ids),
+            added={book_id: items[book_id] for book_id in sorted(book_ids - previous_ids)},
+            partial=partial,
+        )
+
+        payload = zlib.compress(json.dumps(asdict(snapshot), separators=(",", ":")).encode())
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "ab") as log:
+            offset = log.tell()
+            log.write(FRAME_HEADER.pack(len(payload)) + payload)
+            log.flush()
+            os.fsync(log.fileno())
+        with open(self.index_path, "ab") as index:
+            index.write(INDEX_ENTRY.pack(snapshot.taken_at, offset, len(payload)))
+        return snapshot
+
+    def diff(self, older: int = -2, newer: int = -1) -> ShelfDiff:
+        """Books added and removed between two snapshots, by default the last two
+
+        Only the records in between are read, to find the items of the
+        added books. With a single snapshot, all its books are added.
+        """
+        count = len(self)
+        if count == 0:
+            return ShelfDiff()
+        newer = newer % count
+        older = older % count if count > 1 and abs(older) <= count else None
+
+        newer_snapshot = self.read(newer)
+        if older is None:
+            return ShelfDiff(added=dict(newer_snapshot.added))
+        older_ids = set(self.read(older).book_ids)
+
+        diff = ShelfDiff(removed=older_ids - set(newer_snapshot.book_ids))
+        missing = set(newer_snapshot.book_ids) - older_ids
+        position, snapshot = newer, newer_snapshot
+        while missing and position > older:
+            for book_id in missing & snapshot.added.keys():
+                diff.added[book_id] = snapshot.added[book_id]
+            missing -= snapshot.added.keys()
+            position -= 1
+            if position > older:
+                snapshot = self.read(position)
+        return diff
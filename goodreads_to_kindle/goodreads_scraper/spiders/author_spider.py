@@ -1,19 +1,82 @@
 """Spider to extract information from a /author/show page"""
 
+import re
+from urllib.parse import quote_plus, urlparse
+
 import scrapy
 from scrapy import signals
 
+from ..frontier import Frontier
 from ..items import AuthorItem, AuthorLoader
 
+AUTHOR_PAGE_RE = re.compile(r"/author/(show|similar)/(\d+)")
+
+# Priority of the authors linked from a page, by kind of link. Authors on
+# our users' shelves (seed_authors) come before all of them, and every
+# level of depth costs one
+RELEVANT_PRIORITY = 100
+LINK_PRIORITIES = {
+    "influence": 3,
+    "similar": 2,
+    "page": 1,
+}
+
+
+def page_key(url: str) -> str:
+    """Identity of a page in the frontier: the author id for author pages, the URL otherwise"""
+    match = AUTHOR_PAGE_RE.search(url)
+    if match:
+        return f"{match.group(1)}:{match.group(2)}"
+    parsed = urlparse(url)
+    return f"{parsed.path}?{parsed.query}"
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(name.lower().split())
+
 
 class AuthorSpider(scrapy.Spider):
+    """Extract information from /author/show pages
+
+    With author_crawl enabled, the graph of authors is crawled from
+    seed_authors (names, comma separated on the command line), through
+    their influences, similar authors and the other authors linked from
+    their pages. The crawl is bounded: pages deeper than max_depth links
+    are not followed, no more than max_authors pages are requested, and
+    the pages left to crawl are kept in a bounded Frontier, authors named
+    in seed_authors first. The frontier is checkpointed to
+    AUTHOR_CRAWL_CHECKPOINT_FILE, and the next crawl resumes from it,
+    skipping the pages already crawled, until the crawl went through the
+    whole frontier or AUTHOR_CRAWL_SEEN_TTL passed: delete the file to
+    start over sooner.
+
+    See the AUTHOR_CRAWL_* settings for the defaults.
+    """
+
     name = "author"
 
     def _set_crawler(self, crawler):
         super()._set_crawler(crawler)
-        crawler.signals.connect(self.item_scraped_callback, signal=signals.item_scraped)
+        # none when run with `scrapy crawl author`
+        if self.item_scraped_callback is not None:
+            crawler.signals.connect(self.item_scraped_callback, signal=signals.item_scraped)
+
+        settings = crawler.settings
+        if self.max_depth is None:
+            self.max_depth = settings.getint("AUTHOR_CRAWL_MAX_DEPTH", 2)
+        if self.max_authors is None:
+            self.max_authors = settings.getint("AUTHOR_CRAWL_MAX_AUTHORS", 500)
+        self.frontier_size = settings.getint("AUTHOR_CRAWL_FRONTIER_SIZE", 10_000)
+        self.seen_capacity = settings.getint("AUTHOR_CRAWL_SEEN_CAPACITY", 100_000)
+        seen_ttl = settings.get("AUTHOR_CRAWL_SEEN_TTL")
+        self.seen_ttl = float(seen_ttl) if seen_ttl else None
+        self.checkpoint_file = settings.get("AUTHOR_CRAWL_CHECKPOINT_FILE")
+        self.checkpoint_every = settings.getint("AUTHOR_CRAWL_CHECKPOINT_EVERY", 50)
+        self.max_in_flight = settings.getint("CONCURRENT_REQUESTS", 16)
+        if self.author_crawl:
+            crawler.signals.connect(self.save_frontier, signal=signals.spider_closed)
 
-    def __init__(self, author_crawl="False", item_scraped_callback=None):
+    def __init__(self, author_crawl="False", item_scraped_callback=None, seed_authors=None, max_depth=None, max_authors=None):
         # The default arg for author_crawl is intentionally a string
         # since command line arguments to scrapy are strings
         super().__init__()
@@ -23,17 +86,102 @@ class AuthorSpider(scrapy.Spider):
         # Convert author_crawl to str
         # just in case a boolean was passed in programmatically
         self.author_crawl = str(author_crawl).lower() in {"true", "yes", "y"}
-        if self.author_crawl:
-            self.start_urls = [
-                "https://www.goodreads.com/",
-                "https://www.goodreads.com/author/on_goodreads",
-            ]
+
+        if isinstance(seed_authors, str):
+            seed_authors = seed_authors.split(",")
+        self.seed_authors = [name.strip() for name in seed_authors or [] if name.strip()]
+        self.relevant_names = {normalize_name(name) for name in self.seed_authors}
+        self.max_depth = int(max_depth) if max_depth is not None else None
+        self.max_authors = int(max_authors) if max_authors is not None else None
+
+        self.frontier = None
+        # frontier key -> entry of the pages requested and not parsed yet
+        self.in_flight = {}
+        self.crawled = 0
+
+    def start_requests(self):
+        if not self.author_crawl:
+            yield from super().start_requests()
+            return
+
+        self.frontier = Frontier(self.frontier_size, seen_capacity=self.seen_capacity, seen_ttl=self.seen_ttl)
+        if self.checkpoint_file and self.frontier.load(self.checkpoint_file) is not None:
+            self.logger.info(f"Resuming the author crawl with {len(self.frontier)} pages in the frontier")
+
+        for name in self.seed_authors:
+            url = f"https://www.goodreads.com/search?q={quote_plus(name)}&search%5Bfield%5D=author"
+            self.frontier.push(url, f"search:{normalize_name(name)}", RELEVANT_PRIORITY, depth=0)
+        if not self.seed_authors:
+            for url in ("https://www.goodreads.com/", "https://www.goodreads.com/author/on_goodreads"):
+                self.frontier.push(url, page_key(url), 0, depth=0)
+
+        yield from self._schedule()
+
+    def _schedule(self):
+        """Request the best pages of the frontier, as long as there is room and budget"""
+        while len(self.in_flight) < self.max_in_flight and self.crawled + len(self.in_flight) < self.max_authors:
+            entry = self.frontier.pop()
+            if entry is None:
+                break
+            self.in_flight[entry.key] = entry
+            yield scrapy.Request(
+                entry.url,
+                callback=self.parse,
+                errback=self.on_error,
+                priority=int(entry.priority),
+                # the frontier already dedupes them
+                dont_filter=True,
+                meta={"frontier_key": entry.key},
+            )
+
+    def _done(self, key) -> None:
+        if self.in_flight.pop(key, None) is None:
+            return
+        self.frontier.crawled(key)
+        self.crawled += 1
+        self.crawler.stats.inc_value("author_crawl/pages")
+        if self.checkpoint_file and self.crawled % self.checkpoint_every == 0:
+            self.save_frontier(self)
+
+    def on_error(self, failure):
+        self._done(failure.request.meta.get("frontier_key"))
+        yield from self._schedule()
+
+    def save_frontier(self, spider, reason=None):
+        if self.frontier is None or not self.checkpoint_file:
+            return
+        self.frontier.save(self.checkpoint_file, in_flight=list(self.in_flight.values()), crawled=self.crawled)
+
+    def _follow(self, response, depth: int):
+        """Queue the authors linked from the page, return how many were new"""
+        links = [
+            ("influence", response.css('div.dataItem>span>a[href*="/author/show"]')),
+            ("similar", response.css('a[href*="/author/similar"]')[:1]),
+            ("page", response.css('a[href*="/author/show"]')),
+        ]
+        queued = 0
+        for kind, anchors in links:
+            for anchor in anchors:
+                href = anchor.attrib.get("href")
+                if not href:
+                    continue
+                url = response.urljoin(href)
+                # the name may be in a child element, e.g. a <span itemprop="name">
+                name = normalize_name(anchor.xpath("string()").get())
+                priority = LINK_PRIORITIES[kind] - depth
+                if name in self.relevant_names:
+                    priority += RELEVANT_PRIORITY
+                queued += self.frontier.push(url, page_key(url), priority, depth)
+        return queued
 
     def parse(self, response):
         url = response.request.url
 
         # Don't follow blog pages
         if "/blog?page=" in url:
+            if self.author_crawl:
+                self._done(response.meta.get("frontier_key"))
+                yield from self._schedule()
             return
 
         if url.startswith("https://www.goodreads.com/author/show/"):
@@ -43,27 +191,19 @@ class AuthorSpider(scrapy.Spider):
         if not self.author_crawl:
             return
 
-        # If an author crawl is enabled, we crawl similar authors for this author,
+        # If an author crawl is enabled, we queue similar authors for this author,
         # authors that influenced this author,
         # as well as any URL that looks like an author bio page
-        influence_author_urls = response.css(
-            'div.dataItem>span>a[href*="/author/show"]::attr(href)'
-        ).extract()
-
-        for author_url in influence_author_urls:
-            yield response.follow(author_url, callback=self.parse)
-
-        similar_authors = response.css(
-            'a[href*="/author/similar"]::attr(href)'
-        ).extract_first()
-        if similar_authors:
-            yield response.follow(similar_authors, callback=self.parse)
-
-        all_authors_on_this_page = response.css(
-            'a[href*="/author/show"]::attr(href)'
-        ).extract()
-        for author_url in all_authors_on_this_page:
-            yield response.follow(author_url, callback=self.parse)
+        key = response.meta.get("frontier_key")
+        entry = self.in_flight.get(key)
+        if entry is not None and entry.depth < self.max_depth:
+            queued = self._follow(response, entry.depth + 1)
+            self.crawler.stats.inc_value("author_crawl/queued", queued)
+        self._done(key)
+        self.crawler.stats.set_value("author_crawl/frontier", len(self.frontier))
+        self.crawler.stats.set_value("author_crawl/dropped", self.frontier.dropped)
+
+        yield from self._schedule()
 
     def parse_author(self, response):
         loader = AuthorLoader(AuthorItem(), response=response)
@@ -2,7 +2,7 @@
 
 import scrapy
 
-from ..items import BookItem, BookLoader
+from ..items import BOOK_PATHS, BookItem, BookLoader, extract_next_data
 
 
 class BookSpider(scrapy.Spider):
@@ -23,35 +23,17 @@ class BookSpider(scrapy.Spider):
 
     def parse(self, response, loader=None):
         if not loader:
-            loader = BookLoader(BookItem(), response=response)
+            # no response/selector on purpose: every field is read from the
+            # decoded __NEXT_DATA__, so there is no need to build the DOM
+            loader = BookLoader(BookItem())
 
         # loader.add_value('url', response.request.url)
 
         # The new Goodreads page sends JSON in a script tag
-        # that has these values
-
-        loader.add_css("title", "script#__NEXT_DATA__::text")
-        # loader.add_css('titleComplete', 'script#__NEXT_DATA__::text')
-        # loader.add_css('description', 'script#__NEXT_DATA__::text')
-        # loader.add_css('imageUrl', 'script#__NEXT_DATA__::text')
-        # loader.add_css('genres', 'script#__NEXT_DATA__::text')
-        # loader.add_css('asin', 'script#__NEXT_DATA__::text')
-        loader.add_css("isbn", "script#__NEXT_DATA__::text")
-        loader.add_css('isbn13', 'script#__NEXT_DATA__::text')
-        # loader.add_css('publisher', 'script#__NEXT_DATA__::text')
-        # loader.add_css('series', 'script#__NEXT_DATA__::text')
-        loader.add_css("author", "script#__NEXT_DATA__::text")
-        # loader.add_css('publishDate', 'script#__NEXT_DATA__::text')
-
-        # loader.add_css('characters', 'script#__NEXT_DATA__::text')
-        # loader.add_css('places', 'script#__NEXT_DATA__::text')
-        # loader.add_css('ratingHistogram', 'script#__NEXT_DATA__::text')
-        # loader.add_css("ratingsCount", 'script#__NEXT_DATA__::text')
-        # loader.add_css("reviewsCount", 'script#__NEXT_DATA__::text')
-        # loader.add_css('numPages', 'script#__NEXT_DATA__::text')
-        # loader.add_css("format", 'script#__NEXT_DATA__::text')
-
-        loader.add_css("language", "script#__NEXT_DATA__::text")
-        # loader.add_css("awards", 'script#__NEXT_DATA__::text')
+        # that has these values, decode it once and fill every
+        # BookItem field in a single walk over it
+        next_data = extract_next_data(response)
+        for field, values in BOOK_PATHS.match(next_data).items():
+            loader.add_value(field, values)
 
         yield loader.load_item()
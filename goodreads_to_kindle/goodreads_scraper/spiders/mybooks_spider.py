@@ -3,6 +3,8 @@
 import scrapy
 from scrapy import signals
 from .book_spider import BookSpider
+from ..book_cache import BookCache, book_id_from_url
+from ..items import BookItem
 
 
 class MyBooksSpider(scrapy.Spider):
@@ -10,6 +12,16 @@ class MyBooksSpider(scrapy.Spider):
 
     This subsequently passes on the URLs to BookSpider.
     Consequently, this spider also yields BookItem's and AuthorItem's.
+
+    Books found in the book cache (see BOOK_CACHE_* settings) are yielded
+    straight from it, without requesting their page.
+
+    Given the Goodreads ids of the books already known, or the id of the
+    newest book of the shelf at the last crawl (the high-water mark), the
+    shelf is crawled incrementally: sorted by date added, newest first, and
+    stopping after the first page made of known books only, or with the
+    high-water mark on it. The id of the newest book is kept in the stats,
+    under shelf/newest_book_id.
     """
 
     name = "mybooks"
@@ -18,20 +30,76 @@ class MyBooksSpider(scrapy.Spider):
         super()._set_crawler(crawler)
         crawler.signals.connect(self.item_scraped_callback, signal=signals.item_scraped)
 
-    def __init__(self, user_id, shelf, item_scraped_callback=None):
+        if crawler.settings.getbool("BOOK_CACHE_ENABLED"):
+            schema = ",".join(sorted(BookItem.fields))
+            self.book_cache = BookCache.from_settings(crawler.settings, schema=schema)
+            crawler.signals.connect(self.book_cache.close, signal=signals.spider_closed)
+
+    def __init__(self, user_id, shelf, item_scraped_callback=None, known_book_ids=None, high_water_mark=None):
         super().__init__()
         self.book_spider = BookSpider()
         self.item_scraped_callback = item_scraped_callback
-        self.start_urls = [
-            f"https://www.goodreads.com/review/list/{user_id}?shelf={shelf}"
-        ]
+        self.book_cache = None
+        self.user_id = user_id
+        self.shelf = shelf
+        self.known_book_ids = known_book_ids
+        self.high_water_mark = high_water_mark
+        self.incremental = known_book_ids is not None or high_water_mark is not None
+        self.newest_book_id = None
+        self.pages = 0
+        self.stopped_early = False
+        url = f"https://www.goodreads.com/review/list/{user_id}?shelf={shelf}"
+        if self.incremental:
+            url += "&sort=date_added&order=d"
+        self.start_urls = [url]
 
     def parse(self, response):
         book_urls = response.css("#booksBody .title a::attr(href)").extract()
+        book_ids = [book_id_from_url(book_url) for book_url in book_urls]
+        self.pages += 1
+        if book_ids and self.newest_book_id is None:
+            self.newest_book_id = book_ids[0]
+
+        for book_url, book_id in zip(book_urls, book_ids):
+            if self.book_cache and book_id:
+                cached = self.book_cache.get(book_id)
+                if cached is not None:
+                    self.crawler.stats.inc_value("book_cache/hit")
+                    yield BookItem(cached, book_id=book_id)
+                    continue
+                self.crawler.stats.inc_value("book_cache/miss")
 
-        for book_url in book_urls:
-            yield response.follow(book_url, callback=self.book_spider.parse)
+            # the book cache decides when a page is needed again, and a
+            # shelf must have all its books whatever the dupe filter saw before
+            yield response.follow(
+                book_url, callback=self.parse_book, cb_kwargs={"book_id": book_id}, dont_filter=True
+            )
 
-        next_page = response.css("a.next_page").attrib["href"]
+        if self.incremental and self._is_last_new_page(book_ids):
+            self.stopped_early = True
+            return
+
+        # the last page has a disabled span.next_page instead of a link
+        next_page = response.css("a.next_page::attr(href)").get()
         if next_page is not None:
             yield response.follow(next_page, callback=self.parse)
+
+    def _is_last_new_page(self, book_ids) -> bool:
+        """Whether the pages after this one only have books added before the last crawl"""
+        if self.high_water_mark is not None and self.high_water_mark in book_ids:
+            return True
+        return bool(book_ids) and bool(self.known_book_ids) and all(
+            book_id in self.known_book_ids for book_id in book_ids
+        )
+
+    def closed(self, reason):
+        self.crawler.stats.set_value("shelf/pages", self.pages)
+        self.crawler.stats.set_value("shelf/newest_book_id", self.newest_book_id)
+        self.crawler.stats.set_value("shelf/stopped_early", self.stopped_early)
+
+    def parse_book(self, response, book_id=None):
+        for item in self.book_spider.parse(response):
+            item["book_id"] = book_id
+            if self.book_cache and book_id:
+                self.book_cache.set(book_id, item)
+            yield item
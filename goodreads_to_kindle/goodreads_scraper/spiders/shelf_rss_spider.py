@@ -0,0 +1,148 @@
+"""Spider to extract the books of a 'My Books' shelf from its RSS feed"""
+
+from typing import Iterable, Iterator
+from xml.etree import ElementTree
+
+from .mybooks_spider import MyBooksSpider
+from ..items import BookItem
+
+# bytes of the downloaded feed fed to the XML parser at a time
+FEED_CHUNK_SIZE = 64 * 1024
+
+
+def parse_rss_items(chunks: Iterable[bytes]) -> Iterator[dict]:
+    """Yield the children of every <item> of an RSS document, as a tag -> text dict
+
+    Every item is dropped from the tree once yielded, so that the parsed
+    tree never holds more than about one chunk of items. This bounds the
+    tree, not the document: `chunks` are usually slices of a response
+    already downloaded in full.
+    """
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    channel = None
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if event == "start" and element.tag == "channel":
+                channel = element
+            elif event == "end" and element.tag == "item":
+                yield {child.tag: (child.text or "").strip() for child in element}
+                if channel is not None:
+                    channel.remove(element)
+    parser.close()
+
+
+class ShelfRssSpider(MyBooksSpider):
+    """Extract the books of one of the "My Books" shelves of a user from its RSS feed
+
+    Most entries of the feed already have the title, the author and the
+    ISBN of the book, so unlike MyBooksSpider there is no need to request
+    the page of every book. A book page (or its book cache entry) is only
+    used for the books missing one of SHELF_RSS_REQUIRED_FIELDS, entries
+    without a book id to find it are skipped.
+
+    The feed only names the first author of a book. Books with an ISBN are
+    keyed by it, but the others are keyed by their title and every author,
+    so "isbn" is required by default: the books without one take all their
+    authors from their page, as with MyBooksSpider. The feed has no
+    language either, the books taken from it have none unless "language"
+    is required too.
+
+    The feed has no link to its next page: pages are requested until one
+    is shorter than the first, or has no book the previous ones didn't.
+
+    The feed is sorted by date added, newest first, and is crawled
+    incrementally in the same way as MyBooksSpider.
+    """
+
+    name = "shelf_rss"
+
+    # feed entry tag -> BookItem field
+    RSS_FIELDS = {
+        "title": "title",
+        "author_name": "author",
+        "isbn": "isbn",
+        "book_id": "book_id",
+    }
+
+    def _set_crawler(self, crawler):
+        super()._set_crawler(crawler)
+        self.required_fields = crawler.settings.getlist("SHELF_RSS_REQUIRED_FIELDS")
+
+    def __init__(self, user_id, shelf, item_scraped_callback=None, known_book_ids=None, high_water_mark=None):
+        super().__init__(user_id, shelf, item_scraped_callback, known_book_ids, high_water_mark)
+        self.required_fields = ["title", "author", "isbn"]
+        self.feed_url = f"https://www.goodreads.com/review/list_rss/{user_id}?shelf={shelf}"
+        if self.incremental:
+            self.feed_url += "&sort=date_added&order=d"
+        self.page_size = None
+        self.seen_book_ids = set()
+        self.start_urls = [self.feed_url]
+
+    def parse(self, response, page=1):
+        # the feed is already downloaded, only the parsed tree is bounded
+        body = response.body
+        entries = parse_rss_items(
+            body[start:start + FEED_CHUNK_SIZE] for start in range(0, len(body), FEED_CHUNK_SIZE)
+        )
+
+        book_ids = []
+        new_book_ids = 0
+        for entry in entries:
+            item = self._book_item(entry)
+            book_id = item.get("book_id")
+            book_ids.append(book_id)
+            if self.newest_book_id is None:
+                self.newest_book_id = book_id
+            if book_id in self.seen_book_ids:
+                # repeated by a feed ignoring `page`
+                continue
+            if book_id:
+                self.seen_book_ids.add(book_id)
+                new_book_ids += 1
+
+            missing = [field for field in self.required_fields if not item.get(field)]
+            if not missing:
+                yield item
+                continue
+            if not book_id:
+                self.logger.warning(f"Skipping feed entry {item.get('title')!r} without a book id, missing {', '.join(missing)}")
+                self.crawler.stats.inc_value("shelf/skipped_entries")
+                continue
+
+            # Complete the entry with the book page, or its cache entry
+            if self.book_cache:
+                cached = self.book_cache.get(book_id)
+                if cached is not None:
+                    self.crawler.stats.inc_value("book_cache/hit")
+                    yield BookItem(cached, book_id=book_id)
+                    continue
+                self.crawler.stats.inc_value("book_cache/miss")
+            self.crawler.stats.inc_value("shelf/book_page_fallbacks")
+            yield response.follow(
+                f"/book/show/{book_id}", callback=self.parse_book, cb_kwargs={"book_id": book_id}, dont_filter=True
+            )
+        self.pages += 1
+
+        if self.incremental and self._is_last_new_page(book_ids):
+            self.stopped_early = True
+            return
+
+        # No link to the next page in a feed, the last page is the first one
+        # shorter than the others. A feed ignoring `page` repeats its books
+        if self.page_size is None:
+            self.page_size = len(book_ids)
+        if new_book_ids and len(book_ids) >= self.page_size:
+            yield response.follow(
+                f"{self.feed_url}&page={page + 1}", callback=self.parse, cb_kwargs={"page": page + 1}
+            )
+
+    def _book_item(self, entry: dict) -> BookItem:
+        item = BookItem()
+        for tag, field in self.RSS_FIELDS.items():
+            value = entry.get(tag)
+            if value:
+                # names sometimes have doubled spaces, unlike the book pages
+                value = " ".join(value.split())
+                item[field] = [value] if field == "author" else value
+        return item
@@ -1,38 +1,262 @@
-from email.message import EmailMessage
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage, MIMEPart
+from email.policy import SMTP
+from functools import partial
+from typing import Callable, Iterable, Iterator
+import asyncio
+import base64
+import logging
 import os
+import re
 import smtplib
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# A multiple of 57 bytes, which base64 encode to whole 76 characters lines
+ATTACHMENT_CHUNK_SIZE = 57 * 1024
+
+DOT_AT_LINE_START = re.compile(rb"(?m)^\.")
+
+
+def attachment_names(file_paths: list[str], file_names: list[str] | None) -> list[str]:
+    """Names of the attached files, the files' own unless given one for each"""
+    if file_names is None:
+        return [os.path.basename(file_path) for file_path in file_paths]
+    if len(file_names) != len(file_paths):
+        raise ValueError(f"{len(file_names)} attachment names given for {len(file_paths)} files")
+    return list(file_names)
 
 
 class EmailManager:
-    
-    def __init__(self, smtp: str, port: int, user: str, password: str):
+    """Sends emails through a single authenticated SMTP session
+
+    The session is opened on the first send and reused by the following
+    ones. After `idle_check` seconds without sending, its liveness is
+    checked with a NOOP, and a dropped session is transparently reopened.
+    Call `close` (or use the manager as a context manager) when done.
+    """
+
+    def __init__(self, smtp: str, port: int, user: str, password: str, starttls: bool = True, timeout: float = 60, idle_check: float = 10):
         self.smtp = smtp
         self.port = port
         self.user = user
         self.password = password
-        
-    
-    def send_mail(self, send_to: str, subject: str, text: str, file_paths: list[str]) -> None:
+        self.starttls = starttls
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self.server = None
+        self.last_used = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _connect(self) -> smtplib.SMTP:
+        logger.info(f"Connecting to {self.smtp}:{self.port}")
+        server = smtplib.SMTP(self.smtp, port=self.port, timeout=self.timeout)
+        if self.starttls:
+            server.starttls()
+        if self.password:
+            server.login(self.user, self.password)
+        return server
+
+    def _session(self) -> smtplib.SMTP:
+        if self.server is not None and time.monotonic() - self.last_used > self.idle_check:
+            try:
+                alive = self.server.noop()[0] == 250
+            except (smtplib.SMTPException, OSError):
+                alive = False
+            if not alive:
+                logger.info("SMTP session dropped, reconnecting")
+                self._discard()
+
+        if self.server is None:
+            self.server = self._connect()
+        return self.server
+
+    def _discard(self) -> None:
+        # nothing to discard when the connection itself failed
+        if self.server is None:
+            return
+        try:
+            self.server.close()
+        finally:
+            self.server = None
+
+    def close(self) -> None:
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        finally:
+            self._discard()
+
+    def _with_session(self, send: Callable[[smtplib.SMTP], None]) -> None:
+        try:
+            send(self._session())
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # dropped between the liveness check and the send, retry once
+            self._discard()
+            send(self._session())
+        except Exception:
+            # possibly failed halfway through a message, don't reuse the session
+            self._discard()
+            raise
+        self.last_used = time.monotonic()
+
+    def _skeleton(self, recipients: list[str], subject: str, text: str, file_names: list[str]) -> tuple[bytes, list[bytes]]:
+        """Render the message with a unique marker in place of each attachment body"""
         email = EmailMessage()
         email["From"] = self.user
-        email["To"] = send_to
+        email["To"] = ", ".join(recipients)
         email["Subject"] = subject
         email.set_content(text)
 
-        # attach files
-        for file_path in file_paths:
+        markers = []
+        if file_names:
+            email.make_mixed()
+        for file_name in file_names:
+            marker = f"attachment-{uuid.uuid4().hex}"
+            part = MIMEPart()
+            part["Content-Type"] = "application/octet-stream"
+            part["Content-Transfer-Encoding"] = "base64"
+            part.add_header("Content-Disposition", "attachment", filename=file_name)
+            part.set_payload(marker)
+            email.attach(part)
+            markers.append(marker.encode())
+
+        return email.as_bytes(policy=SMTP), markers
+
+    @staticmethod
+    def _message_chunks(skeleton: bytes, markers: list[bytes], file_paths: list[str]) -> Iterator[bytes]:
+        """Yield the message, base64 encoding the attachments a chunk at a time"""
+        rest = skeleton
+        for marker, file_path in zip(markers, file_paths):
+            head, rest = rest.split(marker, 1)
+            yield DOT_AT_LINE_START.sub(b"..", head)
             with open(file_path, "rb") as file:
-                file_data = file.read()
-                email.add_attachment(
-                    file_data,
-                    maintype="application",
-                    subtype="octet-stream",
-                    filename=os.path.basename(file_path),
-                )
-        
-        server = smtplib.SMTP(self.smtp, port=self.port)
-        server.starttls()
-        server.login(self.user, self.password)
-        server.sendmail(self.user, send_to, email.as_string())
-        server.quit()
+                chunk = file.read(ATTACHMENT_CHUNK_SIZE)
+                while chunk:
+                    next_chunk = file.read(ATTACHMENT_CHUNK_SIZE)
+                    encoded = base64.encodebytes(chunk).replace(b"\n", b"\r\n")
+                    # the line break before the next boundary is already in the skeleton
+                    yield encoded if next_chunk else encoded[:-2]
+                    chunk = next_chunk
+        yield DOT_AT_LINE_START.sub(b"..", rest)
+
+    def _send_data(self, server: smtplib.SMTP, recipients: list[str], chunks: Iterable[bytes]) -> None:
+        """Like SMTP.sendmail, but writes the message to the socket as it's produced"""
+        server.ehlo_or_helo_if_needed()
+        code, response = server.mail(self.user)
+        if code != 250:
+            server.rset()
+            raise smtplib.SMTPSenderRefused(code, response, self.user)
+        for recipient in recipients:
+            code, response = server.rcpt(recipient)
+            if code not in (250, 251):
+                server.rset()
+                raise smtplib.SMTPRecipientsRefused({recipient: (code, response)})
+        code, response = server.docmd("data")
+        if code != 354:
+            server.rset()
+            raise smtplib.SMTPDataError(code, response)
+
+        last = b""
+        for chunk in chunks:
+            if chunk:
+                server.send(chunk)
+                last = chunk
+        server.send(b".\r\n" if last.endswith(b"\r\n") else b"\r\n.\r\n")
+        code, response = server.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, response)
+
+    def send_mail(self, send_to: str | list[str], subject: str, text: str, file_paths: list[str], file_names: list[str] | None = None) -> None:
+        """Send an email with the given files attached
+
+        Attachments are never loaded in memory as a whole: they are read,
+        base64 encoded and written to the SMTP socket a chunk at a time.
+        """
+        recipients = [send_to] if isinstance(send_to, str) else list(send_to)
+        file_names = attachment_names(file_paths, file_names)
+        skeleton, markers = self._skeleton(recipients, subject, text, file_names)
+
+        self._with_session(
+            lambda server: self._send_data(server, recipients, self._message_chunks(skeleton, markers, file_paths))
+        )
+
+
+class AsyncEmailManager:
+    """Non-blocking email delivery for asyncio code
+
+    Emails are put on a bounded queue and sent by `workers` workers, each
+    with its own EmailManager session, in a thread pool so the event loop
+    never waits on SMTP. `send_mail` waits while the queue is full, which
+    slows producers down to the delivery rate, and returns a future
+    resolved once the email has been sent (or failed).
+    """
+
+    def __init__(self, smtp: str, port: int, user: str, password: str, workers: int = 2, queue_size: int = 8, **kwargs):
+        self.managers = [EmailManager(smtp, port, user, password, **kwargs) for _ in range(workers)]
+        self.queue_size = queue_size
+        self.queue = None
+        self.executor = None
+        self.tasks = []
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def start(self) -> None:
+        if self.tasks:
+            return
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=len(self.managers), thread_name_prefix="smtp")
+        self.tasks = [asyncio.create_task(self._work(manager)) for manager in self.managers]
+
+    async def send_mail(self, send_to: str | list[str], subject: str, text: str, file_paths: list[str], file_names: list[str] | None = None) -> asyncio.Future:
+        """Queue an email, waiting for room in the queue, and return its delivery future"""
+        # fail now rather than in the delivery future
+        attachment_names(file_paths, file_names)
+        self.start()
+        sent = asyncio.get_running_loop().create_future()
+        await self.queue.put((partial(EmailManager.send_mail, send_to=send_to, subject=subject, text=text, file_paths=file_paths, file_names=file_names), sent))
+        return sent
+
+    async def _work(self, manager: EmailManager) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            send, sent = await self.queue.get()
+            try:
+                if not sent.cancelled():
+                    await loop.run_in_executor(self.executor, send, manager)
+                    if not sent.done():
+                        sent.set_result(None)
+            except Exception as e:
+                if not sent.done():
+                    sent.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+    async def close(self) -> None:
+        """Wait for the queued emails to be sent, then close every session"""
+        if not self.tasks:
+            return
+        await self.queue.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
 
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, manager.close) for manager in self.managers))
+        self.executor.shutdown()
@@ -1,13 +1,19 @@
-from goodreads_scraper.crawl import fetch_want_to_read
-from book_provider import ZlibBookProvider
+# Scrapy, Z-Library, SMTP, Calibre and Pillow are only imported by the
+# stages using them, a run with nothing to do never loads them
 from constants import LANG_MAP, DATA_FOLDER
 from exceptions import BookNotFoundException
-from mail import EmailManager
-from models import GoodReadsBook
-from repository import JsonRepository
+from metrics import RunMetrics
+from models import GoodReadsBook, ShelfState, User
+from pipeline import Pipeline, SingleFlight, Stage
+from repository import JsonRepository, SqliteRepository
 from settings import Settings
 
+import asyncio
+import contextlib
+import functools
 import logging
+from dataclasses import dataclass
+from pathlib import Path
 
 def setup_logging(log_file: str = "main.log", level: int = logging.INFO):
     logger = logging.getLogger()  # root logger
@@ -26,67 +32,309 @@ def setup_logging(log_file: str = "main.log", level: int = logging.INFO):
     logger.addHandler(file_handler)
 
 
-async def main():
-    settings = Settings()
+@dataclass
+class Delivery:
+    """A book on its way to a user, passed along the pipeline stages"""
+    user: User
+    book: GoodReadsBook
+    # Goodreads id of the book
+    book_id: str | None = None
+    file: Path | None = None
+    sent: asyncio.Future | None = None
+    original_bytes: int | None = None
+    sent_bytes: int | None = None
+
+    def __str__(self):
+        return f"{self.book.title} for {self.user.goodreads_id}"
+
+
+class GoodreadsToKindle:
+    """Sends the books on the users' to-read shelves to their Kindles
+
+    Holds everything a run needs: the repository, the SMTP sessions, the
+    book provider and so on. The daemon keeps one instance alive and runs
+    it over and over, so all of them stay warm between runs.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        # metrics of the first run, the daemon starts new ones for the next runs
+        self.start_metrics()
+
+        if settings.repository == "sqlite":
+            self.repository = SqliteRepository(workdir=DATA_FOLDER)
+        else:
+            self.repository = JsonRepository(workdir=DATA_FOLDER)
+
+        # Each file is converted once, and cached across runs by the converter
+        self.converter = None
+        if settings.convert_format:
+            from converter import EbookConverter
+
+            self.converter = EbookConverter(self.repository, max_workers=settings.conversion_workers, timeout=settings.conversion_timeout)
+
+        self.optimizer = None
+        if settings.optimize_epubs:
+            from epub_optimizer import EpubOptimizer
+
+            self.optimizer = EpubOptimizer(self.repository, max_workers=settings.optimizer_workers, max_image_size=settings.max_image_size)
 
-    email_manager = EmailManager(
-        smtp=settings.email_smtp,
-        port=settings.email_smtp_port,
-        user=settings.email_user,
-        password=settings.email_password,
-    )
+        # Goodreads id -> keys of the books on the user's shelf, as of their last crawl that
+        # wasn't interrupted, only the books of the newest pages if in partial_shelves
+        self.shelves: dict[str, set[str]] = {}
+        # Goodreads ids of the users whose last crawl stopped early, being incremental
+        self.partial_shelves: set[str] = set()
+        # Goodreads id -> what is known of the user's shelf, when crawled incrementally
+        self.shelf_states: dict[str, ShelfState] = {}
 
-    repository = JsonRepository(workdir=DATA_FOLDER)
-    book_provider =  ZlibBookProvider(settings.zlib_email, settings.zlib_password)
+    @functools.cached_property
+    def email_manager(self):
+        from mail import AsyncEmailManager
+
+        settings = self.settings
+        return AsyncEmailManager(
+            smtp=settings.email_smtp,
+            port=settings.email_smtp_port,
+            user=settings.email_user,
+            password=settings.email_password,
+            workers=settings.email_workers,
+            queue_size=settings.email_queue_size,
+        )
+
+    @functools.cached_property
+    def book_provider(self):
+        from book_provider import ZlibBookProvider
+
+        return ZlibBookProvider(self.settings.zlib_email, self.settings.zlib_password)
+
+    async def fetch_shelf(self, user: User):
+        from goodreads_scraper.crawl import fetch_want_to_read_stream
 
-    for user in repository.list_users():
         print(f"Checking user {user.goodreads_id}")
-        to_read_shelf = [GoodReadsBook.from_scraped_item(item) for item in await fetch_want_to_read(user.goodreads_id)]
-        missing = [book for book in to_read_shelf if book not in user.books_sent_to_kindle]
-
-        print(f"Found {len(missing)} new books")
-        for book in missing:
-            print(f"Finding book {book.title}...")
-
-            # Search for the book in the repository
-            book_file_to_send = repository.get_book_path(book)
-
-            # If we don't have the book, try to download it
-            if not book_file_to_send:
-                try:
-                    downloaded_book_file = await book_provider.download_book(book, DATA_FOLDER)
-                    book_file_to_send = repository.add_book_file(downloaded_book_file, book)
-                    downloaded_book_file.unlink()
-                    print(f"Book {book.title} downloaded.")
-                except BookNotFoundException:
-                    print(f"Book {book.title} not found")
-                    continue
+        incremental = {}
+        if self.settings.incremental_shelves:
+            state = await asyncio.to_thread(self.repository.get_shelf_state, user)
+            self.shelf_states[user.goodreads_id] = state
+            # only the pages with books added since the last run are crawled. The spider
+            # reads the ids in the reactor thread while they are added to here, give it a copy
+            incremental = dict(known_book_ids=frozenset(state.known_book_ids), high_water_mark=state.high_water_mark)
+
+        stats = {}
+        shelf = set()
+        book_ids = set()
+        try:
+            # Books are passed on as soon as they are scraped,
+            # while the rest of the shelf is still being crawled
+            # closed right away if the pipeline stops early, which stops the crawl
+            async with contextlib.aclosing(
+                fetch_want_to_read_stream(user.goodreads_id, stats=stats, source=self.settings.shelf_source, **incremental)
+            ) as items:
+                async for item in items:
+                    self.metrics.count("books_scraped")
+                    book = GoodReadsBook.from_scraped_item(item)
+                    shelf.add(str(book.key()))
+                    self.shelf_authors.update(book.authors)
+                    if item.get("book_id"):
+                        book_ids.add(item["book_id"])
+                    yield Delivery(user, book, book_id=item.get("book_id"))
+            self.shelves[user.goodreads_id] = shelf
+            if stats.get("shelf/stopped_early"):
+                self.partial_shelves.add(user.goodreads_id)
             else:
-                print(f"Book {book.title} found in the repository")
-
-            # Send the book
-            if book_file_to_send:
-                email_manager.send_mail(
-                    send_to=[user.kindle_email],
-                    subject=f"GoodreadsToKindle - {book.title}",
-                    text=f"This is your requested book: {book.title} by {', '.join(book.authors)}.\n\n--\n\n",
-                    file_paths=[str(book_file_to_send)],
-                )
-                print(f"Book {book.title} sent to {user.kindle_email}")
-
-                # Update the user in the repository
-                user.books_sent_to_kindle.append(book)
-                repository.update_user(user)
-        
-        
-    
+                self.partial_shelves.discard(user.goodreads_id)
+            self.metrics.count("shelf_pages", stats.get("shelf/pages", 0))
+            if incremental:
+                self.crawled_shelves[user.goodreads_id] = (book_ids, stats.get("shelf/newest_book_id"))
+        finally:
+            self.metrics.add_scrapy_stats(user.goodreads_id, stats)
+
+    def mark_known(self, delivery: Delivery) -> None:
+        state = self.shelf_states.get(delivery.user.goodreads_id)
+        if state is not None and delivery.book_id:
+            state.known_book_ids.add(delivery.book_id)
+
+    async def diff(self, delivery: Delivery) -> Delivery | None:
+        if not self.repository.was_book_sent(delivery.user, delivery.book):
+            return delivery
+        self.mark_known(delivery)
+        self.metrics.count("books_already_sent")
+
+    async def resolve_book(self, book: GoodReadsBook) -> Path | None:
+        print(f"Finding book {book.title}...")
+
+        # Search for the book in the repository
+        book_file = self.repository.get_book_path(book)
+        if book_file:
+            print(f"Book {book.title} found in the repository")
+            self.metrics.count("books_in_repository")
+            return book_file
+
+        # If we don't have the book, try to download it
+        try:
+            chunks, extension = await self.book_provider.fetch_book(book)
+            # Written straight into the repository, hashed on the way
+            book_file = await asyncio.to_thread(self.repository.add_book_content, book, chunks, extension)
+        except BookNotFoundException:
+            print(f"Book {book.title} not found")
+            self.metrics.count("books_not_found")
+            return None
+        print(f"Book {book.title} downloaded.")
+        self.metrics.count("books_downloaded")
+        return book_file
+
+    async def acquire(self, delivery: Delivery) -> Delivery | None:
+        # A book wanted by several users is looked up and downloaded only once
+        delivery.file = await self.resolved_books.do(delivery.book.key(), self.resolve_book, delivery.book)
+        if delivery.file:
+            return delivery
+
+    async def convert(self, delivery: Delivery) -> Delivery:
+        format = self.settings.convert_format
+        delivery.file = await self.converted_books.do((delivery.file, format), self.converter.convert, delivery.file, format)
+        return delivery
+
+    async def optimize(self, delivery: Delivery) -> Delivery:
+        delivery.original_bytes = delivery.file.stat().st_size
+        delivery.file = await self.optimized_books.do(delivery.file, self.optimizer.optimize, delivery.file)
+        return delivery
+
+    async def send(self, delivery: Delivery) -> Delivery:
+        # Waits only while the send queue is full
+        book = delivery.book
+        delivery.sent_bytes = delivery.file.stat().st_size
+        delivery.sent = await self.email_manager.send_mail(
+            send_to=[delivery.user.kindle_email],
+            subject=f"GoodreadsToKindle - {book.title}",
+            text=f"This is your requested book: {book.title} by {', '.join(book.authors)}.\n\n--\n\n",
+            file_paths=[str(delivery.file)],
+            file_names=[f"{book.title}{delivery.file.suffix}"],
+        )
+        return delivery
+
+    async def record(self, delivery: Delivery) -> None:
+        # Update the user in the repository once delivered
+        await delivery.sent
+        original_bytes = delivery.original_bytes or delivery.sent_bytes
+        print(f"Book {delivery.book.title} sent to {delivery.user.kindle_email} ({original_bytes} -> {delivery.sent_bytes} bytes)")
+        self.repository.mark_book_sent(delivery.user, delivery.book, original_bytes=original_bytes, sent_bytes=delivery.sent_bytes)
+        self.mark_known(delivery)
+        self.metrics.count("books_sent")
+        self.metrics.count("bytes_sent", delivery.sent_bytes)
+        self.metrics.count("bytes_saved", original_bytes - delivery.sent_bytes)
+
+    def save_shelf_states(self, users: list[User]) -> None:
+        for goodreads_id, (book_ids, newest_book_id) in self.crawled_shelves.items():
+            state = self.shelf_states[goodreads_id]
+            # the mark only moves once every book newer than it was sent,
+            # until then the books not found are looked for again at each run
+            if newest_book_id and book_ids <= state.known_book_ids:
+                state.high_water_mark = newest_book_id
+        for user in users:
+            if user.goodreads_id in self.shelf_states:
+                self.repository.update_shelf_state(user, self.shelf_states[user.goodreads_id])
+
+    async def crawl_authors(self, author_names: list[str]) -> None:
+        """Scrape the pages of `author_names`, and of the authors close to them, into the repository"""
+        from goodreads_scraper.crawl import crawl_authors
+
+        try:
+            authors = await crawl_authors(author_names)
+        except Exception:
+            logging.exception("Author crawl failed")
+            return
+        await asyncio.to_thread(self.repository.update_authors, authors)
+        self.metrics.count("authors_scraped", len(authors))
+
+    def start_metrics(self) -> None:
+        """Start the metrics of a new run, before anything of it is timed"""
+        self.metrics = RunMetrics()
+
+    def load_users(self) -> list[User]:
+        """The users of the repository, the ones added as JSON files since the last time imported first"""
+        if isinstance(self.repository, SqliteRepository):
+            self.repository.migrate_from_json()
+        return self.repository.list_users()
+
+    def list_users(self) -> list[User]:
+        with self.metrics.span("list_users"):
+            return self.load_users()
+
+    async def run(self, users: list[User]) -> None:
+        """Check the shelves of `users`, and send them their new books"""
+        settings = self.settings
+        # results are shared within a run only, a book not found may show up later
+        self.resolved_books = SingleFlight()
+        self.converted_books = SingleFlight()
+        self.optimized_books = SingleFlight()
+        self.shelf_states = {}
+        self.crawled_shelves: dict[str, tuple[set[str], str | None]] = {}
+        # authors of the books on the shelves crawled
+        self.shelf_authors: set[str] = set()
+
+        stages = [
+            Stage("fetch", self.fetch_shelf, concurrency=settings.fetch_concurrency),
+            Stage("diff", self.diff),
+            Stage("acquire", self.acquire, concurrency=settings.acquire_concurrency),
+            Stage("send", self.send),
+            Stage("record", self.record, concurrency=settings.email_workers + settings.email_queue_size),
+        ]
+        if self.converter:
+            # the converter bounds the running conversions, let the others wait on it
+            stages.insert(3, Stage("convert", self.convert, concurrency=settings.acquire_concurrency + settings.conversion_workers))
+        if self.optimizer:
+            # right before sending, after any conversion
+            stages.insert(-2, Stage("optimize", self.optimize, concurrency=settings.optimizer_workers))
+        # Users go in the first stage, deliveries in the others
+        pipeline = Pipeline(stages, metrics=self.metrics, label=lambda item: getattr(item, "user", item).goodreads_id)
+        await pipeline.run(users)
+        with self.metrics.span("save_shelf_states"):
+            self.save_shelf_states(users)
+        # index of the book files stored during the run
+        await asyncio.to_thread(self.repository.flush)
+        if settings.crawl_authors and self.shelf_authors:
+            with self.metrics.span("crawl_authors"):
+                await self.crawl_authors(sorted(self.shelf_authors))
+
+    def write_report(self) -> None:
+        """End the metrics of the run, and write them out"""
+        self.metrics.finish()
+        self.metrics.write_json(Path(self.settings.run_report_file))
+        self.metrics.write_prometheus(Path(self.settings.prometheus_file))
+
+    async def close(self) -> None:
+        if self.optimizer:
+            self.optimizer.close()
+        # Wait for the queued emails, then close the SMTP sessions
+        if "email_manager" in self.__dict__:
+            with self.metrics.span("close_email"):
+                await self.email_manager.close()
+        self.repository.close()
+
+
+async def main():
+    app = GoodreadsToKindle(Settings())
+    try:
+        await app.run(app.list_users())
+    finally:
+        await app.close()
+        app.write_report()
 
 
 if __name__ == "__main__":
-    import asyncio
+    import argparse
+
     from dotenv import load_dotenv
 
+    parser = argparse.ArgumentParser(description="Send the books on Goodreads to-read shelves to Kindles")
+    parser.add_argument("--daemon", action="store_true", help="keep running, checking every shelf on its own schedule")
+    args = parser.parse_args()
+
     load_dotenv()
     setup_logging()
 
-    asyncio.run(main())
+    if args.daemon:
+        from daemon import serve
+
+        asyncio.run(serve(GoodreadsToKindle(Settings())))
+    else:
+        asyncio.run(main())
@@ -0,0 +1,161 @@
+"""Timings and counts of a run
+
+Every stage of a run is timed with `RunMetrics.span`, per user. At the end
+of the run the report is written as JSON, together with the Scrapy stats
+of every crawl, and as a file for the Prometheus node exporter textfile
+collector.
+"""
+import json
+import os
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+METRIC_PREFIX = "goodreads_to_kindle"
+
+# Scrapy stats exported to Prometheus, the JSON report has all of them
+SCRAPY_STATS = {
+    "downloader/request_count": "requests",
+    "downloader/response_count": "responses",
+    "downloader/response_bytes": "response_bytes",
+    "item_scraped_count": "items",
+    "book_cache/hit": "book_cache_hits",
+    "book_cache/miss": "book_cache_misses",
+    "shelf/pages": "shelf_pages",
+    "snapshot/added": "shelf_books_added",
+    "snapshot/removed": "shelf_books_removed",
+    "elapsed_time_seconds": "elapsed_seconds",
+}
+
+
+@dataclass
+class SpanMetrics:
+    count: int = 0
+    errors: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def add(self, seconds: float, failed: bool) -> None:
+        self.count += 1
+        self.errors += failed
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+
+class RunMetrics:
+    def __init__(self):
+        self.started_at = time.time()
+        self.finished_at = None
+        # stage -> user -> metrics
+        self.spans: dict[str, dict[str, SpanMetrics]] = defaultdict(lambda: defaultdict(SpanMetrics))
+        self.counters: dict[str, int] = defaultdict(int)
+        # user -> Scrapy stats of the crawl
+        self.scrapy_stats: dict[str, dict] = {}
+
+    @contextmanager
+    def span(self, stage: str, user: str = ""):
+        """Time the block as a `stage` of `user`, counting it as an error if it raises"""
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.spans[stage][user].add(time.perf_counter() - start, failed)
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] += value
+
+    def add_scrapy_stats(self, user: str, stats: dict) -> None:
+        self.scrapy_stats[user] = stats
+
+    def finish(self) -> None:
+        self.finished_at = time.time()
+
+    def report(self) -> dict:
+        stages = {}
+        for stage, users in self.spans.items():
+            total = SpanMetrics()
+            for metrics in users.values():
+                total.count += metrics.count
+                total.errors += metrics.errors
+                total.total_seconds += metrics.total_seconds
+                total.max_seconds = max(total.max_seconds, metrics.max_seconds)
+            stages[stage] = {**asdict(total), "users": {user: asdict(metrics) for user, metrics in users.items()}}
+
+        finished_at = self.finished_at or time.time()
+        return {
+            "started_at": self.started_at,
+            "finished_at": finished_at,
+            "duration_seconds": finished_at - self.started_at,
+            "stages": stages,
+            "counters": dict(self.counters),
+            "scrapy": self.scrapy_stats,
+        }
+
+    def write_json(self, path: Path) -> None:
+        # Scrapy stats have datetimes
+        write_atomic(path, json.dumps(self.report(), indent=2, sort_keys=True, default=str))
+
+    def write_prometheus(self, path: Path) -> None:
+        report = self.report()
+        lines = []
+
+        def metric(name: str, kind: str, description: str, samples: list[tuple[dict, float]]) -> None:
+            name = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{escape_label(str(label))}"' for key, label in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        metric("run_start_timestamp_seconds", "gauge", "When the last run started.", [({}, report["started_at"])])
+        metric("run_duration_seconds", "gauge", "How long the last run took.", [({}, report["duration_seconds"])])
+
+        per_user = [
+            (stage, user, metrics)
+            for stage, stage_metrics in report["stages"].items()
+            for user, metrics in stage_metrics["users"].items()
+        ]
+        for field, description in (
+            ("count", "Items handled by the stage in the last run."),
+            ("errors", "Items the stage failed on in the last run."),
+            ("total_seconds", "Time spent in the stage in the last run."),
+            ("max_seconds", "Longest time spent on an item by the stage in the last run."),
+        ):
+            metric(
+                f"stage_{field}", "gauge", description,
+                [({"stage": stage, "user": user}, metrics[field]) for stage, user, metrics in per_user],
+            )
+
+        for name, value in report["counters"].items():
+            metric(sanitize_name(name), "gauge", f"{name} in the last run.", [({}, value)])
+
+        for stat, name in SCRAPY_STATS.items():
+            samples = [
+                ({"user": user}, stats[stat])
+                for user, stats in report["scrapy"].items()
+                if isinstance(stats.get(stat), (int, float))
+            ]
+            if samples:
+                metric(f"scrapy_{name}", "gauge", f"Scrapy {stat} of the last crawl.", samples)
+
+        write_atomic(path, "\n".join(lines) + "\n")
+
+
+def sanitize_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def write_atomic(path: Path, content: str) -> None:
+    # the textfile collector may read the file at any time
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(content)
+    os.replace(tmp_path, path)
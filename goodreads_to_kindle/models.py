@@ -1,7 +1,103 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from dataclasses_json import dataclass_json
+from dataclasses import dataclass, field
+from functools import cached_property
+import hashlib
+import re
+import threading
+import unicodedata
+
+# classes whose dataclasses_json methods aren't loaded yet
+_json_classes = []
+_json_lock = threading.Lock()
+
+
+def dataclass_json(cls):
+    """dataclasses_json.dataclass_json, imported the first time an object is (de)serialized
+
+    It's one of the slowest imports of the app, and a run with nothing to
+    do never needs it.
+    """
+    _json_classes.append(cls)
+    for name in ("to_json", "to_dict"):
+        setattr(cls, name, _deferred_method(name))
+    for name in ("from_json", "from_dict", "schema"):
+        setattr(cls, name, classmethod(_deferred_method(name)))
+    return cls
+
+
+def _deferred_method(name: str):
+    def method(self_or_cls, *args, **kwargs):
+        with _json_lock:
+            if _json_classes:
+                import dataclasses_json
+
+                for cls in _json_classes:
+                    dataclasses_json.dataclass_json(cls)
+                _json_classes.clear()
+        # replaced by the real one by now
+        return getattr(self_or_cls, name)(*args, **kwargs)
+
+    return method
+
+
+def normalize_isbn13(isbn: str | None) -> str | None:
+    """Return the ISBN-13 of an ISBN-10 or ISBN-13, None if it doesn't look like one"""
+    if not isbn:
+        return None
+    isbn = re.sub(r"[^0-9Xx]", "", isbn).upper()
+    if len(isbn) == 13 and isbn.isdigit():
+        return isbn
+    if len(isbn) == 10 and isbn[:9].isdigit():
+        digits = "978" + isbn[:9]
+        total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits))
+        return digits + str((10 - total % 10) % 10)
+    return None
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, strip accents and punctuation, collapse whitespace"""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+
+@dataclass(frozen=True)
+class BookKey:
+    """Canonical identity of a book, stable across re-scrapes
+
+    The ISBN-13 (converted from the ISBN-10 if needed) when known,
+    otherwise a hash of the normalized title and sorted authors. The
+    language and the order of the authors don't matter.
+
+    A book scraped once with its ISBN and once without has two different
+    keys, so books are matched by any of their keys, see `all_of`.
+    """
+
+    kind: str
+    value: str
+
+    @classmethod
+    def of(cls, book: GoodReadsBook) -> BookKey:
+        isbn13 = normalize_isbn13(book.isbn13) or normalize_isbn13(book.isbn)
+        if isbn13:
+            return cls("isbn13", isbn13)
+        return cls.of_title(book)
+
+    @classmethod
+    def of_title(cls, book: GoodReadsBook) -> BookKey:
+        authors = sorted(normalize_text(author) for author in book.authors)
+        digest = hashlib.sha1("\n".join([normalize_text(book.title), *authors]).encode())
+        return cls("title", digest.hexdigest()[:20])
+
+    @classmethod
+    def all_of(cls, book: GoodReadsBook) -> frozenset[BookKey]:
+        """Every key `book` is matched by: its canonical key and its title key"""
+        return frozenset({cls.of(book), cls.of_title(book)})
+
+    def __str__(self) -> str:
+        return f"{self.kind}:{self.value}"
 
 
 @dataclass_json
@@ -20,6 +116,9 @@ class GoodReadsBook:
             file_name_parts.append(self.language.lower())
         return "___".join(file_name_parts)
 
+    def key(self) -> BookKey:
+        return BookKey.of(self)
+
     @classmethod
     def from_scraped_item(cls, item: dict) -> GoodReadsBook:
         return cls(
@@ -31,10 +130,43 @@ class GoodReadsBook:
         )
     
 
+@dataclass_json
+@dataclass
+class SendSizes:
+    """Size of a book as found, and of the attachment actually sent"""
+    original_bytes: int | None = None
+    sent_bytes: int | None = None
+
+
 @dataclass_json
 @dataclass
 class User:
     goodreads_id: str
     kindle_email: str
     books_sent_to_kindle: list[GoodReadsBook]
+    # str(BookKey) -> sizes, of the books sent since the sizes are recorded
+    send_sizes: dict[str, SendSizes] = field(default_factory=dict)
+
+    @cached_property
+    def sent_keys(self) -> set[BookKey]:
+        # not a dataclass field: neither serialized nor compared.
+        # Kept in sync by add_sent_book, so use it instead of appending
+        # to books_sent_to_kindle directly
+        return {key for book in self.books_sent_to_kindle for key in BookKey.all_of(book)}
+
+    def has_received(self, book: GoodReadsBook) -> bool:
+        return not self.sent_keys.isdisjoint(BookKey.all_of(book))
 
+    def add_sent_book(self, book: GoodReadsBook) -> None:
+        self.books_sent_to_kindle.append(book)
+        self.sent_keys.update(BookKey.all_of(book))
+
+
+@dataclass_json
+@dataclass
+class ShelfState:
+    """What is known of a user's shelf, to only crawl its newest pages"""
+    # Goodreads ids of the books on the shelf already sent to the user
+    known_book_ids: set[str] = field(default_factory=set)
+    # Goodreads id of the newest book on the shelf, as of the last crawl all of whose books were sent
+    high_water_mark: str | None = None
@@ -0,0 +1,113 @@
+import asyncio
+import contextlib
+import inspect
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Hashable, Iterable
+
+from metrics import RunMetrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Stage:
+    """A step of a Pipeline
+
+    `handler` is called on every item coming from the previous stage, by up
+    to `concurrency` workers at a time. A coroutine handler passes on its
+    return value (None drops the item), an async generator handler passes on
+    everything it yields. `queue_size` bounds the items waiting for the
+    stage, so a slow stage holds back the ones before it.
+    """
+    name: str
+    handler: Callable[[Any], Any]
+    concurrency: int = 1
+    queue_size: int = 16
+
+
+class Pipeline:
+    """Runs items through stages connected by bounded queues
+
+    All the stages work at the same time, so a run takes about as long as
+    its slowest stage needs for all the items, instead of the sum of every
+    stage latency for each item. An error handling an item is logged and
+    drops that item only.
+
+    With `metrics`, every item handled by a stage is timed as a span of that
+    stage, labelled with `label(item)`.
+    """
+
+    def __init__(self, stages: list[Stage], metrics: RunMetrics | None = None, label: Callable[[Any], str] = str):
+        self.stages = stages
+        self.metrics = metrics
+        self.label = label
+
+    async def run(self, items: Iterable) -> None:
+        queues = [asyncio.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        outputs = queues[1:] + [None]
+        workers = [
+            [asyncio.create_task(self._work(stage, queue, output)) for _ in range(stage.concurrency)]
+            for stage, queue, output in zip(self.stages, queues, outputs)
+        ]
+
+        try:
+            for item in items:
+                await queues[0].put(item)
+            # a stage is done once its queue is drained, and the previous ones are done
+            for queue, stage_workers in zip(queues, workers):
+                await queue.join()
+                for worker in stage_workers:
+                    worker.cancel()
+        finally:
+            all_workers = [worker for stage_workers in workers for worker in stage_workers]
+            for worker in all_workers:
+                worker.cancel()
+            await asyncio.gather(*all_workers, return_exceptions=True)
+
+    async def _work(self, stage: Stage, queue: asyncio.Queue, output: asyncio.Queue | None) -> None:
+        async def emit(result):
+            if result is not None and output is not None:
+                await output.put(result)
+
+        while True:
+            item = await queue.get()
+            try:
+                if inspect.isasyncgenfunction(stage.handler):
+                    # includes the time spent waiting for the next stages
+                    # closed right away when the worker is cancelled, rather than by the GC
+                    with self._span(stage, item):
+                        async with contextlib.aclosing(stage.handler(item)) as results:
+                            async for result in results:
+                                await emit(result)
+                else:
+                    with self._span(stage, item):
+                        result = await stage.handler(item)
+                    await emit(result)
+            except Exception:
+                logger.exception(f"Stage {stage.name} failed on {item}")
+            finally:
+                queue.task_done()
+
+    def _span(self, stage: Stage, item):
+        if self.metrics is None:
+            return contextlib.nullcontext()
+        return self.metrics.span(stage.name, self.label(item))
+
+
+class SingleFlight:
+    """Runs a coroutine function once per key
+
+    The first call for a key does the work, concurrent and later calls
+    share its result (or its exception). Cancelling a caller doesn't
+    cancel the shared work.
+    """
+
+    def __init__(self):
+        self.flights: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, func: Callable[..., Awaitable], *args) -> Any:
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = asyncio.ensure_future(func(*args))
+        return await asyncio.shield(flight)
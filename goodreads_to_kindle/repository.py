@@ -1,9 +1,23 @@
 from abc import ABC, abstractmethod
-from models import User, GoodReadsBook
+from book_store import BookStore
+from models import BookKey, SendSizes, User, GoodReadsBook, ShelfState
 from os import path
 from pathlib import Path
-import shutil
+from typing import Iterable
+import sqlite3
 import glob
+import json
+import re
+import threading
+import time
+
+AUTHOR_ID_RE = re.compile(r"/author/show/(\d+)")
+
+
+def author_id(author: dict) -> str:
+    """Goodreads id of a scraped author, from the URL of their page"""
+    return AUTHOR_ID_RE.search(author["url"]).group(1)
+
 
 class Repository(ABC):
 
@@ -20,19 +34,105 @@ class Repository(ABC):
         ...
 
     @abstractmethod
-    def add_book_file(self, book_file_path: str, book: GoodReadsBook) -> None:
+    def add_book_file(self, book_file_path: str, book: GoodReadsBook) -> Path:
+        ...
+
+    @abstractmethod
+    def add_book_content(self, book: GoodReadsBook, chunks: Iterable[bytes], extension: str) -> Path:
+        ...
+
+    @abstractmethod
+    def get_converted_book(self, book_file: Path, format: str) -> Path | None:
+        ...
+
+    @abstractmethod
+    def add_converted_book(self, book_file: Path, format: str, converted_file: Path) -> Path:
+        ...
+
+    @abstractmethod
+    def get_optimized_book(self, book_file: Path, variant: str) -> Path | None:
+        ...
+
+    @abstractmethod
+    def add_optimized_book(self, book_file: Path, variant: str, optimized_file: Path) -> Path:
+        ...
+
+    @abstractmethod
+    def get_shelf_state(self, user: User) -> ShelfState:
+        ...
+
+    @abstractmethod
+    def update_shelf_state(self, user: User, state: ShelfState) -> None:
         ...
 
+    @abstractmethod
+    def update_authors(self, authors: list[dict]) -> None:
+        ...
+
+    def was_book_sent(self, user: User, book: GoodReadsBook) -> bool:
+        return user.has_received(book)
+
+    def mark_book_sent(self, user: User, book: GoodReadsBook, original_bytes: int | None = None, sent_bytes: int | None = None) -> None:
+        user.add_sent_book(book)
+        if original_bytes is not None or sent_bytes is not None:
+            user.send_sizes[str(book.key())] = SendSizes(original_bytes, sent_bytes)
+        self.update_user(user)
+
+    def flush(self) -> None:
+        """Write out what is only kept in memory so far"""
 
-class JsonRepository(Repository):
+    def close(self) -> None:
+        self.flush()
+
+
+class BookStoreRepository(Repository):
+    """Keeps the book files, and their conversions, in a BookStore under `workdir`"""
 
     BOOKS_PATH = "books"
-    USERS_PATH = "users"
 
     def __init__(self, workdir: Path):
         self.workdir = workdir
-        self.user_dir = workdir / self.USERS_PATH
         self.book_dir = workdir / self.BOOKS_PATH
+        self.books = BookStore(self.book_dir)
+
+    def get_book_path(self, book: GoodReadsBook) -> Path | None:
+        legacy_file = self.book_dir / f"{book.get_file_name()}.epub"
+        return self.books.get(str(book.key()), legacy_path=legacy_file)
+
+    def add_book_file(self, book_file_path: Path, book: GoodReadsBook) -> Path:
+        # the caller keeps its file
+        return self.books.copy_file(str(book.key()), book_file_path)
+
+    def add_book_content(self, book: GoodReadsBook, chunks: Iterable[bytes], extension: str) -> Path:
+        return self.books.put_chunks(str(book.key()), chunks, extension)
+
+    def get_converted_book(self, book_file: Path, format: str) -> Path | None:
+        return self.books.get_derived(book_file, format)
+
+    def add_converted_book(self, book_file: Path, format: str, converted_file: Path) -> Path:
+        return self.books.put_derived(book_file, format, converted_file)
+
+    def get_optimized_book(self, book_file: Path, variant: str) -> Path | None:
+        return self.books.get_derived(book_file, variant)
+
+    def add_optimized_book(self, book_file: Path, variant: str, optimized_file: Path) -> Path:
+        return self.books.put_derived(book_file, variant, optimized_file)
+
+    def flush(self) -> None:
+        self.books.save_index()
+
+
+class JsonRepository(BookStoreRepository):
+
+    USERS_PATH = "users"
+    SHELVES_PATH = "shelves"
+    AUTHORS_PATH = "authors"
+
+    def __init__(self, workdir: Path):
+        super().__init__(workdir)
+        self.user_dir = workdir / self.USERS_PATH
+        self.shelf_dir = workdir / self.SHELVES_PATH
+        self.author_dir = workdir / self.AUTHORS_PATH
 
     def list_users(self) -> list[User]:
         users = []
@@ -45,12 +145,246 @@ class JsonRepository(Repository):
         with open(self.user_dir / f"{user.goodreads_id}.json", "w") as file:
             file.write(user.to_json())
 
-    def get_book_path(self, book: GoodReadsBook) -> Path | None:
-        book_file = self.book_dir / f"{book.get_file_name()}.epub"
-        return book_file if book_file.exists() else None
+    def get_shelf_state(self, user: User) -> ShelfState:
+        shelf_file = self.shelf_dir / f"{user.goodreads_id}.json"
+        if not shelf_file.exists():
+            return ShelfState()
+        return ShelfState.from_json(shelf_file.read_text())
+
+    def update_shelf_state(self, user: User, state: ShelfState) -> None:
+        self.shelf_dir.mkdir(parents=True, exist_ok=True)
+        (self.shelf_dir / f"{user.goodreads_id}.json").write_text(state.to_json())
+
+    def update_authors(self, authors: list[dict]) -> None:
+        self.author_dir.mkdir(parents=True, exist_ok=True)
+        for author in authors:
+            (self.author_dir / f"{author_id(author)}.json").write_text(json.dumps(author))
+
+
+class SqliteRepository(BookStoreRepository):
+    """Repository keeping users and the ledger of sent books in SQLite
+
+    Sending a book is a single row insert, and checking whether a book was
+    already sent is an indexed lookup. Book files are kept in the same
+    BookStore as in JsonRepository.
+    """
+
+    DB_FILE = "repository.sqlite"
+    # bumped whenever the keys change, to recompute them
+    BOOK_KEY_VERSION = "2"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        goodreads_id TEXT PRIMARY KEY,
+        kindle_email TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS books (
+        id INTEGER PRIMARY KEY,
+        key TEXT NOT NULL UNIQUE,
+        -- BookKey.of_title, matches the books scraped without their ISBN
+        title_key TEXT,
+        book TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS sends (
+        id INTEGER PRIMARY KEY,
+        user_id TEXT NOT NULL REFERENCES users (goodreads_id),
+        book_id INTEGER NOT NULL REFERENCES books (id),
+        sent_at REAL NOT NULL,
+        original_bytes INTEGER,
+        sent_bytes INTEGER,
+        UNIQUE (user_id, book_id)
+    );
+    CREATE INDEX IF NOT EXISTS sends_by_book ON sends (book_id);
+    CREATE TABLE IF NOT EXISTS shelves (
+        user_id TEXT PRIMARY KEY REFERENCES users (goodreads_id),
+        state TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS authors (
+        goodreads_id TEXT PRIMARY KEY,
+        author TEXT NOT NULL,
+        crawled_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS meta (
+        name TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """
+
+    def __init__(self, workdir: Path):
+        super().__init__(workdir)
+        # used from the event loop and from worker threads (asyncio.to_thread)
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(workdir / self.DB_FILE, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(self.SCHEMA)
+        self._add_size_columns()
+        self._add_title_key_column()
+        self._rekey_books()
+
+    @staticmethod
+    def _book_key(book: GoodReadsBook) -> str:
+        return str(book.key())
+
+    @staticmethod
+    def _title_key(book: GoodReadsBook) -> str:
+        return str(BookKey.of_title(book))
+
+    def _add_size_columns(self) -> None:
+        """Add the attachment size columns to a sends table created before them"""
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(sends)")}
+        with self.connection:
+            for column in ("original_bytes", "sent_bytes"):
+                if column not in columns:
+                    self.connection.execute(f"ALTER TABLE sends ADD COLUMN {column} INTEGER")
+
+    def _add_title_key_column(self) -> None:
+        """Add the title_key column to a books table created before it, filled by _rekey_books"""
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(books)")}
+        with self.connection:
+            if "title_key" not in columns:
+                self.connection.execute("ALTER TABLE books ADD COLUMN title_key TEXT")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS books_by_title_key ON books (title_key)")
+
+    def _rekey_books(self) -> None:
+        """Move books stored with an older identity to BookKey, merging the ones that now match"""
+        row = self.connection.execute("SELECT value FROM meta WHERE name = 'book_key'").fetchone()
+        if row and row[0] == self.BOOK_KEY_VERSION:
+            return
+
+        with self.connection:
+            books = self.connection.execute("SELECT id, book FROM books ORDER BY id").fetchall()
+            kept = {}
+            for book_id, book in books:
+                key = self._book_key(GoodReadsBook.from_json(book))
+                if key not in kept:
+                    kept[key] = book_id
+                    continue
+                # same book under two keys, keep the first one
+                self.connection.execute(
+                    "UPDATE OR IGNORE sends SET book_id = ? WHERE book_id = ?", (kept[key], book_id)
+                )
+                self.connection.execute("DELETE FROM sends WHERE book_id = ?", (book_id,))
+                self.connection.execute("DELETE FROM books WHERE id = ?", (book_id,))
+            # two passes, new keys may collide with old ones
+            for key, book_id in kept.items():
+                self.connection.execute("UPDATE books SET key = ? WHERE id = ?", (f"~{book_id}", book_id))
+            for key, book_id in kept.items():
+                self.connection.execute("UPDATE books SET key = ? WHERE id = ?", (key, book_id))
+            for book_id, book in self.connection.execute("SELECT id, book FROM books").fetchall():
+                title_key = self._title_key(GoodReadsBook.from_json(book))
+                self.connection.execute("UPDATE books SET title_key = ? WHERE id = ?", (title_key, book_id))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES ('book_key', ?)", (self.BOOK_KEY_VERSION,)
+            )
+
+    def _book_id(self, book: GoodReadsBook) -> int:
+        key = self._book_key(book)
+        self.connection.execute(
+            "INSERT OR IGNORE INTO books (key, title_key, book) VALUES (?, ?, ?)",
+            (key, self._title_key(book), book.to_json()),
+        )
+        return self.connection.execute("SELECT id FROM books WHERE key = ?", (key,)).fetchone()[0]
+
+    def _save_user(self, user: User) -> None:
+        self.connection.execute(
+            "INSERT INTO users (goodreads_id, kindle_email) VALUES (?, ?) "
+            "ON CONFLICT (goodreads_id) DO UPDATE SET kindle_email = excluded.kindle_email",
+            (user.goodreads_id, user.kindle_email),
+        )
+        now = time.time()
+        for book in user.books_sent_to_kindle:
+            sizes = user.send_sizes.get(str(book.key()), SendSizes())
+            self.connection.execute(
+                "INSERT OR IGNORE INTO sends (user_id, book_id, sent_at, original_bytes, sent_bytes) VALUES (?, ?, ?, ?, ?)",
+                (user.goodreads_id, self._book_id(book), now, sizes.original_bytes, sizes.sent_bytes),
+            )
+
+    def list_users(self) -> list[User]:
+        """The users, without their sent books: was_book_sent queries the ledger, see get_sent_books"""
+        with self.lock:
+            return [
+                User(goodreads_id=goodreads_id, kindle_email=kindle_email, books_sent_to_kindle=[])
+                for goodreads_id, kindle_email in self.connection.execute(
+                    "SELECT goodreads_id, kindle_email FROM users ORDER BY goodreads_id"
+                )
+            ]
+
+    def get_sent_books(self, user: User) -> list[GoodReadsBook]:
+        with self.lock:
+            return [
+                GoodReadsBook.from_json(book)
+                for (book,) in self.connection.execute(
+                    "SELECT books.book FROM sends JOIN books ON books.id = sends.book_id "
+                    "WHERE sends.user_id = ? ORDER BY sends.id",
+                    (user.goodreads_id,),
+                )
+            ]
+
+    def update_user(self, user: User) -> None:
+        with self.lock, self.connection:
+            self._save_user(user)
+
+    def was_book_sent(self, user: User, book: GoodReadsBook) -> bool:
+        # sent under its ISBN, or under the same title and authors with or without one
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM sends JOIN books ON books.id = sends.book_id "
+                "WHERE sends.user_id = ? AND (books.key = ? OR books.title_key = ?)",
+                (user.goodreads_id, self._book_key(book), self._title_key(book)),
+            ).fetchone()
+        return row is not None
+
+    def mark_book_sent(self, user: User, book: GoodReadsBook, original_bytes: int | None = None, sent_bytes: int | None = None) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO sends (user_id, book_id, sent_at, original_bytes, sent_bytes) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (user.goodreads_id, self._book_id(book), time.time(), original_bytes, sent_bytes),
+            )
+
+    def get_shelf_state(self, user: User) -> ShelfState:
+        with self.lock:
+            row = self.connection.execute("SELECT state FROM shelves WHERE user_id = ?", (user.goodreads_id,)).fetchone()
+        return ShelfState.from_json(row[0]) if row else ShelfState()
+
+    def update_shelf_state(self, user: User, state: ShelfState) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO shelves (user_id, state) VALUES (?, ?)", (user.goodreads_id, state.to_json())
+            )
+
+    def update_authors(self, authors: list[dict]) -> None:
+        crawled_at = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO authors (goodreads_id, author, crawled_at) VALUES (?, ?, ?)",
+                [(author_id(author), json.dumps(author), crawled_at) for author in authors],
+            )
+
+    def migrate_from_json(self) -> int:
+        """Import the users of a JsonRepository in the same workdir that aren't in the database yet
+
+        Meant to be called whenever the users are loaded, so that users added
+        as JSON files are picked up. Users already imported are left alone,
+        the database is their source of truth. Returns the number of
+        imported users.
+        """
+        if not (self.workdir / JsonRepository.USERS_PATH).is_dir():
+            return 0
+        with self.lock:
+            known = {row[0] for row in self.connection.execute("SELECT goodreads_id FROM users")}
+            users = [user for user in JsonRepository(self.workdir).list_users() if user.goodreads_id not in known]
+            with self.connection:
+                for user in users:
+                    self._save_user(user)
+        return len(users)
 
-    def add_book_file(self, book_file_path: Path, book: GoodReadsBook):
-        return shutil.copy2(book_file_path, self.book_dir / f"{book.get_file_name()}.epub")
+    def close(self) -> None:
+        super().close()
+        with self.lock:
+            self.connection.close()
 
 
 if __name__ == "__main__":
@@ -1,3 +1,6 @@
+from typing import Literal
+
+from pydantic import Field
 from pydantic_settings import BaseSettings
 
 
@@ -9,3 +12,38 @@ class Settings(BaseSettings):
     rapid_api_key: str
     zlib_email: str
     zlib_password: str
+    repository: Literal["json", "sqlite"] = "json"
+    # SMTP connections sending in parallel, and emails waiting for one
+    email_workers: int = 2
+    email_queue_size: int = 8
+    # users whose shelves are crawled, and books acquired, at the same time
+    fetch_concurrency: int = 2
+    acquire_concurrency: int = 2
+    # convert books to this format (e.g. "azw3") with Calibre before sending
+    convert_format: str | None = None
+    conversion_workers: int = 2
+    conversion_timeout: float = 10 * 60
+    # recompress EPUBs and downscale their images before sending
+    optimize_epubs: bool = False
+    optimizer_workers: int = 2
+    max_image_size: int = 1600
+    # written at the end of every run, the .prom file for the node exporter textfile collector
+    run_report_file: str = "run_report.json"
+    prometheus_file: str = "goodreads_to_kindle.prom"
+    # daemon mode: every shelf is checked on its own interval, shortened while
+    # the shelf keeps changing and stretched while it doesn't, in seconds
+    poll_initial_interval: float = 60 * 60
+    poll_min_interval: float = 10 * 60
+    poll_max_interval: float = 24 * 60 * 60
+    # cap on the shelf checks of all users together
+    max_polls_per_hour: float = Field(60, gt=0)
+    poll_burst: int = Field(10, ge=1)
+    # how often the daemon reloads the users, picking up new and removed ones
+    users_refresh_interval: float = 5 * 60
+    # read the shelves from their "html" list pages and book pages, or from their "rss" feeds
+    shelf_source: Literal["html", "rss"] = "html"
+    # only crawl the shelf pages with books added since the last run
+    incremental_shelves: bool = True
+    # after each run, scrape the pages of the authors of the books on the shelves crawled, and of the
+    # authors close to them, into the repository. Bounded by the AUTHOR_CRAWL_* scrapy settings
+    crawl_authors: bool = False
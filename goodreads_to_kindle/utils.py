@@ -1,11 +1,40 @@
+import asyncio
 import subprocess
 from pathlib import Path
 from exceptions import EbookConversionError
 
+# Calibre can take a while on big books, but not forever
+CONVERSION_TIMEOUT = 10 * 60
 
-def convert_ebook(original_path: Path, format: str) -> str:
-    new_path = original_path.with_suffix(".{format}")
-    outcome = subprocess.run(["ebook-convert", original_path, new_path])
-    if outcome != 0:
-        raise EbookConversionError
-    return new_path
\ No newline at end of file
+
+def convert_ebook(original_path: Path, format: str, new_path: Path | None = None, timeout: float = CONVERSION_TIMEOUT) -> Path:
+    new_path = new_path or original_path.with_suffix(f".{format}")
+    try:
+        outcome = subprocess.run(
+            ["ebook-convert", str(original_path), str(new_path)], capture_output=True, timeout=timeout
+        )
+    except subprocess.TimeoutExpired as e:
+        raise EbookConversionError(f"Converting {original_path} timed out") from e
+    if outcome.returncode != 0:
+        raise EbookConversionError(outcome.stderr.decode(errors="replace").strip()[-1000:])
+    return new_path
+
+
+async def convert_ebook_async(original_path: Path, format: str, new_path: Path | None = None, timeout: float = CONVERSION_TIMEOUT) -> Path:
+    """Like convert_ebook, without blocking the event loop"""
+    new_path = new_path or original_path.with_suffix(f".{format}")
+    process = await asyncio.create_subprocess_exec(
+        "ebook-convert", str(original_path), str(new_path),
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        _, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError as e:
+        raise EbookConversionError(f"Converting {original_path} timed out") from e
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    if process.returncode != 0:
+        raise EbookConversionError(stderr.decode(errors="replace").strip()[-1000:])
+    return new_path
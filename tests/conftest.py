@@ -0,0 +1,89 @@
+import socketserver
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+# the application modules import each other as top level modules
+sys.path.insert(0, str(Path(__file__).parent.parent / "goodreads_to_kindle"))
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    """Just enough of an SMTP server to receive messages, no TLS and no auth"""
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            refused = server.connections <= server.fail_connections
+        if refused:
+            # closed before the greeting, as a server going away would
+            return
+
+        self.wfile.write(b"220 localhost stand-in\r\n")
+        while line := self.rfile.readline():
+            command = line.strip().upper()
+            if command.startswith((b"EHLO", b"HELO")):
+                self.wfile.write(b"250-localhost\r\n250 8BITMIME\r\n")
+            elif command.startswith(b"RCPT") and any(r.upper().encode() in command for r in server.refused_recipients):
+                self.wfile.write(b"550 No such mailbox\r\n")
+            elif command.startswith((b"MAIL", b"RCPT", b"RSET", b"NOOP")):
+                self.wfile.write(b"250 OK\r\n")
+            elif command == b"DATA":
+                self.wfile.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                self.receive_data()
+                server.accepting.wait()
+                self.wfile.write(b"250 OK queued\r\n")
+                if server.drop_after_message:
+                    return
+            elif command == b"QUIT":
+                self.wfile.write(b"221 Bye\r\n")
+                return
+            else:
+                self.wfile.write(b"502 Command not implemented\r\n")
+
+    def receive_data(self):
+        lines = []
+        while (line := self.rfile.readline()) != b".\r\n":
+            if not line:
+                raise ConnectionError("Connection closed in the middle of DATA")
+            # undo the dot-stuffing
+            lines.append(line[1:] if line.startswith(b".") else line)
+        self.server.messages.append(b"".join(lines))
+
+
+class SmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SmtpHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        # raw messages received, as sent after DATA
+        self.messages = []
+        # how many of the first connections are closed right away
+        self.fail_connections = 0
+        # close the connection after every message
+        self.drop_after_message = False
+        # recipients refused with a 550
+        self.refused_recipients = set()
+        # cleared to hold the reply to every message until it's set again
+        self.accepting = threading.Event()
+        self.accepting.set()
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+
+@pytest.fixture
+def smtp_server():
+    server = SmtpServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.accepting.set()
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,129 @@
+import asyncio
+import http.server
+import json
+import threading
+
+import pytest
+import requests
+
+from book_provider import ZlibBookProvider
+from book_store import BookStore
+from exceptions import BookDownloadError
+from models import GoodReadsBook
+
+
+def test_index_written_once_per_batch(tmp_path):
+    store = BookStore(tmp_path)
+    first = store.put_chunks("isbn13:1", [b"first"], "epub")
+    store.put_chunks("isbn13:2", [b"second"], "EPUB")
+    # same content, stored once
+    assert store.put_chunks("isbn13:3", [b"first"], "epub") == first
+    assert not store.index_file.exists()
+
+    store.save_index()
+    assert json.loads(store.index_file.read_text()) == store.index
+    assert len(list(store.blob_dir.iterdir())) == 2
+
+    written = store.index_file.stat().st_mtime_ns
+    store.save_index()
+    assert store.index_file.stat().st_mtime_ns == written
+
+    reopened = BookStore(tmp_path)
+    assert reopened.get("isbn13:3") == first
+    assert reopened.get("isbn13:4") is None
+
+
+def test_chunks_closed_when_storing_fails(tmp_path):
+    store = BookStore(tmp_path)
+    closed = []
+
+    def chunks():
+        try:
+            yield b"start"
+            raise ConnectionError("download interrupted")
+        finally:
+            closed.append(True)
+
+    generator = chunks()
+    with pytest.raises(ConnectionError):
+        store.put_chunks("isbn13:1", generator, "epub")
+    assert closed == [True]
+    assert list(store.tmp_dir.iterdir()) == []
+    assert store.get("isbn13:1") is None
+
+
+class DownloadHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/book.epub":
+            self.send_response(200)
+            self.send_header("Content-Type", "application/epub+zip")
+            body = b"epub content" * 1000
+        elif self.path == "/limit":
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            body = b"<html>Daily limit reached</html>"
+        else:
+            self.send_response(404)
+            self.send_header("Content-Type", "text/html")
+            body = b"<html>Not found</html>"
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def download_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), DownloadHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+class SearchResult(dict):
+    async def fetch(self):
+        return {"download_url": self["download_url"]}
+
+
+class FakeZlib:
+    """Finds every book, at `download_url`"""
+
+    cookies = {}
+
+    def __init__(self, download_url: str):
+        self.download_url = download_url
+
+    async def login(self, email, password):
+        pass
+
+    async def search(self, **kwargs):
+        result = SearchResult(name="Dune", authors=["Frank Herbert"], extension="EPUB", download_url=self.download_url)
+
+        class Paginator:
+            async def next(self):
+                return [result]
+
+        return Paginator()
+
+
+def fetch(download_url: str):
+    provider = ZlibBookProvider("me@example.com", "")
+    provider.lib = FakeZlib(download_url)
+    book = GoodReadsBook(authors=["Frank Herbert"], isbn=None, isbn13=None, language=None, title="Dune")
+    return asyncio.run(provider.fetch_book(book))
+
+
+def test_download_streamed(download_server):
+    chunks, extension = fetch(f"{download_server}/book.epub")
+    assert extension == "epub"
+    assert b"".join(chunks) == b"epub content" * 1000
+
+
+@pytest.mark.parametrize("path, error", [("/missing", requests.HTTPError), ("/limit", BookDownloadError)])
+def test_failed_download_not_stored(download_server, path, error):
+    with pytest.raises(error):
+        fetch(f"{download_server}{path}")
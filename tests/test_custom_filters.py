@@ -0,0 +1,58 @@
+import time
+
+from goodreads_scraper.custom_filters import FingerprintStore
+
+
+def fingerprint(i: int) -> bytes:
+    return i.to_bytes(20, "little")
+
+
+def test_store_shared_by_the_crawls_of_a_process(tmp_path):
+    path = str(tmp_path / "seen_requests.bin")
+    first = FingerprintStore.acquire(path)
+    second = FingerprintStore.acquire(path)
+    assert first is second
+
+    first.add(fingerprint(1), ttl=-10)
+    first.maybe_compact(0)
+    # added after the file was replaced by the compaction
+    second.add(fingerprint(2))
+    first.release()
+    assert not first.file.closed
+    second.release()
+    assert first.file.closed
+
+    reloaded = FingerprintStore.acquire(path)
+    assert reloaded is not first
+    assert fingerprint(2) in reloaded
+    assert fingerprint(1) not in reloaded
+    reloaded.release()
+
+
+def test_expired_records_dropped_by_compaction(tmp_path):
+    path = tmp_path / "seen_requests.bin"
+    store = FingerprintStore(str(path))
+    store.add(fingerprint(1))
+    store.add(fingerprint(2), ttl=3600)
+    for i in range(3, 6):
+        store.add(fingerprint(i), ttl=-2 * FingerprintStore.EXPIRY_BUCKET)
+    store.close(0.5)
+
+    assert path.stat().st_size == 2 * FingerprintStore.RECORD.size
+    reloaded = FingerprintStore(str(path))
+    assert (reloaded.live, reloaded.stale) == (2, 0)
+    assert fingerprint(1) in reloaded and fingerprint(3) not in reloaded
+    reloaded.close()
+
+
+def test_truncated_record_ignored(tmp_path):
+    path = tmp_path / "seen_requests.bin"
+    store = FingerprintStore(str(path))
+    store.add(fingerprint(1), ttl=time.time())
+    store.close()
+    with open(path, "ab") as file:
+        file.write(b"\x01\x02\x03")
+
+    reloaded = FingerprintStore(str(path))
+    assert reloaded.live == 1 and fingerprint(1) in reloaded
+    reloaded.close()
@@ -0,0 +1,73 @@
+import pydantic
+import pytest
+
+from daemon import PollScheduler, TokenBucket
+from models import User
+from settings import Settings
+
+REQUIRED = dict(
+    email_password="", email_smtp_port=25, email_smtp="localhost", email_user="me@example.com",
+    rapid_api_key="", zlib_email="", zlib_password="",
+)
+
+
+@pytest.mark.parametrize("name, value", [("max_polls_per_hour", 0), ("max_polls_per_hour", -1), ("poll_burst", 0)])
+def test_polls_cap_must_allow_polls(name, value):
+    with pytest.raises(pydantic.ValidationError):
+        Settings(**REQUIRED, **{name: value})
+
+
+def test_token_bucket_bursts_then_waits(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("daemon.time.monotonic", lambda: now[0])
+    bucket = TokenBucket(rate=0.5, capacity=3)
+
+    assert bucket.take(5) == 3
+    assert bucket.take(1) == 0
+    assert bucket.wait_time() == 2.0
+
+    now[0] += 1
+    assert bucket.wait_time() == 1.0
+    now[0] += 10
+    # never more than the capacity
+    assert bucket.take(5) == 3
+
+
+def schedule_of(scheduler: PollScheduler, goodreads_id: str = "u1"):
+    scheduler.update_users([User(goodreads_id=goodreads_id, kindle_email="u1@kindle.com", books_sent_to_kindle=[])])
+    return scheduler.schedules[goodreads_id]
+
+
+def test_partial_shelf_compared_as_such():
+    scheduler = PollScheduler(initial_interval=100, min_interval=10, max_interval=1000)
+    schedule = schedule_of(scheduler)
+    scheduler.polled(schedule, {"a", "b", "c"})
+    assert schedule.interval == 100
+
+    # only the newest page, all of it known: unchanged, not "books removed"
+    scheduler.polled(schedule, {"c"}, partial=True)
+    assert schedule.interval > 100
+    assert schedule.shelf == {"a", "b", "c"}
+
+    interval = schedule.interval
+    scheduler.polled(schedule, {"d", "c"}, partial=True)
+    assert schedule.interval < interval
+    assert schedule.shelf == {"a", "b", "c", "d"}
+
+
+def test_full_shelf_with_a_book_removed_changed():
+    scheduler = PollScheduler(initial_interval=100, min_interval=10, max_interval=1000)
+    schedule = schedule_of(scheduler)
+    scheduler.polled(schedule, {"a", "b"})
+    scheduler.polled(schedule, {"a"})
+    assert schedule.interval < 100
+    assert schedule.shelf == {"a"}
+
+
+def test_failed_crawl_keeps_the_interval():
+    scheduler = PollScheduler(initial_interval=100, min_interval=10, max_interval=1000)
+    schedule = schedule_of(scheduler)
+    scheduler.polled(schedule, {"a"})
+    scheduler.polled(schedule, None)
+    assert schedule.interval == 100
+    assert schedule.shelf == {"a"}
@@ -0,0 +1,119 @@
+import time
+
+from goodreads_scraper.frontier import Frontier
+
+
+def page(i: int) -> tuple:
+    return f"https://www.goodreads.com/author/show/{i}", f"author:{i}"
+
+
+def frontier(**kwargs) -> Frontier:
+    return Frontier(**{"max_size": 5, "seen_capacity": 100, **kwargs})
+
+
+def pop_keys(frontier: Frontier) -> list:
+    keys = []
+    while (entry := frontier.pop()) is not None:
+        keys.append(entry.key)
+    return keys
+
+
+def test_highest_priority_first_and_raised_when_queued_again():
+    pages = frontier()
+    for i, priority in enumerate([1, 3, 2]):
+        assert pages.push(*page(i), priority=priority, depth=1)
+    # queued again from closer: higher priority, lower depth
+    assert not pages.push(*page(0), priority=5, depth=0)
+    assert not pages.push(*page(1), priority=0, depth=0)
+
+    first = pages.pop()
+    assert (first.key, first.priority, first.depth) == ("author:0", 5, 0)
+    # the replaced entry of author:0 skipped
+    assert pop_keys(pages) == ["author:1", "author:2"]
+
+
+def test_lowest_priority_pages_dropped_past_twice_the_size():
+    pages = frontier()
+    for i in range(11):
+        pages.push(*page(i), priority=i, depth=1)
+
+    assert len(pages) == 5
+    assert pages.dropped == 6
+    assert pop_keys(pages) == [f"author:{i}" for i in range(10, 5, -1)]
+    # a dropped page can be queued again, it was never crawled
+    assert pages.push(*page(0), priority=0, depth=1)
+
+
+def test_crawled_pages_not_queued_again_popped_ones_requeued():
+    pages = frontier()
+    pages.push(*page(1), priority=1, depth=1)
+    pages.push(*page(2), priority=2, depth=1)
+    second, first = pages.pop(), pages.pop()
+
+    assert not pages.push(*page(1), priority=9, depth=1)
+    pages.crawled(second.key)
+    assert second.key in pages and not pages.push(*page(2), priority=9, depth=1)
+
+    # e.g. its request failed
+    pages.requeue(first)
+    assert pop_keys(pages) == ["author:1"]
+
+
+def test_checkpoint_resumed_with_the_pages_in_flight(tmp_path):
+    path = str(tmp_path / "frontier.json")
+    pages = frontier()
+    for i in range(4):
+        pages.push(*page(i), priority=i, depth=i)
+    pages.crawled(pages.pop().key)
+    in_flight = pages.pop()
+    pages.save(path, [in_flight], scraped=1)
+
+    resumed = frontier()
+    assert resumed.load(path) == {"scraped": 1}
+    assert "author:3" in resumed
+    assert not resumed.push(*page(3), priority=9, depth=0)
+    entry = resumed.pop()
+    assert (entry.key, entry.priority, entry.depth) == ("author:2", 2, 2)
+    assert pop_keys(resumed) == ["author:1", "author:0"]
+
+
+def test_complete_crawl_starts_a_new_generation(tmp_path):
+    path = str(tmp_path / "frontier.json")
+    pages = frontier()
+    pages.push(*page(1), priority=1, depth=1)
+    pages.crawled(pages.pop().key)
+    pages.save(path)
+
+    resumed = frontier()
+    assert resumed.load(path) is None
+    assert resumed.push(*page(1), priority=1, depth=1)
+
+
+def test_checkpoint_older_than_the_ttl_started_over(tmp_path, monkeypatch):
+    path = str(tmp_path / "frontier.json")
+    pages = frontier()
+    pages.push(*page(1), priority=1, depth=1)
+    pages.push(*page(2), priority=2, depth=1)
+    pages.crawled(pages.pop().key)
+    pages.save(path)
+
+    assert frontier(seen_ttl=3600).load(path) == {}
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 7200)
+    resumed = frontier(seen_ttl=3600)
+    assert resumed.load(path) is None
+    assert "author:2" not in resumed
+
+
+def test_bloom_filter_of_another_size_forgotten(tmp_path):
+    path = str(tmp_path / "frontier.json")
+    pages = frontier()
+    pages.push(*page(1), priority=1, depth=1)
+    pages.push(*page(2), priority=2, depth=1)
+    pages.crawled(pages.pop().key)
+    pages.save(path)
+
+    resumed = frontier(seen_capacity=1000)
+    assert resumed.load(path) == {}
+    assert "author:2" not in resumed
+    assert pop_keys(resumed) == ["author:1"]
@@ -0,0 +1,197 @@
+import asyncio
+import smtplib
+import socket
+from email import message_from_bytes, policy
+
+import pytest
+
+from mail import AsyncEmailManager, EmailManager
+
+
+def email_manager(port: int, **kwargs) -> EmailManager:
+    return EmailManager("127.0.0.1", port, "me@example.com", password="", starttls=False, timeout=5, **kwargs)
+
+
+def send(manager: EmailManager, subject: str = "Book", file_paths=(), file_names=None) -> None:
+    manager.send_mail("kindle@example.com", subject, "Your book", list(file_paths), file_names)
+
+
+def subjects(smtp_server) -> list[str]:
+    return [message_from_bytes(message, policy=policy.SMTP)["Subject"] for message in smtp_server.messages]
+
+
+def test_sends_reuse_the_session(smtp_server):
+    with email_manager(smtp_server.port) as manager:
+        for i in range(3):
+            send(manager, f"Book {i}")
+
+    assert smtp_server.connections == 1
+    assert subjects(smtp_server) == ["Book 0", "Book 1", "Book 2"]
+
+
+def test_idle_session_checked_and_reopened_after_a_drop(smtp_server):
+    smtp_server.drop_after_message = True
+    with email_manager(smtp_server.port, idle_check=0) as manager:
+        send(manager, "Book 0")
+        send(manager, "Book 1")
+
+    assert smtp_server.connections == 2
+    assert subjects(smtp_server) == ["Book 0", "Book 1"]
+
+
+def test_send_retried_on_a_session_dropped_since_the_last_check(smtp_server):
+    smtp_server.drop_after_message = True
+    # never checked with a NOOP, the send itself finds the session dropped
+    with email_manager(smtp_server.port, idle_check=3600) as manager:
+        send(manager, "Book 0")
+        send(manager, "Book 1")
+
+    assert smtp_server.connections == 2
+    assert subjects(smtp_server) == ["Book 0", "Book 1"]
+
+
+def test_failed_connection_retried(smtp_server):
+    smtp_server.fail_connections = 1
+    with email_manager(smtp_server.port) as manager:
+        send(manager)
+
+    assert smtp_server.connections == 2
+    assert subjects(smtp_server) == ["Book"]
+
+
+def test_refused_connection_raises_the_connection_error():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    # nothing listens on the port anymore
+    manager = email_manager(port)
+
+    with pytest.raises(ConnectionRefusedError):
+        send(manager)
+    assert manager.server is None
+    manager.close()
+
+
+def attachments(message) -> list[tuple[str, bytes]]:
+    return [(part.get_filename(), part.get_payload(decode=True)) for part in message.iter_attachments()]
+
+
+@pytest.mark.parametrize("text", [".Leading dot\r\n..two\r\n.\r\nlast line\r\n", ".Leading dot\r\n.\r\nno line break at the end"])
+@pytest.mark.parametrize("content", [
+    b".\r\n.line with a leading dot\r\n..\r\nends with CRLF\r\n",
+    b".\r\n.line with a leading dot\r\nno CRLF at the end",
+    # more than one chunk, not a multiple of the chunk size
+    bytes(range(256)) * 1000 + b"\r\n.\r\n",
+])
+def test_message_received_intact(smtp_server, tmp_path, text, content):
+    file_path = tmp_path / "book.epub"
+    file_path.write_bytes(content)
+
+    with email_manager(smtp_server.port) as manager:
+        manager.send_mail("kindle@example.com", "Book", text, [str(file_path)], ["A book.epub"])
+
+    [raw] = smtp_server.messages
+    message = message_from_bytes(raw, policy=policy.SMTP)
+    body = message.get_body(("plain",))
+    # set_content ends the text with a line break if it has none
+    assert body.get_payload(decode=True) == text.encode() + (b"" if text.endswith("\r\n") else b"\r\n")
+    assert attachments(message) == [("A book.epub", content)]
+
+
+def test_message_without_attachments_received_intact(smtp_server):
+    with email_manager(smtp_server.port) as manager:
+        manager.send_mail("kindle@example.com", "No book", ".\r\n.Leading dot", [])
+
+    [raw] = smtp_server.messages
+    message = message_from_bytes(raw, policy=policy.SMTP)
+    assert message.get_payload(decode=True) == b".\r\n.Leading dot\r\n"
+    assert attachments(message) == []
+
+
+@pytest.mark.parametrize("data", [b"Subject: x\r\n\r\nends with CRLF\r\n", b"Subject: x\r\n\r\nno CRLF at the end"])
+def test_data_terminated_whether_or_not_it_ends_with_crlf(smtp_server, data):
+    with email_manager(smtp_server.port) as manager:
+        # split so that no chunk ends where the data does
+        chunks = [data[:5], data[5:-3], data[-3:]]
+        manager._with_session(lambda server: manager._send_data(server, ["kindle@example.com"], iter(chunks)))
+        # the session is still usable
+        send(manager, "Next")
+
+    first, second = smtp_server.messages
+    # the CRLF of the terminating line isn't part of the data
+    assert first == (data if data.endswith(b"\r\n") else data + b"\r\n")
+    assert subjects(smtp_server)[1] == "Next"
+    assert smtp_server.connections == 1
+
+
+def test_async_manager_delivers_every_email(smtp_server, tmp_path):
+    file_paths = []
+    for i in range(6):
+        file_path = tmp_path / f"book{i}.epub"
+        file_path.write_bytes(f".book {i}\r\n".encode() * 1000)
+        file_paths.append(file_path)
+
+    async def send_all():
+        manager = AsyncEmailManager("127.0.0.1", smtp_server.port, "me@example.com", "", workers=2, queue_size=2, starttls=False, timeout=5)
+        async with manager:
+            sent = [
+                await manager.send_mail("kindle@example.com", f"Book {i}", "Your book", [str(file_path)])
+                for i, file_path in enumerate(file_paths)
+            ]
+            await asyncio.gather(*sent)
+
+    asyncio.run(send_all())
+
+    received = {}
+    for raw in smtp_server.messages:
+        message = message_from_bytes(raw, policy=policy.SMTP)
+        received[message["Subject"]] = attachments(message)
+    assert received == {
+        f"Book {i}": [(file_path.name, file_path.read_bytes())] for i, file_path in enumerate(file_paths)
+    }
+    # at most one session per worker
+    assert smtp_server.connections <= 2
+
+
+def async_email_manager(port: int, **kwargs) -> AsyncEmailManager:
+    return AsyncEmailManager("127.0.0.1", port, "me@example.com", "", starttls=False, timeout=5, **kwargs)
+
+
+def test_async_manager_send_waits_while_the_queue_is_full(smtp_server):
+    smtp_server.accepting.clear()
+
+    async def send_all():
+        async with async_email_manager(smtp_server.port, workers=1, queue_size=1) as manager:
+            # taken by the worker, whose session waits for the server
+            first = await manager.send_mail("kindle@example.com", "Book 0", "Your book", [])
+            while not manager.queue.empty():
+                await asyncio.sleep(0.01)
+            # fills the queue
+            second = await manager.send_mail("kindle@example.com", "Book 1", "Your book", [])
+            third = asyncio.create_task(manager.send_mail("kindle@example.com", "Book 2", "Your book", []))
+            await asyncio.sleep(0.3)
+            assert not third.done()
+            assert not first.done()
+
+            smtp_server.accepting.set()
+            sent = [first, second, await third]
+            await asyncio.gather(*sent)
+
+    asyncio.run(send_all())
+    assert subjects(smtp_server) == ["Book 0", "Book 1", "Book 2"]
+
+
+def test_async_manager_failed_send_reaches_the_future(smtp_server):
+    smtp_server.refused_recipients = {"nobody@example.com"}
+
+    async def send_all():
+        async with async_email_manager(smtp_server.port, workers=1) as manager:
+            refused = await manager.send_mail("nobody@example.com", "Refused", "Your book", [])
+            delivered = await manager.send_mail("kindle@example.com", "Delivered", "Your book", [])
+            with pytest.raises(smtplib.SMTPRecipientsRefused):
+                await refused
+            # the worker goes on, with a new session
+            await delivered
+
+    asyncio.run(send_all())
+    assert subjects(smtp_server) == ["Delivered"]
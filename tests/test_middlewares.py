@@ -0,0 +1,44 @@
+from scrapy.utils.test import get_crawler
+
+from goodreads_scraper import settings as project_settings
+from goodreads_scraper.middlewares import EndpointThrottle, EndpointThrottleMiddleware, classify
+
+
+def throttle(**settings) -> EndpointThrottle:
+    defaults = {name: value for name, value in vars(project_settings).items() if name.startswith("ENDPOINT_THROTTLE_")}
+    middleware = EndpointThrottleMiddleware(get_crawler(settings_dict={**defaults, **settings}))
+    return EndpointThrottle(**middleware.throttle_settings)
+
+
+def test_delay_never_below_the_download_delay():
+    fast = throttle(DOWNLOAD_DELAY=0.5, ENDPOINT_THROTTLE_START_DELAY=0.1, ENDPOINT_THROTTLE_MIN_DELAY=0)
+    assert fast.delay == 0.5
+    for _ in range(500):
+        fast.on_success(0.05)
+    assert fast.delay == 0.5
+    assert fast.concurrency == fast.max_concurrency
+
+
+def test_delay_shortened_down_to_the_min_delay():
+    fast = throttle(DOWNLOAD_DELAY=0, ENDPOINT_THROTTLE_START_DELAY=1, ENDPOINT_THROTTLE_MIN_DELAY=0.2)
+    for _ in range(500):
+        fast.on_success(0.05)
+    assert fast.delay == 0.2
+
+
+def test_backed_off_on_errors():
+    backed_off = throttle(DOWNLOAD_DELAY=0.1, ENDPOINT_THROTTLE_START_CONCURRENCY=8, ENDPOINT_THROTTLE_MAX_DELAY=60)
+    backed_off.on_error()
+    assert (backed_off.delay, backed_off.concurrency) == (0.5, 4)
+    backed_off.on_error(retry_after=30)
+    assert (backed_off.delay, backed_off.concurrency) == (30, 2)
+    backed_off.on_error(retry_after=3600)
+    assert (backed_off.delay, backed_off.concurrency) == (60, 1)
+
+
+def test_endpoint_classes():
+    assert classify("https://www.goodreads.com/review/list/1-user?shelf=to-read") == "shelf"
+    assert classify("https://www.goodreads.com/review/list_rss/1?shelf=to-read") == "shelf"
+    assert classify("https://www.goodreads.com/book/show/1.Dune") == "book"
+    assert classify("https://www.goodreads.com/author/show/1.Frank_Herbert") == "author"
+    assert classify("https://www.goodreads.com/search?q=dune") is None
@@ -0,0 +1,53 @@
+import pytest
+
+from models import BookKey, GoodReadsBook, User, normalize_isbn13
+
+
+def book(title="Dune", authors=("Frank Herbert",), isbn=None, isbn13=None, language="en") -> GoodReadsBook:
+    return GoodReadsBook(authors=list(authors), isbn=isbn, isbn13=isbn13, language=language, title=title)
+
+
+@pytest.mark.parametrize("isbn, expected", [
+    ("0306406152", "9780306406157"),
+    ("0-306-40615-2", "9780306406157"),
+    ("080442957x", "9780804429573"),
+    ("978-0-306-40615-7", "9780306406157"),
+    ("", None),
+    (None, None),
+    ("12345", None),
+    ("ABCDEFGHIJ", None),
+])
+def test_normalize_isbn13(isbn, expected):
+    assert normalize_isbn13(isbn) == expected
+
+
+def test_editions_with_the_same_isbn_share_a_key():
+    assert book(isbn="0306406152").key() == book(title="Another title", isbn13="9780306406157").key()
+    assert book(isbn13="9780306406157").key() != book(isbn13="9780804429573").key()
+
+
+def test_title_key_ignores_case_accents_punctuation_and_author_order():
+    first = book(title="Les Misérables!", authors=["Victor Hugo", "Translator"], language="fr")
+    second = book(title="les miserables", authors=["translator", "VICTOR HUGO"], language="en")
+    assert first.key() == second.key() == BookKey.of_title(first)
+    assert first.key().kind == "title"
+
+
+def test_book_scraped_with_and_without_its_isbn_matched():
+    with_isbn = book(isbn13="9780306406157")
+    without_isbn = book()
+    assert with_isbn.key() != without_isbn.key()
+
+    sent_with_isbn = User(goodreads_id="u", kindle_email="u@kindle.com", books_sent_to_kindle=[with_isbn])
+    assert sent_with_isbn.has_received(without_isbn)
+    sent_without_isbn = User(goodreads_id="u", kindle_email="u@kindle.com", books_sent_to_kindle=[without_isbn])
+    assert sent_without_isbn.has_received(with_isbn)
+    assert not sent_without_isbn.has_received(book(title="Dune Messiah"))
+
+
+def test_sent_keys_kept_in_sync():
+    user = User(goodreads_id="u", kindle_email="u@kindle.com", books_sent_to_kindle=[])
+    assert not user.has_received(book())
+    user.add_sent_book(book(isbn="0306406152"))
+    assert user.has_received(book(isbn13="9780306406157", title="Other"))
+    assert user.has_received(book())
@@ -0,0 +1,130 @@
+import asyncio
+
+from pipeline import Pipeline, SingleFlight, Stage
+
+
+def run(stages, items) -> None:
+    asyncio.run(Pipeline(stages).run(items))
+
+
+def test_failed_item_dropped_others_go_through(caplog):
+    done = []
+
+    async def parse(item):
+        if item == 3:
+            raise ValueError("bad item")
+        return item * 10
+
+    async def record(item):
+        done.append(item)
+
+    run([Stage("parse", parse, concurrency=2), Stage("record", record)], range(6))
+
+    assert sorted(done) == [0, 10, 20, 40, 50]
+    assert "Stage parse failed on 3" in caplog.text
+
+
+def test_none_drops_the_item():
+    done = []
+
+    async def keep_even(item):
+        return item if item % 2 == 0 else None
+
+    async def record(item):
+        done.append(item)
+
+    run([Stage("filter", keep_even), Stage("record", record)], range(5))
+
+    assert sorted(done) == [0, 2, 4]
+
+
+def test_generator_stage_fans_out_and_keeps_what_it_yielded_before_failing():
+    done = []
+
+    async def books(user):
+        for i in range(3):
+            if user == "broken" and i == 2:
+                raise ConnectionError("crawl failed")
+            yield f"{user}-{i}"
+
+    async def record(item):
+        done.append(item)
+
+    run([Stage("fetch", books, concurrency=2), Stage("record", record)], ["a", "broken", "b"])
+
+    assert sorted(done) == ["a-0", "a-1", "a-2", "b-0", "b-1", "b-2", "broken-0", "broken-1"]
+
+
+def test_stage_concurrency_bounded_and_stages_overlap():
+    running = {"slow": 0, "fast": 0}
+    most = {"slow": 0, "fast": 0}
+    overlapped = []
+
+    def handler(name: str, delay: float):
+        async def handle(item):
+            running[name] += 1
+            most[name] = max(most[name], running[name])
+            if running["slow"] and running["fast"]:
+                overlapped.append(item)
+            await asyncio.sleep(delay)
+            running[name] -= 1
+            return item
+
+        return handle
+
+    run([Stage("slow", handler("slow", 0.02), concurrency=3), Stage("fast", handler("fast", 0.01))], range(12))
+
+    assert most == {"slow": 3, "fast": 1}
+    assert overlapped
+
+
+def test_single_flight_runs_once_per_key():
+    calls = []
+
+    async def resolve(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return f"file of {key}"
+
+    async def main():
+        flights = SingleFlight()
+        concurrent = await asyncio.gather(*(flights.do(key, resolve, key) for key in ["a", "b", "a", "a"]))
+        later = await flights.do("a", resolve, "a")
+        return concurrent, later
+
+    concurrent, later = asyncio.run(main())
+    assert concurrent == ["file of a", "file of b", "file of a", "file of a"]
+    assert later == "file of a"
+    assert sorted(calls) == ["a", "b"]
+
+
+def test_single_flight_shares_the_exception():
+    calls = []
+
+    async def resolve(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        raise LookupError(key)
+
+    async def main():
+        flights = SingleFlight()
+        return await asyncio.gather(flights.do("a", resolve, "a"), flights.do("a", resolve, "a"), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert [type(result) for result in results] == [LookupError, LookupError]
+    assert calls == ["a"]
+
+
+def test_single_flight_work_survives_a_cancelled_caller():
+    async def resolve(key):
+        await asyncio.sleep(0.05)
+        return key
+
+    async def main():
+        flights = SingleFlight()
+        first = asyncio.create_task(flights.do("a", resolve, "a"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await flights.do("a", resolve, "a"), first.cancelled()
+
+    assert asyncio.run(main()) == ("a", True)
@@ -0,0 +1,123 @@
+import sqlite3
+import threading
+
+import pytest
+
+from models import BookKey, GoodReadsBook, User
+from repository import JsonRepository, SqliteRepository
+
+
+def book(title: str, isbn13: str | None = None, authors=("Author",)) -> GoodReadsBook:
+    return GoodReadsBook(authors=list(authors), isbn=None, isbn13=isbn13, language="en", title=title)
+
+
+def user(goodreads_id: str, *sent: GoodReadsBook) -> User:
+    return User(goodreads_id=goodreads_id, kindle_email=f"{goodreads_id}@kindle.com", books_sent_to_kindle=list(sent))
+
+
+@pytest.fixture
+def sqlite_repository(tmp_path):
+    repository = SqliteRepository(workdir=tmp_path)
+    yield repository
+    repository.close()
+
+
+def test_json_users_imported_whenever_loaded(tmp_path, sqlite_repository):
+    json_repository = JsonRepository(workdir=tmp_path)
+    (tmp_path / JsonRepository.USERS_PATH).mkdir()
+    json_repository.update_user(user("u1", book("First", "9780000000002")))
+    assert sqlite_repository.migrate_from_json() == 1
+
+    # added while running, e.g. by the daemon's next users refresh
+    json_repository.update_user(user("u2"))
+    # changes to imported users are the database's, not the JSON file's
+    json_repository.update_user(user("u1"))
+    assert sqlite_repository.migrate_from_json() == 1
+
+    assert [u.goodreads_id for u in sqlite_repository.list_users()] == ["u1", "u2"]
+    assert [b.title for b in sqlite_repository.get_sent_books(user("u1"))] == ["First"]
+
+
+def test_users_listed_without_their_ledger(sqlite_repository):
+    sent = book("Sent", "9780000000002")
+    sqlite_repository.update_user(user("u1"))
+    sqlite_repository.mark_book_sent(user("u1"), sent, original_bytes=10, sent_bytes=5)
+
+    [listed] = sqlite_repository.list_users()
+    assert listed.books_sent_to_kindle == []
+    assert sqlite_repository.was_book_sent(listed, sent)
+    assert not sqlite_repository.was_book_sent(listed, book("Other"))
+    assert sqlite_repository.get_sent_books(listed) == [sent]
+
+
+def test_connection_shared_by_threads(sqlite_repository):
+    sqlite_repository.update_user(user("u1"))
+    errors = []
+
+    def send(start: int):
+        try:
+            for i in range(start, start + 50):
+                b = book(f"Book {i}")
+                sqlite_repository.mark_book_sent(user("u1"), b)
+                assert sqlite_repository.was_book_sent(user("u1"), b)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=send, args=(i * 50,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(sqlite_repository.get_sent_books(user("u1"))) == 200
+
+
+OLD_SCHEMA = """
+CREATE TABLE users (goodreads_id TEXT PRIMARY KEY, kindle_email TEXT NOT NULL);
+CREATE TABLE books (id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, book TEXT NOT NULL);
+CREATE TABLE sends (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL REFERENCES users (goodreads_id),
+    book_id INTEGER NOT NULL REFERENCES books (id),
+    sent_at REAL NOT NULL,
+    UNIQUE (user_id, book_id)
+);
+CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def test_database_of_older_keys_rekeyed(tmp_path):
+    # two editions of the same book, keyed by their fields before BookKey
+    isbn10 = book("Dune", authors=["Frank Herbert"])
+    isbn10.isbn = "0306406152"
+    isbn13 = book("Dune", "9780306406157", authors=["Frank Herbert"])
+    other = book("Emma", authors=["Jane Austen"])
+    with sqlite3.connect(tmp_path / SqliteRepository.DB_FILE) as connection:
+        connection.executescript(OLD_SCHEMA)
+        connection.executemany("INSERT INTO users VALUES (?, ?)", [("u1", "u1@kindle.com"), ("u2", "u2@kindle.com")])
+        for book_id, b in enumerate([isbn10, isbn13, other], 1):
+            connection.execute("INSERT INTO books VALUES (?, ?, ?)", (book_id, f"old-key-{book_id}", b.to_json()))
+        connection.executemany(
+            "INSERT INTO sends (user_id, book_id, sent_at) VALUES (?, ?, 0)", [("u1", 1), ("u1", 2), ("u2", 2), ("u2", 3)]
+        )
+    connection.close()
+
+    repository = SqliteRepository(workdir=tmp_path)
+    rows = repository.connection.execute("SELECT id, key, title_key FROM books ORDER BY id").fetchall()
+    assert rows == [
+        (1, "isbn13:9780306406157", str(BookKey.of_title(isbn10))),
+        (3, str(other.key()), str(other.key())),
+    ]
+    # the send of the merged book kept once per user
+    assert [b.title for b in repository.get_sent_books(user("u1"))] == ["Dune"]
+    assert [b.title for b in repository.get_sent_books(user("u2"))] == ["Dune", "Emma"]
+    # matched without the ISBN as well
+    assert repository.was_book_sent(user("u1"), book("dune", authors=["frank herbert"]))
+    repository.close()
+
+    # done once
+    reopened = SqliteRepository(workdir=tmp_path)
+    assert reopened.connection.execute("SELECT value FROM meta WHERE name = 'book_key'").fetchone() == (SqliteRepository.BOOK_KEY_VERSION,)
+    assert reopened.connection.execute("SELECT COUNT(*) FROM sends").fetchone() == (3,)
+    reopened.close()
@@ -0,0 +1,99 @@
+import zlib
+
+import pytest
+
+from goodreads_scraper.snapshot_log import FRAME_HEADER, INDEX_ENTRY, SnapshotLog
+
+
+def items(*book_ids: str) -> dict:
+    return {book_id: {"book_id": book_id, "title": f"Book {book_id}"} for book_id in book_ids}
+
+
+@pytest.fixture
+def log(tmp_path) -> SnapshotLog:
+    log = SnapshotLog(tmp_path / "u1_to-read.snapshots")
+    log.append(items("1", "2"))
+    log.append(items("1", "2", "3"))
+    return log
+
+
+def test_diff_reads_the_items_of_the_books_added_in_between(log):
+    log.append(items("2", "3", "4"))
+    log.append(items("5"), partial=True)
+
+    assert log.latest().book_ids == ["2", "3", "4", "5"]
+    diff = log.diff(0, -1)
+    assert diff.added == items("3", "4", "5")
+    assert diff.removed == {"1"}
+
+
+def test_every_book_of_a_single_snapshot_added(tmp_path):
+    log = SnapshotLog(tmp_path / "u1_to-read.snapshots")
+    assert log.diff().added == {}
+    log.append(items("1", "2"))
+    assert log.diff().added == items("1", "2")
+
+
+def test_torn_record_cut_off(log):
+    size = log.path.stat().st_size
+    with open(log.path, "ab") as file:
+        file.write(FRAME_HEADER.pack(100) + b"half a record")
+
+    repaired = SnapshotLog(log.path)
+    assert len(repaired) == 2
+    assert log.path.stat().st_size == size
+    repaired.append(items("4"))
+    assert repaired.read(-1).book_ids == ["4"]
+
+
+def test_corrupt_record_cut_off_with_everything_after_it(log):
+    _, offset, length = log._entry(-1)
+    with open(log.path, "r+b") as file:
+        file.seek(offset + FRAME_HEADER.size)
+        file.write(b"\x00" * length)
+        file.seek(0, 2)
+        # a good record after the corrupt one isn't trusted either
+        payload = zlib.compress(b'{"taken_at": 0, "book_ids": [], "added": {}}')
+        file.write(FRAME_HEADER.pack(len(payload)) + payload)
+    log.index_path.unlink()
+
+    repaired = SnapshotLog(log.path)
+    assert len(repaired) == 1
+    assert log.path.stat().st_size == offset
+    assert repaired.latest().book_ids == ["1", "2"]
+
+
+def test_lost_index_rebuilt_from_the_log(log):
+    entries = log.index_path.read_bytes()
+    log.index_path.unlink()
+
+    repaired = SnapshotLog(log.path)
+    assert log.index_path.read_bytes() == entries
+    assert repaired.diff().added == items("3")
+
+
+def test_index_entries_missing_or_torn_added_back(log):
+    entries = log.index_path.read_bytes()
+    # a crash after writing the record, and half its index entry
+    log.index_path.write_bytes(entries[:INDEX_ENTRY.size + 5])
+
+    assert len(SnapshotLog(log.path)) == 2
+    assert log.index_path.read_bytes() == entries
+
+
+def test_index_longer_than_the_log_rebuilt(log):
+    _, offset, _ = log._entry(-1)
+    with open(log.path, "r+b") as file:
+        file.truncate(offset)
+
+    repaired = SnapshotLog(log.path)
+    assert len(repaired) == 1
+    assert repaired.latest().book_ids == ["1", "2"]
+
+
+def test_index_without_a_log_removed(log):
+    log.path.unlink()
+
+    repaired = SnapshotLog(log.path)
+    assert len(repaired) == 0 and repaired.latest() is None
+    assert not log.index_path.exists()
@@ -0,0 +1,95 @@
+import pytest
+from scrapy.http import HtmlResponse, Request, XmlResponse
+from scrapy.utils.test import get_crawler
+
+from goodreads_scraper import settings as project_settings
+from goodreads_scraper.spiders.mybooks_spider import MyBooksSpider
+from goodreads_scraper.spiders.shelf_rss_spider import ShelfRssSpider, parse_rss_items
+
+SHELF_URL = "https://www.goodreads.com/review/list/1-user?shelf=to-read&sort=date_added&order=d"
+
+
+def shelf_page(book_ids, next_page: bool = True) -> HtmlResponse:
+    rows = "".join(
+        f'<tr><td class="field title"><div class="value"><a href="/book/show/{book_id}.Title">Title</a></div></td></tr>'
+        for book_id in book_ids
+    )
+    link = '<a class="next_page" href="/review/list/1-user?page=2">next</a>' if next_page else '<span class="next_page disabled">next</span>'
+    body = f'<table><tbody id="booksBody">{rows}</tbody></table>{link}'
+    return HtmlResponse(url=SHELF_URL, body=body.encode(), encoding="utf-8", request=Request(SHELF_URL))
+
+
+def spider(**incremental) -> MyBooksSpider:
+    return MyBooksSpider("1-user", "to-read", **incremental)
+
+
+@pytest.mark.parametrize("incremental, book_ids, last", [
+    # every book known
+    (dict(known_book_ids={"1", "2", "3"}), ["3", "2"], True),
+    # a book added since
+    (dict(known_book_ids={"1", "2"}), ["3", "2"], False),
+    # the newest book of the last crawl is on the page
+    (dict(high_water_mark="2"), ["4", "3", "2"], True),
+    (dict(high_water_mark="2", known_book_ids={"3"}), ["5", "4"], False),
+    # nothing known, e.g. the first crawl of a shelf
+    (dict(known_book_ids=set()), ["1"], False),
+    (dict(known_book_ids={"1"}), [], False),
+])
+def test_is_last_new_page(incremental, book_ids, last):
+    assert spider(**incremental)._is_last_new_page(book_ids) is last
+
+
+def test_incremental_crawl_stops_after_the_last_new_page():
+    mybooks = spider(known_book_ids={"1", "2"})
+    requests = list(mybooks.parse(shelf_page(["2", "1"])))
+
+    assert [request.url for request in requests] == [
+        "https://www.goodreads.com/book/show/2.Title",
+        "https://www.goodreads.com/book/show/1.Title",
+    ]
+    assert mybooks.stopped_early
+    assert mybooks.newest_book_id == "2"
+
+
+def test_full_crawl_follows_every_page():
+    mybooks = spider()
+    assert not mybooks.incremental
+    requests = list(mybooks.parse(shelf_page(["2", "1"])))
+
+    assert requests[-1].url == "https://www.goodreads.com/review/list/1-user?page=2"
+    assert not mybooks.stopped_early
+
+
+FEED_URL = "https://www.goodreads.com/review/list_rss/1-user?shelf=to-read"
+
+
+def feed(*entries: dict) -> XmlResponse:
+    items = "".join(
+        "<item>" + "".join(f"<{tag}><![CDATA[{value}]]></{tag}>" for tag, value in entry.items()) + "</item>"
+        for entry in entries
+    )
+    body = f'<?xml version="1.0"?><rss version="2.0"><channel><title>to-read</title>{items}</channel></rss>'
+    return XmlResponse(url=FEED_URL, body=body.encode(), encoding="utf-8", request=Request(FEED_URL))
+
+
+def test_parse_rss_items_in_small_chunks():
+    body = feed(*({"book_id": str(i), "title": f"Book {i}"} for i in range(50))).body
+    entries = list(parse_rss_items(body[start:start + 7] for start in range(0, len(body), 7)))
+    assert entries == [{"book_id": str(i), "title": f"Book {i}"} for i in range(50)]
+
+
+def test_rss_book_without_isbn_completed_from_its_page():
+    crawler = get_crawler(settings_dict={"SHELF_RSS_REQUIRED_FIELDS": project_settings.SHELF_RSS_REQUIRED_FIELDS})
+    rss = ShelfRssSpider.from_crawler(crawler, "1-user", "to-read", item_scraped_callback=lambda item: None)
+    results = list(rss.parse(feed(
+        {"book_id": "1", "title": "Dune", "author_name": "Frank  Herbert", "isbn": "0441172717"},
+        # co-written, the feed only names the first author
+        {"book_id": "2", "title": "Good Omens", "author_name": "Terry Pratchett", "isbn": ""},
+    )))
+
+    [item, request] = results[:2]
+    assert dict(item) == {"book_id": "1", "title": "Dune", "author": ["Frank Herbert"], "isbn": "0441172717"}
+    assert "language" not in item
+    assert request.url == "https://www.goodreads.com/book/show/2"
+    assert request.cb_kwargs == {"book_id": "2"}
+    assert crawler.stats.get_value("shelf/book_page_fallbacks") == 1